@@ -0,0 +1,159 @@
+"""Caché persistente de respuestas del modelo (creador de rutinas IA).
+
+La clave es el SHA-256 de (modelo, temperatura, system prompt, prompt). Como
+build_prompt solo usa los datos ya normalizados por analyze_user_data, dos
+peticiones que se normalizan igual comparten entrada y no vuelven a llamar al
+modelo.
+
+Cada entrada es un JSON en usuarios_data/ai_cache/<2 hex>/<sha256>.json.
+- TTL: VITALPEAK_AI_CACHE_TTL (segundos, por defecto 7 días).
+- Tamaño máximo: VITALPEAK_AI_CACHE_MAX_MB (por defecto 50); al superarlo se
+  borran las entradas usadas hace más tiempo (mtime, que se actualiza en cada acierto).
+- VITALPEAK_AI_CACHE=0 la desactiva.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_TTL_S = 7 * 24 * 3600
+DEFAULT_MAX_MB = 50.0
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def cache_dir() -> Path:
+    return Path(os.getenv("VITALPEAK_AI_CACHE_DIR") or "usuarios_data/ai_cache")
+
+
+def cache_enabled() -> bool:
+    return (os.getenv("VITALPEAK_AI_CACHE") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _ttl_s() -> float:
+    try:
+        return float(os.getenv("VITALPEAK_AI_CACHE_TTL") or DEFAULT_TTL_S)
+    except ValueError:
+        return float(DEFAULT_TTL_S)
+
+
+def _max_bytes() -> int:
+    try:
+        mb = float(os.getenv("VITALPEAK_AI_CACHE_MAX_MB") or DEFAULT_MAX_MB)
+    except ValueError:
+        mb = DEFAULT_MAX_MB
+    return int(mb * 1024 * 1024)
+
+
+def cache_key(model: str, system: str, prompt: str, *, temperature: float = 0.0) -> str:
+    """Hash de contenido de la petición (independiente del proveedor/base_url)."""
+    h = hashlib.sha256()
+    for part in (model, f"{float(temperature):.3f}", system, prompt):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def _entry_path(key: str) -> Path:
+    return cache_dir() / key[:2] / f"{key}.json"
+
+
+def get_cached(key: str) -> Optional[str]:
+    """Respuesta guardada para `key`, o None si no existe o ha caducado."""
+    if not cache_enabled():
+        return None
+    p = _entry_path(key)
+    try:
+        entry = json.loads(p.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        _stats["misses"] += 1
+        return None
+    created = entry.get("created") if isinstance(entry, dict) else None
+    if not isinstance(created, (int, float)) or time.time() - created > _ttl_s():
+        try:
+            p.unlink()
+        except OSError:
+            pass
+        _stats["misses"] += 1
+        return None
+    try:
+        os.utime(p, None)  # marca de uso para la expulsión LRU
+    except OSError:
+        pass
+    _stats["hits"] += 1
+    return entry.get("response")
+
+
+def put_cached(key: str, response: str, *, model: str = "") -> None:
+    """Guarda la respuesta (escritura atómica) y aplica el límite de tamaño."""
+    if not cache_enabled() or not response:
+        return
+    p = _entry_path(key)
+    payload = {"created": time.time(), "model": model, "response": response}
+    try:
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(p.name + f".tmp.{os.getpid()}.{threading.get_ident()}")
+        tmp.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, p)
+    except OSError:
+        # Es una caché: si no se puede escribir, simplemente no se guarda
+        return
+    _stats["stores"] += 1
+    evict()
+
+
+def _entries() -> List[Tuple[float, int, Path]]:
+    out: List[Tuple[float, int, Path]] = []
+    root = cache_dir()
+    if not root.exists():
+        return out
+    for p in root.glob("*/*.json"):
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        out.append((st.st_mtime, st.st_size, p))
+    return out
+
+
+def evict(max_bytes: Optional[int] = None) -> int:
+    """Borra caducadas y, si se supera el tamaño, las menos usadas. Devuelve cuántas borró."""
+    limit = _max_bytes() if max_bytes is None else max_bytes
+    ttl = _ttl_s()
+    now = time.time()
+    removed = 0
+    with _lock:
+        entries = sorted(_entries())
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, p in entries:
+            # mtime >= created, así que si el último uso supera el TTL la entrada también
+            if total <= limit and now - mtime <= ttl:
+                continue
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+    _stats["evictions"] += removed
+    return removed
+
+
+def clear_cache() -> None:
+    for _, _, p in _entries():
+        try:
+            p.unlink()
+        except OSError:
+            pass
+
+
+def cache_stats() -> Dict[str, Any]:
+    entries = _entries()
+    return dict(_stats, entries=len(entries), bytes=sum(size for _, size, _ in entries))
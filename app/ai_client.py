@@ -0,0 +1,294 @@
+"""Cliente IA compartido (OpenAI Cloud u Ollama /v1) para todo el proceso.
+
+- Un cliente síncrono y uno asíncrono por configuración (y por event loop en
+  el caso async), con pool de conexiones keep-alive: no se abre una conexión
+  nueva en cada generación.
+- Timeout explícito, reintentos con backoff exponencial + jitter ante 429,
+  5xx, timeouts y errores de conexión (los reintentos del SDK se desactivan
+  para que la política sea una sola).
+- Límite de peticiones simultáneas al modelo por proceso (Ollama sirve pocas
+  a la vez; el resto espera en cola en vez de saturarlo).
+
+Configuración (env / .env / st.secrets vía config.load_env):
+    VITALPEAK_AI_TIMEOUT=120        segundos por petición
+    VITALPEAK_AI_MAX_RETRIES=3
+    VITALPEAK_AI_BACKOFF=1.0        segundos base del backoff
+    VITALPEAK_AI_CONCURRENCY=2      peticiones simultáneas al modelo
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Tuple, TypeVar
+
+from . import ai_trace
+
+try:
+    from openai import AsyncOpenAI, OpenAI
+except Exception:
+    AsyncOpenAI = None  # type: ignore
+    OpenAI = None  # type: ignore
+
+try:
+    import httpx
+except Exception:
+    httpx = None  # type: ignore
+
+T = TypeVar("T")
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRY_ERRORS = ("APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError", "ConnectError", "ReadTimeout", "ConnectTimeout")
+MAX_BACKOFF_S = 30.0
+
+_lock = threading.Lock()
+_sync_clients: Dict[Tuple, Any] = {}
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, Any]]" = weakref.WeakKeyDictionary()
+_slots: Dict[int, threading.BoundedSemaphore] = {}
+_async_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[int, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def ai_settings() -> Dict[str, Any]:
+    """Configuración efectiva (se relee en cada llamada para respetar cambios de .env/secrets)."""
+    return {
+        "api_key": os.getenv("OPENAI_API_KEY") or "ollama",
+        "base_url": (os.getenv("OPENAI_BASE_URL") or os.getenv("OPENAI_API_BASE") or "").strip() or None,
+        "timeout": _env_float("VITALPEAK_AI_TIMEOUT", 120.0),
+        "max_retries": max(0, int(_env_float("VITALPEAK_AI_MAX_RETRIES", 3))),
+        "backoff": max(0.0, _env_float("VITALPEAK_AI_BACKOFF", 1.0)),
+        "concurrency": max(1, int(_env_float("VITALPEAK_AI_CONCURRENCY", 2))),
+    }
+
+
+def _client_key(cfg: Dict[str, Any]) -> Tuple:
+    return (cfg["api_key"], cfg["base_url"], cfg["timeout"], cfg["concurrency"])
+
+
+def _client_kwargs(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    kw: Dict[str, Any] = {"api_key": cfg["api_key"], "timeout": cfg["timeout"], "max_retries": 0}
+    if cfg["base_url"]:
+        kw["base_url"] = cfg["base_url"]
+    return kw
+
+
+def _limits(cfg: Dict[str, Any]):
+    n = cfg["concurrency"] * 2
+    return httpx.Limits(max_connections=n, max_keepalive_connections=n, keepalive_expiry=60.0)
+
+
+def get_client():
+    """Cliente síncrono compartido; sin el SDK nuevo, el módulo `openai` legado."""
+    cfg = ai_settings()
+    if OpenAI is None:
+        import openai as _openai
+
+        _openai.api_key = cfg["api_key"]
+        if cfg["base_url"]:
+            try:
+                _openai.base_url = cfg["base_url"]
+            except Exception:
+                pass
+        return _openai
+    key = _client_key(cfg)
+    with _lock:
+        client = _sync_clients.get(key)
+        if client is None:
+            kw = _client_kwargs(cfg)
+            if httpx is not None:
+                kw["http_client"] = httpx.Client(limits=_limits(cfg), timeout=cfg["timeout"])
+            client = _sync_clients[key] = OpenAI(**kw)
+    return client
+
+
+def get_async_client():
+    """Cliente asíncrono compartido para el event loop actual."""
+    if AsyncOpenAI is None:
+        raise RuntimeError("El paquete 'openai' (>=1.0) es necesario para el cliente asíncrono.")
+    cfg = ai_settings()
+    loop = asyncio.get_running_loop()
+    key = _client_key(cfg)
+    with _lock:
+        per_loop = _async_clients.setdefault(loop, {})
+        client = per_loop.get(key)
+        if client is None:
+            kw = _client_kwargs(cfg)
+            if httpx is not None:
+                kw["http_client"] = httpx.AsyncClient(limits=_limits(cfg), timeout=cfg["timeout"])
+            client = per_loop[key] = AsyncOpenAI(**kw)
+    return client
+
+
+def _close_async_clients(loop: asyncio.AbstractEventLoop, clients: list) -> None:
+    """Cierra clientes async en su propio loop (sin esperar si el loop está en marcha)."""
+    if not clients or loop.is_closed():
+        return
+
+    async def _close() -> None:
+        for c in clients:
+            try:
+                await c.close()
+            except Exception:
+                pass
+
+    try:
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(_close(), loop)
+        else:
+            loop.run_until_complete(_close())
+    except Exception:
+        pass
+
+
+def reset_clients() -> None:
+    """Descarta y cierra los clientes cacheados (p. ej. tras cambiar la API key o la URL)."""
+    with _lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+        async_clients = [(loop, list(per_loop.values())) for loop, per_loop in _async_clients.items()]
+        _async_clients.clear()
+    for c in clients:
+        try:
+            c.close()
+        except Exception:
+            pass
+    for loop, per_loop in async_clients:
+        _close_async_clients(loop, per_loop)
+
+
+@contextmanager
+def model_slot() -> Iterator[None]:
+    """Reserva uno de los VITALPEAK_AI_CONCURRENCY huecos de petición al modelo."""
+    n = ai_settings()["concurrency"]
+    with _lock:
+        sem = _slots.setdefault(n, threading.BoundedSemaphore(n))
+    with sem:
+        yield
+
+
+@asynccontextmanager
+async def model_slot_async():
+    n = ai_settings()["concurrency"]
+    loop = asyncio.get_running_loop()
+    with _lock:
+        sem = _async_slots.setdefault(loop, {}).setdefault(n, asyncio.Semaphore(n))
+    async with sem:
+        yield
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """429/5xx, timeouts y errores de conexión; los 4xx de petición no se reintentan."""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in RETRY_STATUS
+    return type(exc).__name__ in _RETRY_ERRORS or isinstance(exc, (TimeoutError, ConnectionError))
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, exc: Optional[BaseException] = None, *, base: Optional[float] = None) -> float:
+    """Espera antes del reintento `attempt` (0-based): base·2^attempt con jitter, o Retry-After."""
+    hinted = _retry_after(exc) if exc is not None else None
+    if hinted is not None:
+        return min(MAX_BACKOFF_S, hinted)
+    base = ai_settings()["backoff"] if base is None else base
+    return min(MAX_BACKOFF_S, base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+
+def retry_call(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Ejecuta `fn` reintentando errores transitorios (sin reservar hueco de concurrencia)."""
+    retries = ai_settings()["max_retries"]
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            ai_trace.count("retries")
+            time.sleep(backoff_delay(attempt, e))
+            attempt += 1
+
+
+def with_retries(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Como retry_call, pero cada intento ocupa un hueco de concurrencia (no se retiene durante el backoff)."""
+    retries = ai_settings()["max_retries"]
+    attempt = 0
+    while True:
+        try:
+            with model_slot():
+                return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            ai_trace.count("retries")
+            time.sleep(backoff_delay(attempt, e))
+            attempt += 1
+
+
+async def with_retries_async(fn: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+    retries = ai_settings()["max_retries"]
+    attempt = 0
+    while True:
+        try:
+            async with model_slot_async():
+                return await fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            ai_trace.count("retries")
+            await asyncio.sleep(backoff_delay(attempt, e))
+            attempt += 1
+
+
+async def chat_completion_async(messages, *, model: str, temperature: float = 0.1, **extra: Any) -> str:
+    """Petición de chat asíncrona (cliente compartido + reintentos + límite de concurrencia)."""
+    client = get_async_client()
+    resp = await with_retries_async(
+        client.chat.completions.create, model=model, temperature=temperature, messages=messages, **extra
+    )
+    ai_trace.record_usage(getattr(resp, "usage", None))
+    return resp.choices[0].message.content
+
+
+_bg_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Event loop propio en un hilo daemon: el cliente async y su pool sobreviven entre llamadas."""
+    global _bg_loop
+    with _lock:
+        if _bg_loop is None or _bg_loop.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="ai-client-loop", daemon=True).start()
+            _bg_loop = loop
+        return _bg_loop
+
+
+def run_async(coro: Awaitable[T], *, timeout: Optional[float] = None) -> T:
+    """Ejecuta una corrutina en el loop de fondo desde código síncrono (con o sin loop propio)."""
+    fut = asyncio.run_coroutine_threadsafe(coro, _background_loop())
+    try:
+        return fut.result(timeout)
+    except BaseException:
+        fut.cancel()
+        raise
@@ -1,16 +1,31 @@
 from __future__ import annotations
-__all__ = ["call_gpt", "build_prompt", "build_system"]
-try:
-    from openai import OpenAI
-except Exception:
-    OpenAI = None  # fallback to legacy openai package
-
+__all__ = ["call_gpt", "call_gpt_async", "build_prompt", "build_system"]
 
+import asyncio
+import contextvars
 import os
 import re
 import json
-from typing import Any, Dict, List, Optional
-from openai import OpenAI
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from . import ai_trace
+from .ai_cache import cache_key, get_cached, put_cached
+from .ai_client import chat_completion_async, get_client, model_slot, retry_call, run_async, with_retries
+from .plan_features import (
+    CATEGORIES,
+    CORE_PREFIX,
+    DayFeatures,
+    compile_keywords,
+    day_features,
+    day_has_core,
+    day_is_lower,
+    features_of,
+    keyword_matcher,
+    plan_features,
+)
+from .plan_stream import IncrementalDaysParser, iter_plan_days
+from .prompt_budget import PromptSection, canonical, compact_enabled, estimate_tokens, render, section_report
 
 JSON_MD_RE = re.compile(r"```json\s*(\{[\s\S]*?\})\s*```", re.IGNORECASE)
 JSON_BLOCK_RE = re.compile(r"\{[\s\S]*\}", re.MULTILINE)
@@ -693,12 +708,38 @@ def analyze_user_data(datos: Dict[str, Any]) -> Dict[str, Any]:
 
 
 
-def build_prompt(datos: Dict[str, Any]) -> str:
-    """Construye el prompt para la IA.
+SCHEMA_HINT = '''
+ESQUEMA JSON (obligatorio):
+{
+  "meta": {"nivel": "principiante|intermedio|avanzado", "dias": N, "duracion_min": N, "objetivo": "fuerza|hipertrofia|resistencia|mixto"},
+  "dias": [
+    {"nombre": "Lunes", "ejercicios": [
+      {"nombre": "...", "series": 3, "reps": "8-12", "intensidad": "RIR 1-2", "descanso": "60-90s"}
+    ], "notas": "..."}
+  ],
+  "progresion": {"principales": "...", "accesorios": "...", "deload_semana": N}
+}
+'''
 
-    Importante: aquí solo ensamblamos texto. La lógica/derivaciones están en analyze_user_data().
+# Mismo esquema en una línea (forma compacta)
+SCHEMA_HINT_COMPACT = (
+    "ESQUEMA JSON (obligatorio):\n"
+    '{"meta":{"nivel":"principiante|intermedio|avanzado","dias":N,"duracion_min":N,"objetivo":"fuerza|hipertrofia|resistencia|mixto"},'
+    '"dias":[{"nombre":"Lunes","ejercicios":[{"nombre":"...","series":3,"reps":"8-12","intensidad":"RIR 1-2","descanso":"60-90s"}],"notas":"..."}],'
+    '"progresion":{"principales":"...","accesorios":"...","deload_semana":N}}'
+)
+
+
+def build_prompt_sections(
+    datos: Dict[str, Any], A: Optional[Dict[str, Any]] = None, *, compact: bool = True
+) -> List[PromptSection]:
+    """Secciones del prompt. Con compact=False, unidas tal cual dan el prompt detallado original.
+
+    La forma compacta omite lo que ya dicen otras partes: CONTEXTO (= system),
+    DATOS NORMALIZADOS (= checklist de restricciones), SALIDA (= primera regla
+    general) y las reglas de split que ya están en la checklist.
     """
-    A = analyze_user_data(datos)
+    A = A or analyze_user_data(datos)
     nl = chr(10)
 
     ia_detalles = (datos.get("ia_detalles") or "").strip()
@@ -719,14 +760,20 @@ def build_prompt(datos: Dict[str, Any]) -> str:
 
     split_rules = ""
     if A.get("split_pref"):
-        split_rules += "REGLAS DE SPLIT (OBLIGATORIO):" + nl
-        if A.get("split_template"):
-            # Se exige el orden, y que se refleje en el nombre del día para que la app lo valide.
-            split_rules += f"- Usa este orden exacto de sesiones: {A['split_template']}." + nl
-            split_rules += "- El campo 'nombre' de cada día debe ser: '<DíaSemana> - <Sesión>' (ej: 'Lunes - Push A')." + nl
+        if compact:
+            # Split y orden ya van en la checklist; solo falta el formato del nombre
+            if A.get("split_template"):
+                split_rules = "REGLAS DE SPLIT (OBLIGATORIO):" + nl
+                split_rules += "- El campo 'nombre' de cada día debe ser: '<DíaSemana> - <Sesión>' (ej: 'Lunes - Push A')." + nl
         else:
-            split_rules += f"- Split preferido: {A['split_pref']}. Respétalo." + nl
-        split_rules += nl
+            split_rules += "REGLAS DE SPLIT (OBLIGATORIO):" + nl
+            if A.get("split_template"):
+                # Se exige el orden, y que se refleje en el nombre del día para que la app lo valide.
+                split_rules += f"- Usa este orden exacto de sesiones: {A['split_template']}." + nl
+                split_rules += "- El campo 'nombre' de cada día debe ser: '<DíaSemana> - <Sesión>' (ej: 'Lunes - Push A')." + nl
+            else:
+                split_rules += f"- Split preferido: {A['split_pref']}. Respétalo." + nl
+            split_rules += nl
 
     restricciones_txt = nl.join(A["restricciones"])
 
@@ -742,68 +789,243 @@ def build_prompt(datos: Dict[str, Any]) -> str:
             "<<<" + nl + notas + nl + ">>>" + nl
         )
 
+    if compact:
+        # Con salida estructurada el servidor ya recibe el esquema: la pista es prescindible
+        return [
+            PromptSection("reglas_generales", reglas_generales),
+            PromptSection("split", split_rules),
+            PromptSection("reglas_objetivo", A["reglas_objetivo"]),
+            PromptSection("restricciones", "RESTRICCIONES Y CHECKLIST (OBLIGATORIO):" + nl + restricciones_txt),
+            PromptSection("detalles_usuario", detalles_usuario),
+            PromptSection("esquema", SCHEMA_HINT_COMPACT, optional=_structured_enabled()),
+        ]
+
     # Importante: el schema usa 'duracion_min' y 'objetivo' en {fuerza|hipertrofia|resistencia|mixto}
-    schema_hint = '''
-ESQUEMA JSON (obligatorio):
-{
-  "meta": {"nivel": "principiante|intermedio|avanzado", "dias": N, "duracion_min": N, "objetivo": "fuerza|hipertrofia|resistencia|mixto"},
-  "dias": [
-    {"nombre": "Lunes", "ejercicios": [
-      {"nombre": "...", "series": 3, "reps": "8-12", "intensidad": "RIR 1-2", "descanso": "60-90s"}
-    ], "notas": "..."}
-  ],
-  "progresion": {"principales": "...", "accesorios": "...", "deload_semana": N}
-}
-'''
+    return [
+        PromptSection(
+            "contexto",
+            "CONTEXTO:" + nl +
+            "Eres un entrenador personal experto. Diseña un plan que cumpla las restricciones del usuario y el objetivo." + nl + nl,
+        ),
+        PromptSection(
+            "datos",
+            "DATOS NORMALIZADOS:" + nl +
+            f"- Objetivo: {A['objetivo']}" + nl +
+            f"- Nivel: {A['nivel']}" + nl +
+            f"- Días/semana: {A['dias']}" + nl +
+            f"- Duración: {A['duracion']} min" + nl +
+            f"- Días exactos: {A['disponibilidad']}" + nl + nl,
+        ),
+        PromptSection("reglas_generales", reglas_generales + nl),
+        PromptSection("split", split_rules),
+        PromptSection("reglas_objetivo", "REGLAS POR OBJETIVO:" + nl + A["reglas_objetivo"] + nl),
+        PromptSection("restricciones", "RESTRICCIONES Y CHECKLIST (OBLIGATORIO):" + nl + restricciones_txt + nl),
+        PromptSection("detalles_usuario", detalles_usuario + nl),
+        PromptSection("esquema", SCHEMA_HINT + nl),
+        PromptSection("salida", "SALIDA: devuelve SOLO JSON válido." + nl),
+    ]
+
+
+def build_prompt(datos: Dict[str, Any], *, compact: Optional[bool] = None) -> str:
+    """Construye el prompt para la IA.
+
+    Importante: aquí solo ensamblamos texto. La lógica/derivaciones están en analyze_user_data().
+    Por defecto se usa la forma compacta (VITALPEAK_AI_PROMPT_COMPACT=0 vuelve a la detallada).
+    """
+    compact = compact_enabled() if compact is None else compact
+    sections = build_prompt_sections(datos, compact=compact)
+    return canonical(sections) if compact else render(sections, compact=False)
+
+
+def prompt_report(datos: Dict[str, Any], *, compact: Optional[bool] = None) -> Dict[str, Any]:
+    """Tokens por sección y total del prompt (ver prompt_budget.section_report)."""
+    compact = compact_enabled() if compact is None else compact
+    return section_report(build_prompt_sections(datos, compact=compact), compact=compact)
 
-    prompt = (
-        "CONTEXTO:" + nl +
-        "Eres un entrenador personal experto. Diseña un plan que cumpla las restricciones del usuario y el objetivo." + nl + nl +
-        "DATOS NORMALIZADOS:" + nl +
-        f"- Objetivo: {A['objetivo']}" + nl +
-        f"- Nivel: {A['nivel']}" + nl +
-        f"- Días/semana: {A['dias']}" + nl +
-        f"- Duración: {A['duracion']} min" + nl +
-        f"- Días exactos: {A['disponibilidad']}" + nl + nl +
-        reglas_generales + nl +
-        split_rules +
-        "REGLAS POR OBJETIVO:" + nl + A['reglas_objetivo'] + nl +
-        "RESTRICCIONES Y CHECKLIST (OBLIGATORIO):" + nl + restricciones_txt + nl +
-        detalles_usuario + nl +
-        schema_hint + nl +
-        "SALIDA: devuelve SOLO JSON válido." + nl
-    )
 
-    return prompt
 def _client():
-    """Cliente compatible con OpenAI Cloud y Ollama local (API /v1)."""
-    api_key = os.getenv("OPENAI_API_KEY") or "ollama"
-    base_url = (os.getenv("OPENAI_BASE_URL") or os.getenv("OPENAI_API_BASE") or "").strip() or None
-    if OpenAI is not None:
-        if base_url:
-            return OpenAI(api_key=api_key, base_url=base_url)
-        return OpenAI(api_key=api_key)
-    import openai as _openai
-    _openai.api_key = api_key
-    if base_url:
+    """Cliente compatible con OpenAI Cloud y Ollama local (API /v1), compartido por el proceso (ai_client)."""
+    return get_client()
+
+
+# --- Salida estructurada (JSON Schema de schema_rutina como response_format) ---
+# OpenAI: structured outputs; Ollama (/v1, >=0.5): se traduce a su parámetro `format`.
+# Si el servidor rechaza response_format se recuerda por (base_url, modelo) y se
+# vuelve al modo libre + parser tolerante (_try_parse_json).
+_NO_STRUCTURED: set = set()
+
+
+def _structured_enabled() -> bool:
+    return (os.getenv("VITALPEAK_AI_STRUCTURED") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _structured_target() -> tuple:
+    return ((os.getenv("OPENAI_BASE_URL") or os.getenv("OPENAI_API_BASE") or "").strip(), _get_model())
+
+
+def _plan_schema(dias: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    try:
+        from .schema_rutina import rutina_json_schema
+        return rutina_json_schema(dias)
+    except Exception:
+        return None
+
+
+def _day_schema() -> Optional[Dict[str, Any]]:
+    try:
+        from .schema_rutina import dia_json_schema
+        return dia_json_schema()
+    except Exception:
+        return None
+
+
+def _structured_kwargs(schema: Optional[Dict[str, Any]], name: str = "rutina") -> Dict[str, Any]:
+    if schema is None or not _structured_enabled() or _structured_target() in _NO_STRUCTURED:
+        return {}
+    return {"response_format": {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}}
+
+
+def _rejects_structured(e: BaseException) -> bool:
+    """Error 4xx del servidor por no soportar response_format/json_schema."""
+    status = getattr(e, "status_code", None)
+    msg = str(e).lower()
+    return status in (400, 404, 422) and any(t in msg for t in ("response_format", "json_schema", "schema", "format"))
+
+
+def _create_completion(call: Callable[..., Any], client, *, schema: Optional[Dict[str, Any]], schema_name: str, **kw: Any) -> Any:
+    """client.chat.completions.create con salida estructurada si se puede; si la rechazan, sin ella."""
+    extra = _structured_kwargs(schema, schema_name)
+    if extra:
         try:
-            _openai.base_url = base_url
+            return call(client.chat.completions.create, **kw, **extra)
+        except Exception as e:
+            if not _rejects_structured(e):
+                raise
+            _NO_STRUCTURED.add(_structured_target())
+            ai_trace.count("structured_fallbacks")
+    return call(client.chat.completions.create, **kw)
+
+
+def _chat(
+    client,
+    prompt: str,
+    *,
+    temperature: float = 0.1,
+    use_cache: bool = True,
+    schema: Optional[Dict[str, Any]] = None,
+    schema_name: str = "rutina",
+) -> str:
+    model = _get_model()
+    system = build_system()
+    key = cache_key(model, system, prompt, temperature=temperature)
+    if use_cache:
+        cached = get_cached(key)
+        if cached:
+            ai_trace.count("cache_hits")
+            return cached
+    with ai_trace.stage("model"):
+        resp = _create_completion(
+            with_retries,
+            client,
+            schema=schema,
+            schema_name=schema_name,
+            model=model,
+            temperature=temperature,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt},
+            ],
+        )
+    ai_trace.count("model_calls")
+    ai_trace.record_usage(getattr(resp, "usage", None))
+    content = resp.choices[0].message.content
+    # Se guarda aunque se haya saltado la lectura (refresca la entrada), pero
+    # solo si es parseable: un JSON roto no debe servirse de nuevo
+    if content:
+        try:
+            _try_parse_json(content)
         except Exception:
             pass
-    return _openai
+        else:
+            put_cached(key, content, model=model)
+    return content
+
+def _chat_stream(
+    client,
+    prompt: str,
+    *,
+    temperature: float = 0.1,
+    use_cache: bool = True,
+    schema: Optional[Dict[str, Any]] = None,
+    schema_name: str = "rutina",
+) -> Iterator[str]:
+    """Como _chat, pero va devolviendo los tokens según llegan (stream=True).
+
+    Un acierto de caché se devuelve como un único fragmento.
+    """
+    model = _get_model()
+    system = build_system()
+    key = cache_key(model, system, prompt, temperature=temperature)
+    if use_cache:
+        cached = get_cached(key)
+        if cached:
+            ai_trace.count("cache_hits")
+            yield cached
+            return
+    parts: List[str] = []
+    t0 = time.perf_counter()
+    # El hueco de concurrencia se mantiene mientras dura el stream; solo se
+    # reintenta la apertura (una vez emitidos tokens no se puede repetir)
+    with model_slot():
+        stream = _create_completion(
+            retry_call,
+            client,
+            schema=schema,
+            schema_name=schema_name,
+            model=model,
+            temperature=temperature,
+            stream=True,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt},
+            ],
+        )
+        for chunk in stream:
+            choices = getattr(chunk, "choices", None) or []
+            if not choices:
+                continue
+            delta = getattr(choices[0], "delta", None)
+            tok = getattr(delta, "content", None) if delta is not None else None
+            if tok:
+                parts.append(tok)
+                yield tok
+    content = "".join(parts)
+    # Incluye lo que tarda el consumidor entre tokens (vista previa); sin usage en streaming
+    trace = ai_trace.current()
+    if trace is not None:
+        trace.add_time("model", time.perf_counter() - t0)
+        trace.count("model_calls")
+        ai_trace.record_estimated_tokens(estimate_tokens(system) + estimate_tokens(prompt), estimate_tokens(content))
+    if content:
+        try:
+            _try_parse_json(content)
+        except Exception:
+            pass
+        else:
+            put_cached(key, content, model=model)
 
 
-def _chat(client, prompt: str, *, temperature: float = 0.1) -> str:
-    model = _get_model()
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=temperature,
-        messages=[
-            {"role": "system", "content": build_system()},
-            {"role": "user", "content": prompt},
-        ],
-    )
-    return resp.choices[0].message.content
+def _chat_progressive(client, prompt: str, on_day: Callable[[Dict[str, Any]], None], **kw) -> str:
+    """Consume _chat_stream llamando a `on_day` con cada día de `dias` en cuanto se cierra."""
+    parser = IncrementalDaysParser()
+    for day in iter_plan_days(_chat_stream(client, prompt, **kw), parser):
+        try:
+            on_day(day)
+        except Exception:
+            # Un fallo al pintar no debe abortar la generación
+            pass
+    return parser.text
+
 
 def _try_parse_json(text: str) -> Dict[str, Any]:
     """Intenta parsear JSON tolerante a respuestas con texto adicional o fences."""
@@ -837,29 +1059,24 @@ MUSCLES_SYNONYMS = {
 def _norm(x: str) -> str:
     return (x or "").lower()
 
+_GROUP_MATCHERS = {k: compile_keywords(v) for k, v in MUSCLES_SYNONYMS.items()}
+
+def _group_matcher(group_key: str):
+    rx = _GROUP_MATCHERS.get(group_key)
+    return rx if rx is not None else keyword_matcher((group_key,))
+
 def _day_has_group(d: dict, group_key: str) -> bool:
-    keys = MUSCLES_SYNONYMS.get(group_key, [group_key])
-    name = _norm(d.get("nombre",""))
-    if any(k in name for k in keys):
+    rx = _group_matcher(group_key)
+    if rx.search(features_of(d).norm):
         return True
-    for ej in d.get("ejercicios", []):
-        n = _norm(ej.get("nombre",""))
-        if any(k in n for k in keys):
-            return True
-    return False
+    return any(rx.search(features_of(ej).norm) for ej in d.get("ejercicios", []))
 
 def _count_days_for_group(plan: dict, group_key: str) -> int:
     return sum(1 for d in plan.get("dias", []) if _day_has_group(d, group_key))
 
 def _count_exercises_for_group(plan: dict, group_key: str) -> int:
-    keys = MUSCLES_SYNONYMS.get(group_key, [group_key])
-    c = 0
-    for d in plan.get("dias", []):
-        for ej in d.get("ejercicios", []):
-            n = _norm(ej.get("nombre",""))
-            if any(k in n for k in keys):
-                c += 1
-    return c
+    rx = _group_matcher(group_key)
+    return sum(1 for d in plan.get("dias", []) for ej in d.get("ejercicios", []) if rx.search(features_of(ej).norm))
 
 CARDIO_KEYWORDS = ["cardio","cinta","trote","correr","run","running","elíptica","eliptica","bicicleta","spinning","remo","erg","hiit","saltos","jumping jacks","burpees","saltar comba","comba","escaladora","stepper","air bike"]
 MACHINE_KEYWORDS = ["máquina","maquina","machine","prensa","polea","cable","smith","hack squat","pec deck","contractora","extensión de cuádriceps","extension de cuadriceps","curl femoral","jalón en polea","jalon en polea","cruce en polea","pulldown"]
@@ -867,8 +1084,7 @@ BARBELL_KEYWORDS = ["barra","barbell"]
 DUMBBELL_KEYWORDS = ["mancuerna","mancuernas","dumbbell","db"]
 
 def _is_cardio_exercise(ej: dict) -> bool:
-    n = _norm(ej.get("nombre",""))
-    return any(k in n for k in CARDIO_KEYWORDS)
+    return features_of(ej).has("cardio")
 
 def _exercise_minutes(ej: dict) -> int | None:
     for k in ["duracion_minutos","duración_minutos","tiempo_minutos","minutos"]:
@@ -899,17 +1115,19 @@ def _day_has_cardio_minutes(dia: dict, min_minutes: int) -> bool:
     return False
 
 def _exercise_uses_any(ej: dict, keywords: list[str]) -> bool:
-    n = _norm(ej.get("nombre",""))
-    return any(k in n for k in keywords)
+    return keyword_matcher(tuple(keywords)).search(features_of(ej).norm) is not None
 
 
-def validar_comentarios(plan: dict, comentarios: str) -> list[str]:
+def validar_comentarios(plan: dict, comentarios: str, *, feats: Optional[List[DayFeatures]] = None) -> list[str]:
     """
     Reglas estrictas derivadas de 'comentarios' del usuario.
+    `feats` (plan_features) evita reclasificar los ejercicios si ya se hizo.
     """
     errs: list[str] = []
     if not comentarios or not isinstance(comentarios, str):
         return errs
+    if feats is None:
+        feats = plan_features(plan)
 
     txt = comentarios.strip().lower()
 
@@ -923,36 +1141,33 @@ def validar_comentarios(plan: dict, comentarios: str) -> list[str]:
         except Exception:
             return None
 
-    def _day_has_cardio_minutes(d: dict, min_minutes: int) -> bool:
-        for ej in d.get("ejercicios", []):
-            n = _norm(ej.get("nombre", ""))
-            if any(k in n for k in ("cardio","cinta","trote","correr","bicic","elípt","elipt","escalador","remo")):
+    def _day_has_cardio_minutes(df: DayFeatures, min_minutes: int) -> bool:
+        for ej, f in df.exercises:
+            if f.has("cardio_comentarios"):
                 mins = _exercise_minutes(ej)
                 if mins is not None and mins >= min_minutes:
                     return True
         return False
 
     if re.search(r"solo\\s+un\\s+d[ií]a\\s+de\\s+pierna", txt):
-        leg_terms=("pierna","glúteo","gluteo","cuádriceps","cuadriceps","isquio","femoral","gemelo","glutes","legs")
         leg_days=0
-        for d in plan.get("dias", []):
-            ej=d.get("ejercicios", [])
-            leg_like=sum(1 for e in ej if any(t in _norm(e.get("nombre","")) for t in leg_terms))
-            if leg_like>=max(1, round(max(1,len(ej))*0.5)): leg_days+=1
+        for df in feats:
+            leg_like=df.count("pierna_comentarios")
+            if leg_like>=max(1, round(max(1,len(df.exercises))*0.5)): leg_days+=1
         if leg_days>1: errs.append(f"Pediste 'solo un día de pierna' y hay {leg_days} días tipo pierna.")
 
     m=re.search(r"(?:m[áa]ximo|max|como\\s+mucho)\\s+(\\d+)\\s+ejercicios\\s+por\\s+(?:sesión|sesion|d[ií]a|dia)", txt)
     if m:
         limit=int(m.group(1))
-        for i,d in enumerate(plan.get("dias", []), start=1):
-            cnt=len(d.get("ejercicios", []))
+        for i,df in enumerate(feats, start=1):
+            cnt=len(df.exercises)
             if cnt>limit: errs.append(f"Máximo {limit} ejercicios por sesión: el día {i} tiene {cnt}.")
 
     if re.search(r"no\\s+repetir\\s+ejercicio[s]?(?:\\s+exactos?)?\\s+en\\s+la\\s+semana|no\\s+repetir\\s+ejercicios", txt):
         seen=set(); dup=set()
-        for d in plan.get("dias", []):
-            for ej in d.get("ejercicios", []):
-                n=_norm(ej.get("nombre",""))
+        for df in feats:
+            for _, f in df.exercises:
+                n=f.norm
                 if not n: continue
                 if n in seen: dup.add(n)
                 seen.add(n)
@@ -961,47 +1176,42 @@ def validar_comentarios(plan: dict, comentarios: str) -> list[str]:
     m=re.search(r"(?:incluir|a(?:ñ|n)adir|meter)\\s+calentamiento\\s+de\\s+(\\d+)\\s*(?:min|mins|minutos)(?:\\s+cada\\s+d[ií]a)?", txt)
     if m:
         need=int(m.group(1))
-        for i,d in enumerate(plan.get("dias", []), start=1):
+        for i,df in enumerate(feats, start=1):
             found=False
-            for ej in d.get("ejercicios", []):
-                if "calentamiento" in _norm(ej.get("nombre","")):
+            for ej, f in df.exercises:
+                if f.has("calentamiento"):
                     mins=_exercise_minutes(ej)
                     if mins is None or mins<need: errs.append(f"Calentamiento de {need} min requerido en día {i}.")
                     found=True; break
             if not found: errs.append(f"Incluir calentamiento de {need} min en el día {i}.")
 
     if re.search(r"(?:incluir|a(?:ñ|n)adir|meter)\\s+estiramientos", txt):
-        for i,d in enumerate(plan.get("dias", []), start=1):
-            ok=any("estir" in _norm(ej.get("nombre","")) for ej in d.get("ejercicios", []))
+        for i,df in enumerate(feats, start=1):
+            ok=df.any("estiramiento")
             if not ok: errs.append(f"Incluir estiramientos al final del día {i}.")
 
     m=re.search(r"m[ií]nimo\\s+(\\d+)\\s*(?:min|mins|’|')\\s+de\\s+cardio\\s+(\\d+)\\s+d[ií]as?", txt)
     if m:
         mins=int(m.group(1)); days=int(m.group(2))
-        ok_days=sum(1 for d in plan.get("dias", []) if _day_has_cardio_minutes(d, mins))
+        ok_days=sum(1 for df in feats if _day_has_cardio_minutes(df, mins))
         if ok_days<days: errs.append(f"Cardio mínimo {mins} min en {days} días: solo hay {ok_days} días OK.")
 
     m=re.search(r"m[aá]s\\s+ejercicios\\s+de\\s+([a-záéíóúñ\\s]+)", txt)
     if m:
-        target=_norm(m.group(1)); count=0
-        for d in plan.get("dias", []):
-            for e in d.get("ejercicios", []):
-                if target and target in _norm(e.get("nombre","")): count+=1
+        target=_norm(m.group(1))
+        count=sum(1 for df in feats for _, f in df.exercises if target and target in f.norm)
         if count<3: errs.append(f"Pediste más ejercicios de '{target}': hay {count}, se esperaban ≥ 3.")
 
     m=re.search(r"menos\\s+ejercicios\\s+de\\s+([a-záéíóúñ\\s]+)", txt)
     if m:
-        target=_norm(m.group(1)); count=0
-        for d in plan.get("dias", []):
-            for e in d.get("ejercicios", []):
-                if target and target in _norm(e.get("nombre","")): count+=1
+        target=_norm(m.group(1))
+        count=sum(1 for df in feats for _, f in df.exercises if target and target in f.norm)
         if count>2: errs.append(f"Pediste menos ejercicios de '{target}': hay {count}, se esperaban ≤ 2.")
 
     m=re.search(r"(?:meter|incluir|hacer)\\s+([a-záéíóúñ\\s]+?)\\s+(\\d+)\\s+(?:veces|d[ií]as)", txt)
     if m:
-        target=_norm(m.group(1)); N=int(m.group(2)); days_with=0
-        for d in plan.get("dias", []):
-            if any(target in _norm(e.get("nombre","")) for e in d.get("ejercicios", [])): days_with+=1
+        target=_norm(m.group(1)); N=int(m.group(2))
+        days_with=sum(1 for df in feats if any(target in f.norm for _, f in df.exercises))
         if days_with!=N: errs.append(f"'{target}' debe aparecer exactamente {N} días y aparece {days_with}.")
 
     no_machines=bool(re.search(r"(?:no\\s+máquinas|no\\s+maquinas|solo\\s+peso\\s+libre)", txt))
@@ -1009,41 +1219,38 @@ def validar_comentarios(plan: dict, comentarios: str) -> list[str]:
     no_smith="no smith" in txt or "sin smith" in txt
     no_bar=bool(re.search(r"(?:no\\s+barra[s]?|sin\\s+barra[s]?)", txt))
     no_db=bool(re.search(r"(?:no\\s+mancuernas|sin\\s+mancuernas)", txt))
-    BARBELL_KEYWORDS=("barra","barbell"); DUMBBELL_KEYWORDS=("mancuerna","mancuernas","dumbbell","db")
-    MACHINE_KEYWORDS=("máquina","maquina","machine","selectorizada"); CABLE_KEYWORDS=("polea","poleas","cable","cables")
     if any((no_machines,no_cables,no_smith,no_bar,no_db)):
-        for i,d in enumerate(plan.get("dias", []), start=1):
-            for ej in d.get("ejercicios", []):
-                name=_norm(ej.get("nombre",""))
-                if no_machines and any(k in name for k in MACHINE_KEYWORDS): errs.append(f"Sin máquinas: '{ej.get('nombre','')}' en día {i}.")
-                if no_cables and any(k in name for k in CABLE_KEYWORDS): errs.append(f"Sin poleas/cables: '{ej.get('nombre','')}' en día {i}.")
-                if no_smith and "smith" in name: errs.append(f"Sin Smith: '{ej.get('nombre','')}' en día {i}.")
-                if no_bar and any(k in name for k in BARBELL_KEYWORDS): errs.append(f"Sin barra: '{ej.get('nombre','')}' en día {i}.")
-                if no_db and any(k in name for k in DUMBBELL_KEYWORDS): errs.append(f"Sin mancuernas: '{ej.get('nombre','')}' en día {i}.")
+        for i,df in enumerate(feats, start=1):
+            for ej, f in df.exercises:
+                if no_machines and f.has("maquina"): errs.append(f"Sin máquinas: '{ej.get('nombre','')}' en día {i}.")
+                if no_cables and f.has("polea"): errs.append(f"Sin poleas/cables: '{ej.get('nombre','')}' en día {i}.")
+                if no_smith and f.has("smith"): errs.append(f"Sin Smith: '{ej.get('nombre','')}' en día {i}.")
+                if no_bar and f.has("barra"): errs.append(f"Sin barra: '{ej.get('nombre','')}' en día {i}.")
+                if no_db and f.has("mancuerna"): errs.append(f"Sin mancuernas: '{ej.get('nombre','')}' en día {i}.")
 
     m=re.search(r"(?:al\\s+menos|min[ií]mo|como\\s+min[ií]mo)\\s*(\\d+)\\s*(?:ejercicios?\\s+)?de\\s+b[ií]ceps", txt)
     more_biceps=bool(re.search(r"(m[aá]s\\s+ejercicios\\s+de\\s+b[ií]ceps|m[aá]s\\s+b[ií]ceps)", txt))
     min_bi=int(m.group(1)) if m else (3 if more_biceps else None)
     if min_bi is not None:
-        total_bi=0; bi_terms=("curl","predicador","martillo","hammer curl","inclinado con mancuernas")
-        for d in plan.get("dias", []):
-            for e in d.get("ejercicios", []):
-                name=_norm(e.get("nombre",""))
+        total_bi=0
+        for df in feats:
+            for e, f in df.exercises:
                 gp=_norm(e.get("musculo_principal","")) or _norm(e.get("grupo",""))
                 sp=_norm(e.get("musculo_secundario",""))
-                if "biceps" in name or "bíceps" in name or "bicep" in name or "bícep" in name: total_bi+=1
-                elif any(t in name for t in bi_terms): total_bi+=1
+                if f.has("biceps_nombre") or f.has("biceps_terminos"): total_bi+=1
                 elif "biceps" in gp or "bíceps" in gp or "biceps" in sp or "bíceps" in sp: total_bi+=1
         if total_bi<min_bi: errs.append(f"Pediste bíceps ≥ {min_bi} y solo se detectan {total_bi} ejercicios de bíceps en la semana.")
 
     return errs
 
 
-def validar_objetivo(plan: Dict[str, Any], A: Dict[str, Any]) -> List[str]:
+def validar_objetivo(plan: Dict[str, Any], A: Dict[str, Any], *, feats: Optional[List[DayFeatures]] = None) -> List[str]:
     """Validaciones extra para asegurar que la rutina respeta el objetivo y las consignas."""
     errs: List[str] = []
     if not isinstance(plan, dict):
         return ['Plan inválido (no es dict).']
+    if feats is None:
+        feats = plan_features(plan)
 
     objetivo = (A.get('objetivo') or '').lower()
     dias_user = A.get('disponibilidad') or []
@@ -1084,12 +1291,11 @@ def validar_objetivo(plan: Dict[str, Any], A: Dict[str, Any]) -> List[str]:
                 errs.append(f"Día {i}: demasiados ejercicios en rango <=6 reps para hipertrofia (hay {lows}).")
 
         # cobertura básica brazos/hombro lateral (al menos 1/semana)
-        names = ' '.join([(ej.get('nombre','') or '').lower() for d in plan.get('dias', []) or [] for ej in (d.get('ejercicios') or [])])
-        if not any(k in names for k in ('curl', 'bíceps', 'biceps', 'martillo', 'predicador')):
+        if not any(df.any('cobertura_biceps') for df in feats):
             errs.append("Hipertrofia: falta trabajo directo de bíceps en la semana.")
-        if not any(k in names for k in ('tríceps', 'triceps', 'jalón de tríceps', 'extensión de tríceps', 'fondos', 'pushdown', 'skull')):
+        if not any(df.any('cobertura_triceps') for df in feats):
             errs.append("Hipertrofia: falta trabajo directo de tríceps en la semana.")
-        if not any(k in names for k in ('elevaciones laterales', 'lateral', 'deltoide lateral', 'laterales')):
+        if not any(df.any('cobertura_lateral') for df in feats):
             errs.append("Hipertrofia: falta trabajo directo de deltoide lateral (elevaciones laterales o equivalente).")
 
     elif objetivo == 'fuerza':
@@ -1106,9 +1312,10 @@ def validar_objetivo(plan: Dict[str, Any], A: Dict[str, Any]) -> List[str]:
 
 
 # --- Validaciones extra para evitar desvíos del prompt ---
-_CORE_PREFIX = ("core:", "finisher:")
-_CORE_KEYWORDS = ("plancha", "abdominal", "core", "hollow", "dead bug", "pallof", "crunch", "elevación de piernas", "elevacion de piernas", "farmer")
-_TRICEPS_KEYWORDS = ("tríceps", "triceps", "extensión tríceps", "extension triceps", "pushdown", "jalón de tríceps", "jalon de triceps", "fondos", "press francés", "press frances", "skull")
+# Las listas viven en plan_features.CATEGORIES (compiladas); se mantienen los nombres por compatibilidad
+_CORE_PREFIX = CORE_PREFIX
+_CORE_KEYWORDS = CATEGORIES["core"]
+_TRICEPS_KEYWORDS = CATEGORIES["triceps"]
 
 
 def _nrm_name(s: str) -> str:
@@ -1116,29 +1323,15 @@ def _nrm_name(s: str) -> str:
 
 
 def _has_core_or_finisher(dia: dict) -> bool:
-    for ej in dia.get("ejercicios", []) or []:
-        nm = _nrm_name(ej.get("nombre", ""))
-        if nm.startswith(_CORE_PREFIX):
-            return True
-        if any(k in nm for k in _CORE_KEYWORDS):
-            return True
-    return False
+    return day_has_core(day_features(dia))
 
 
 def _is_lower_day(dia: dict) -> bool:
-    nm = _nrm_name(dia.get("nombre", ""))
-    if any(k in nm for k in ("legs", "pierna", "lower")):
-        return True
-    # Heurística: si >=50% de ejercicios son de pierna, lo tratamos como lower
-    leg_terms = ("sentadilla", "prensa", "zancada", "femoral", "isquio", "gemelo", "cuádriceps", "cuadriceps", "glúteo", "gluteo", "hip thrust", "peso muerto rumano")
-    ej = dia.get("ejercicios", []) or []
-    if not ej:
-        return False
-    leg_like = sum(1 for e in ej if any(t in _nrm_name(e.get("nombre", "")) for t in leg_terms))
-    return leg_like >= max(1, round(len(ej) * 0.5))
+    # Por nombre, o si >=50% de ejercicios son de pierna
+    return day_is_lower(day_features(dia))
 
 
-def _parse_rest_to_seconds(rest: str) -> float:
+def parse_rest_to_seconds(rest: str) -> float:
     import re as _re
     s = _nrm_name(rest).replace(" ", "")
     if not s:
@@ -1163,7 +1356,7 @@ def _parse_rest_to_seconds(rest: str) -> float:
     return 60.0
 
 
-def _estimate_day_minutes(dia: dict) -> float:
+def estimate_day_minutes(dia: dict) -> float:
     """Estimación simple de duración basada en series + descanso.
 
     No es perfecta, pero sirve para detectar desviaciones grandes (>60 min) y forzar refino.
@@ -1177,7 +1370,7 @@ def _estimate_day_minutes(dia: dict) -> float:
         reps = _nrm_name(str(ej.get("reps", "10")))
         # trabajo por serie aproximado
         work = 45.0 if any(ch.isdigit() for ch in reps) and ("-" in reps or reps.isdigit()) and (int(reps.split("-")[-1]) if reps.split("-")[-1].isdigit() else 10) <= 10 else 35.0
-        rest = _parse_rest_to_seconds(str(ej.get("descanso", "60s")))
+        rest = parse_rest_to_seconds(str(ej.get("descanso", "60s")))
         # tiempo de la serie + descanso (no contamos el descanso del final del ejercicio)
         total_sec += sets * work
         if sets > 1:
@@ -1224,22 +1417,26 @@ def _postprocess_plan(plan: dict, A: dict) -> dict:
     return plan
 
 
-def validar_estructura_split(plan: Dict[str, Any], A: Dict[str, Any], datos: Dict[str, Any]) -> List[str]:
+def validar_estructura_split(
+    plan: Dict[str, Any], A: Dict[str, Any], datos: Dict[str, Any], *, feats: Optional[List[DayFeatures]] = None
+) -> List[str]:
     """Validación estricta para minimizar el desvío entre prompt y salida."""
     errs: List[str] = []
     dias = plan.get("dias") or []
     if not isinstance(dias, list):
         return ["Campo 'dias' inválido (no es lista)."]
+    if feats is None:
+        feats = plan_features(plan)
 
     # 5-8 ejercicios y core/finisher diario
-    for i, d in enumerate(dias, start=1):
+    for i, (d, df) in enumerate(zip(dias, feats), start=1):
         if not isinstance(d, dict):
             continue
         ej = d.get("ejercicios") or []
         if isinstance(ej, list):
             if len(ej) < 5 or len(ej) > 8:
                 errs.append(f"Día {i}: debe tener 5-8 ejercicios (tiene {len(ej)}).")
-        if not _has_core_or_finisher(d):
+        if not day_has_core(df):
             errs.append(f"Día {i}: falta core/finisher (último ejercicio debe empezar por 'Core:' o 'Finisher:').")
 
     # Días exactos + split en nombre
@@ -1254,12 +1451,12 @@ def validar_estructura_split(plan: Dict[str, Any], A: Dict[str, Any], datos: Dic
     # No duplicar ejercicio exacto en la semana (salvo core/finisher)
     seen = set()
     dup = set()
-    for d in dias:
-        for ej in d.get("ejercicios", []) or []:
-            nm = _nrm_name(ej.get("nombre", ""))
+    for df in feats:
+        for _, f in df.exercises:
+            nm = f.norm
             if not nm:
                 continue
-            if nm.startswith(_CORE_PREFIX):
+            if f.is_core_prefixed:
                 continue
             if nm in seen:
                 dup.add(nm)
@@ -1268,11 +1465,10 @@ def validar_estructura_split(plan: Dict[str, Any], A: Dict[str, Any], datos: Dic
         errs.append(f"No repetir ejercicio exacto en la semana: '{n}'.")
 
     # Lower: evitar tríceps
-    for i, d in enumerate(dias, start=1):
-        if _is_lower_day(d):
-            for ej in d.get("ejercicios", []) or []:
-                nm = _nrm_name(ej.get("nombre", ""))
-                if any(k in nm for k in _TRICEPS_KEYWORDS):
+    for i, df in enumerate(feats, start=1):
+        if df.day is not None and day_is_lower(df):
+            for ej, f in df.exercises:
+                if f.has("triceps"):
                     errs.append(f"Día {i} (Lower): contiene tríceps '{ej.get('nombre','')}'.")
 
     # Duración estimada
@@ -1281,7 +1477,7 @@ def validar_estructura_split(plan: Dict[str, Any], A: Dict[str, Any], datos: Dic
     except Exception:
         dur = 60
     for i, d in enumerate(dias, start=1):
-        mins = _estimate_day_minutes(d)
+        mins = estimate_day_minutes(d)
         # tolerancia pequeña
         if mins > (dur + 5):
             errs.append(f"Día {i}: estimación de tiempo ~{mins:.0f} min (objetivo {dur} min). Reduce series/descansos o usa superseries solo en accesorios.")
@@ -1300,7 +1496,365 @@ def validar_estructura_split(plan: Dict[str, Any], A: Dict[str, Any], datos: Dic
             errs.append(f"Deload: debe ser en la semana {semanas} (se recibió {dld}).")
 
     return errs
-def call_gpt(datos: Dict[str, Any]) -> Dict[str, Any]:
+# --- Refinado dirigido: localizar errores por día y regenerar solo esos días ---
+_DAY_REF_RE = re.compile(r"\bd[ií]a\s+(\d+)\b", re.IGNORECASE)
+_DUP_ERR_RE = re.compile(r"^No repetir ejercicios? exactos?.*?'([^']+)'", re.IGNORECASE)
+DAY_REPAIR_WORKERS = 4
+
+
+def _validate_plan(plan: Dict[str, Any], datos: Dict[str, Any], A: Dict[str, Any]) -> List[str]:
+    """Todos los validadores sobre un plan ya coercionado (los opcionales no abortan)."""
+    with ai_trace.stage("validate"):
+        per: Dict[str, int] = {}
+        errs: List[str] = []
+        errs += validar_negocio(plan)
+        per["validar_negocio"] = len(errs)
+        # Cada ejercicio se clasifica una vez y los validadores comparten el registro
+        feats = plan_features(plan)
+        for name, fn in (
+            ("validar_comentarios", lambda: validar_comentarios(plan, (datos.get("comentarios") or ""), feats=feats)),
+            ("validar_objetivo", lambda: validar_objetivo(plan, A, feats=feats)),
+            ("validar_estructura_split", lambda: validar_estructura_split(plan, A, datos, feats=feats)),
+        ):
+            try:
+                found = fn()
+            except Exception:
+                continue
+            errs += found
+            per[name] = len(found)
+    ai_trace.record_validation(per)
+    return errs
+
+
+def _repair_locally(
+    plan: Dict[str, Any], errs: List[str], datos: Dict[str, Any], A: Dict[str, Any]
+) -> tuple[Dict[str, Any], List[str], List[str]]:
+    """Reparación determinista (plan_repair) antes de volver a llamar al modelo.
+
+    Solo se adopta si deja menos errores. Devuelve (plan, errores, acciones).
+    """
+    from .plan_repair import repair_plan
+
+    try:
+        with ai_trace.stage("local_repair"):
+            repaired, actions = repair_plan(plan, A, datos)
+    except Exception:
+        return plan, errs, []
+    with ai_trace.stage("postprocess"):
+        repaired = _postprocess_plan(repaired, A)
+    errs_r = _validate_plan(repaired, datos, A)
+    if actions and len(errs_r) < len(errs):
+        return repaired, errs_r, actions
+    return plan, errs, []
+
+
+def _localize_errors(plan: Dict[str, Any], errs: List[str]) -> tuple[Dict[int, List[str]], List[str]]:
+    """Reparte los errores por día (índice 0-based); los que no se pueden asignar quedan como globales.
+
+    - Mensajes con "Día N"/"día N" → ese día.
+    - Ejercicio repetido en la semana → todos los días donde aparece salvo el primero.
+    - Cobertura semanal (bíceps, cardio, deload…) → global.
+    """
+    dias = plan.get("dias") or []
+    by_day: Dict[int, List[str]] = {}
+    global_errs: List[str] = []
+    for e in errs:
+        idx = sorted({int(n) - 1 for n in _DAY_REF_RE.findall(e)})
+        idx = [i for i in idx if 0 <= i < len(dias)]
+        if not idx:
+            m = _DUP_ERR_RE.match(e)
+            if m:
+                target = _nrm_name(m.group(1))
+                found = [
+                    i for i, d in enumerate(dias)
+                    if isinstance(d, dict)
+                    and any(_nrm_name(ej.get("nombre", "")) == target for ej in (d.get("ejercicios") or []) if isinstance(ej, dict))
+                ]
+                idx = found[1:]
+        if idx:
+            for i in idx:
+                by_day.setdefault(i, []).append(e)
+        else:
+            global_errs.append(e)
+    return by_day, global_errs
+
+
+def _build_day_fix_prompt(plan: Dict[str, Any], i: int, errs: List[str], A: Dict[str, Any], datos: Dict[str, Any]) -> str:
+    """Prompt mínimo para rehacer un solo día: restricciones, el día, sus errores y lo usado en el resto de la semana."""
+    nl = chr(10)
+    dias = plan.get("dias") or []
+    dia = dias[i]
+    otros = sorted({
+        str(ej.get("nombre", "")).strip()
+        for j, d in enumerate(dias) if j != i and isinstance(d, dict)
+        for ej in (d.get("ejercicios") or []) if isinstance(ej, dict) and not _nrm_name(ej.get("nombre", "")).startswith(_CORE_PREFIX)
+    } - {""})
+    notas = (datos.get("comentarios") or "").strip()
+    return (
+        f"Corrige SOLO este día ({i + 1} de {len(dias)}) de una rutina semanal." + nl +
+        "Devuelve EXCLUSIVAMENTE un objeto JSON {\"nombre\", \"ejercicios\": [...], \"notas\"}, sin texto extra." + nl + nl +
+        "REGLAS:" + nl +
+        "- 5-8 ejercicios; el último empieza por 'Core:' o 'Finisher:'." + nl +
+        "- Incluye 'descanso' en todos los ejercicios." + nl +
+        f"- Debe caber en {A.get('duracion')} min." + nl +
+        "- No uses ejercicios que ya están en otros días: " + json.dumps(otros, ensure_ascii=False) + nl +
+        "RESTRICCIONES:" + nl + nl.join(A.get("restricciones") or []) + nl +
+        (("NOTAS_USUARIO:" + nl + "<<<" + nl + notas + nl + ">>>" + nl) if notas else "") + nl +
+        "ERRORES A CORREGIR:" + nl + nl.join(f"- {e}" for e in errs) + nl + nl +
+        "DÍA ACTUAL:" + nl + json.dumps(dia, ensure_ascii=False, separators=(",", ":"))
+    )
+
+
+def _build_fix_prompt(plan: Dict[str, Any], errs: List[str], prompt: str, A: Dict[str, Any], datos: Dict[str, Any]) -> str:
+    """Prompt de refinado del plan completo.
+
+    En forma compacta no se reenvía el prompt original entero: solo las
+    secciones de usuario (split, objetivo, restricciones, detalles) sin las
+    reglas ya resumidas aquí, y el JSON sin indentar.
+    """
+    nl = chr(10)
+    tarea = (
+        "Corrige el JSON de rutina para que cumpla EXACTAMENTE todas las reglas." + nl +
+        "IMPORTANTE: Devuelve EXCLUSIVAMENTE JSON válido. Sin texto extra." + nl + nl +
+        "REGLAS (resumen):" + nl +
+        "- 5-8 ejercicios por día." + nl +
+        "- Último ejercicio de cada día: Core/Finisher y debe empezar por 'Core:' o 'Finisher:'." + nl +
+        "- Respetar el split y el nombre del día '<DíaSemana> - <Sesión>' si se especifica." + nl +
+        "- No repetir exactamente el mismo ejercicio en la semana (salvo core/finisher)." + nl +
+        "- Ajustar volumen/descansos para cumplir el tiempo." + nl + nl
+    )
+    if not compact_enabled():
+        return (
+            tarea +
+            "ERRORES A CORREGIR (no ignores ninguno):" + nl + json.dumps(errs, ensure_ascii=False, indent=2) + nl + nl +
+            "PROMPT ORIGINAL (para referencia):" + nl + prompt + nl + nl +
+            "JSON ORIGINAL:" + nl + json.dumps(plan, ensure_ascii=False)
+        )
+    keep = ("split", "reglas_objetivo", "restricciones", "detalles_usuario")
+    contexto = [sec for sec in build_prompt_sections(datos, A, compact=True) if sec.name in keep]
+    return canonical([
+        PromptSection("tarea", tarea),
+        PromptSection("errores", "ERRORES A CORREGIR (no ignores ninguno):" + nl + nl.join(f"- {e}" for e in errs)),
+        *contexto,
+        PromptSection("json", "JSON ORIGINAL:" + nl + json.dumps(plan, ensure_ascii=False, separators=(",", ":"))),
+    ], max_tokens=0)
+
+
+def _parse_day_reply(raw: str) -> Optional[Dict[str, Any]]:
+    data = _try_parse_json(raw)
+    if isinstance(data, dict) and isinstance(data.get("dias"), list) and data["dias"]:
+        data = data["dias"][0]
+    if isinstance(data, dict) and isinstance(data.get("ejercicios"), list):
+        return data
+    return None
+
+
+def _repair_days(
+    client,
+    plan: Dict[str, Any],
+    by_day: Dict[int, List[str]],
+    A: Dict[str, Any],
+    datos: Dict[str, Any],
+    *,
+    use_cache: bool = True,
+) -> tuple[Dict[str, Any], List[str]]:
+    """Regenera en paralelo los días con errores y los mezcla en una copia del plan.
+
+    Devuelve (plan, raws). Los días cuya respuesta no se puede parsear se dejan como estaban.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    day_schema = _day_schema()
+
+    def _one(i: int) -> tuple[int, str, Optional[Dict[str, Any]]]:
+        raw = _chat(
+            client,
+            _build_day_fix_prompt(plan, i, by_day[i], A, datos),
+            temperature=0.0,
+            use_cache=use_cache,
+            schema=day_schema,
+            schema_name="dia",
+        )
+        try:
+            return i, raw, _parse_day_reply(raw)
+        except Exception:
+            return i, raw, None
+
+    new_plan = dict(plan)
+    new_dias = list(plan.get("dias") or [])
+    raws: List[str] = []
+    workers = max(1, min(DAY_REPAIR_WORKERS, len(by_day)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Cada hilo con su copia del contexto: así la traza activa (ai_trace) llega a _chat
+        futures = [pool.submit(contextvars.copy_context().run, _one, i) for i in sorted(by_day)]
+        for i, raw, day in (f.result() for f in futures):
+            raws.append(raw)
+            if day is None:
+                continue
+            # El nombre lo fija _postprocess_plan; se conserva el original si no viene
+            day.setdefault("nombre", (new_dias[i] or {}).get("nombre", ""))
+            new_dias[i] = {
+                "nombre": day.get("nombre"),
+                "ejercicios": [_ensure_descanso_for_ej(ej) for ej in day.get("ejercicios") or []],
+                "notas": day.get("notas", "") or "",
+            }
+    new_plan["dias"] = new_dias
+    return new_plan, raws
+
+
+# --- Best-of-N especulativo ---
+BEST_OF_TEMPERATURES = (0.1, 0.4, 0.7, 0.9)
+
+
+def _best_of_setting() -> int:
+    try:
+        return max(1, min(len(BEST_OF_TEMPERATURES), int(os.getenv("VITALPEAK_AI_BEST_OF") or 1)))
+    except ValueError:
+        return 1
+
+
+def _evaluate_candidate(raw: str, datos: Dict[str, Any], A: Dict[str, Any]) -> Dict[str, Any]:
+    """Parsea, coerciona, valida y repara una respuesta. plan=None si no es JSON válido."""
+    try:
+        with ai_trace.stage("json"):
+            data = _try_parse_json(raw)
+    except Exception as e:
+        return {"raw": raw, "plan": None, "errs": [f"JSON no válido: {e}"], "repairs": []}
+    with ai_trace.stage("coerce"):
+        plan = _coerce_to_schema(data, datos)
+    with ai_trace.stage("postprocess"):
+        plan = _sanitize_plan_reps(plan)
+        plan = _postprocess_plan(plan, A)
+    errs = _validate_plan(plan, datos, A)
+    repairs: List[str] = []
+    if errs:
+        plan, errs, repairs = _repair_locally(plan, errs, datos, A)
+    return {"raw": raw, "plan": plan, "errs": errs, "repairs": repairs}
+
+
+def _candidate_score(cand: Dict[str, Any]) -> tuple:
+    # Menos errores es mejor; un JSON no parseable es siempre el peor
+    return (cand["plan"] is None, len(cand["errs"]))
+
+
+async def _speculate(
+    prompt: str,
+    n: int,
+    datos: Dict[str, Any],
+    A: Dict[str, Any],
+    *,
+    use_cache: bool = True,
+    schema: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Lanza n candidatos a la vez (temperaturas BEST_OF_TEMPERATURES) y devuelve el mejor.
+
+    En cuanto uno pasa todos los validadores se cancelan las peticiones
+    pendientes; si ninguno lo consigue, gana el de menos errores.
+    """
+    model = _get_model()
+    system = build_system()
+    messages = [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+
+    async def _one(temperature: float) -> str:
+        key = cache_key(model, system, prompt, temperature=temperature)
+        if use_cache:
+            cached = get_cached(key)
+            if cached:
+                ai_trace.count("cache_hits")
+                return cached
+        extra = _structured_kwargs(schema)
+        with ai_trace.stage("model"):
+            try:
+                raw = await chat_completion_async(messages, model=model, temperature=temperature, **extra)
+            except Exception as e:
+                if not extra or not _rejects_structured(e):
+                    raise
+                _NO_STRUCTURED.add(_structured_target())
+                ai_trace.count("structured_fallbacks")
+                raw = await chat_completion_async(messages, model=model, temperature=temperature)
+        ai_trace.count("model_calls")
+        if raw:
+            try:
+                _try_parse_json(raw)
+            except Exception:
+                pass
+            else:
+                put_cached(key, raw, model=model)
+        return raw
+
+    tasks = [asyncio.ensure_future(_one(t)) for t in BEST_OF_TEMPERATURES[:n]]
+    best: Optional[Dict[str, Any]] = None
+    failures: List[BaseException] = []
+    try:
+        for fut in asyncio.as_completed(tasks):
+            try:
+                raw = await fut
+            except Exception as e:
+                failures.append(e)
+                continue
+            cand = _evaluate_candidate(raw, datos, A)
+            if best is None or _candidate_score(cand) < _candidate_score(best):
+                best = cand
+            if cand["plan"] is not None and not cand["errs"]:
+                break
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    if best is None:
+        raise failures[0] if failures else RuntimeError("Ningún candidato generado")
+    best["candidates"] = n
+    return best
+
+
+def call_gpt(
+    datos: Dict[str, Any],
+    *,
+    use_cache: bool = True,
+    on_day: Optional[Callable[[Dict[str, Any]], None]] = None,
+    best_of: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Genera el plan con el modelo; `use_cache=False` ignora la caché de respuestas (ai_cache).
+
+    Con `on_day`, la primera respuesta se pide en streaming y se llama a
+    `on_day(dia)` con cada día (tal cual lo escribe el modelo, sin coerción)
+    en cuanto se completa, para poder pintarlo antes de que acabe la generación.
+
+    `best_of` (por defecto VITALPEAK_AI_BEST_OF, 1) > 1 lanza N candidatos en
+    paralelo a distintas temperaturas y se queda con el primero que pasa todos
+    los validadores (ver _speculate); en ese modo `on_day` recibe los días del
+    candidato elegido, ya coercionados.
+
+    El resultado incluye siempre `trace` (ai_trace): segundos por etapa
+    (model, json, coerce, postprocess, validate, local_repair; `refine` es el
+    tiempo total del bucle de refinado e incluye las etapas de sus intentos), tokens
+    de entrada/salida, contadores (llamadas, aciertos de caché, reintentos,
+    intentos de refinado) y errores por validador. La traza también se añade
+    al fichero de métricas rotativo.
+    """
+    with ai_trace.tracing(_get_model()) as trace:
+        result = _call_gpt(datos, use_cache=use_cache, on_day=on_day, best_of=best_of)
+        trace.result = {
+            "ok": bool(result.get("ok")),
+            "error": str(result.get("error") or "")[:300] or None,
+            "best_of": best_of,
+            "use_cache": use_cache,
+            "prompt_tokens_est": estimate_tokens(result.get("prompt") or ""),
+            "repairs": len(result.get("repairs") or []),
+        }
+        result["trace"] = trace.to_dict()
+    ai_trace.append_metrics(result["trace"])
+    return result
+
+
+def _call_gpt(
+    datos: Dict[str, Any],
+    *,
+    use_cache: bool = True,
+    on_day: Optional[Callable[[Dict[str, Any]], None]] = None,
+    best_of: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Pipeline de call_gpt (la traza la gestiona call_gpt)."""
 
     # --- Pre-análisis y normalización (cumplir consignas) ---
     A = analyze_user_data(datos)
@@ -1328,8 +1882,16 @@ def call_gpt(datos: Dict[str, Any]) -> Dict[str, Any]:
 
     _system = build_system()
     _prompt = build_prompt(datos)
+    n_candidates = _best_of_setting() if best_of is None else max(1, int(best_of))
+    plan_schema = _plan_schema(A.get("dias"))
     try:
-        raw = _chat(client, _prompt, temperature=0.1)
+        if n_candidates > 1:
+            best = run_async(_speculate(_prompt, n_candidates, datos, A, use_cache=use_cache, schema=plan_schema))
+            raw = best["raw"]
+        elif on_day is not None:
+            raw = _chat_progressive(client, _prompt, on_day, temperature=0.1, use_cache=use_cache, schema=plan_schema)
+        else:
+            raw = _chat(client, _prompt, temperature=0.1, use_cache=use_cache, schema=plan_schema)
     except Exception as e:
         return {
             "ok": False,
@@ -1342,94 +1904,110 @@ def call_gpt(datos: Dict[str, Any]) -> Dict[str, Any]:
             "system": _system,
         }
 
-    # Primer intento de parseo
-    try:
-        data = _try_parse_json(raw)
-    except Exception as e:
-        return {"ok": False, "error": f"JSON no válido: {e}", "raw": raw, "prompt": _prompt, "system": _system}
-
-    # Validación + coerción
-    coerced = _coerce_to_schema(data, datos)
-    coerced = _sanitize_plan_reps(coerced)
-    coerced = _postprocess_plan(coerced, A)
-    errs = []
-    errs += validar_negocio(coerced)
-    try:
-        errs += validar_comentarios(coerced, (datos.get("comentarios") or ""))
-    except Exception:
-        pass
-    try:
-        errs += validar_objetivo(coerced, A)
-    except Exception:
-        pass
-    try:
-        errs += validar_estructura_split(coerced, A, datos)
-    except Exception:
-        pass
+    # Parseo + coerción + validación + reparación local
+    cand = best if n_candidates > 1 else _evaluate_candidate(raw, datos, A)
+    if cand["plan"] is None:
+        return {"ok": False, "error": cand["errs"][0], "raw": raw, "prompt": _prompt, "system": _system}
+    if n_candidates > 1 and on_day is not None:
+        for dia in cand["plan"].get("dias") or []:
+            try:
+                on_day(dia)
+            except Exception:
+                pass
+    coerced, errs = cand["plan"], cand["errs"]
+    repairs: List[str] = list(cand["repairs"])
 
     if not errs:
-        return {"ok": True, "data": coerced, "prompt": _prompt, "system": _system}
-
-    # Intento de REFINADO: bucle de corrección (máx 3) con temperatura baja.
-    nl = chr(10)
-    fixed = None
+        return {"ok": True, "data": coerced, "prompt": _prompt, "system": _system, "repairs": repairs}
+
+    # Intento de REFINADO (máx 3, temperatura baja). Si todos los errores se
+    # pueden asignar a días concretos, solo se regeneran esos días (en
+    # paralelo, con un prompt corto); si hay errores de semana completa se
+    # reenvía el plan entero.
+    with ai_trace.stage("refine"):
+        return _refine(client, coerced, errs, raw, _prompt, _system, A, datos, repairs, use_cache=use_cache, plan_schema=plan_schema)
+
+
+def _refine(
+    client,
+    plan: Dict[str, Any],
+    errs: List[str],
+    raw: str,
+    _prompt: str,
+    _system: str,
+    A: Dict[str, Any],
+    datos: Dict[str, Any],
+    repairs: List[str],
+    *,
+    use_cache: bool,
+    plan_schema: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Bucle de refinado de call_gpt (máx. 3 intentos); devuelve el resultado final."""
+    fixed = plan
     last_raw = raw
     last_errs = errs
     for _attempt in range(3):
-        fix_prompt = (
-            "Corrige el JSON de rutina para que cumpla EXACTAMENTE todas las reglas.\n"
-            "IMPORTANTE: Devuelve EXCLUSIVAMENTE JSON válido. Sin texto extra.\n\n"
-            "REGLAS (resumen):\n"
-            "- 5-8 ejercicios por día.\n"
-            "- Último ejercicio de cada día: Core/Finisher y debe empezar por 'Core:' o 'Finisher:'.\n"
-            "- Respetar el split y el nombre del día '<DíaSemana> - <Sesión>' si se especifica.\n"
-            "- No repetir exactamente el mismo ejercicio en la semana (salvo core/finisher).\n"
-            "- Ajustar volumen/descansos para cumplir el tiempo.\n\n"
-            "ERRORES A CORREGIR (no ignores ninguno):\n" + json.dumps(last_errs, ensure_ascii=False, indent=2) + "\n\n"
-            "PROMPT ORIGINAL (para referencia):\n" + _prompt + "\n\n"
-            "JSON ORIGINAL:\n" + json.dumps(coerced if fixed is None else fixed, ensure_ascii=False)
-        )
-        try:
-            fixed_raw = _chat(client, fix_prompt, temperature=0.0)
-        except Exception as e:
-            return {
-                "ok": False,
-                "error": f"Error en refinado IA: {e}",
-                "raw": last_raw,
-                "prompt": _prompt,
-                "system": _system,
-            }
-        last_raw = fixed_raw
-        try:
-            fixed = _try_parse_json(fixed_raw)
-        except Exception:
-            fixed = None
-            continue
-
-        fixed = _coerce_to_schema(fixed, datos)
-        fixed = _sanitize_plan_reps(fixed)
-        fixed = _postprocess_plan(fixed, A)
+        ai_trace.count("refine_attempts")
+        by_day, global_errs = _localize_errors(fixed, last_errs)
+        if by_day and not global_errs:
+            ai_trace.count("refine_day_repairs", len(by_day))
+            try:
+                candidate, raws = _repair_days(client, fixed, by_day, A, datos, use_cache=use_cache)
+            except Exception as e:
+                return {
+                    "ok": False,
+                    "error": f"Error en refinado IA: {e}",
+                    "raw": last_raw,
+                    "prompt": _prompt,
+                    "system": _system,
+                }
+            last_raw = raws[-1] if raws else last_raw
+        else:
+            fix_prompt = _build_fix_prompt(fixed, last_errs, _prompt, A, datos)
+            try:
+                fixed_raw = _chat(client, fix_prompt, temperature=0.0, use_cache=use_cache, schema=plan_schema)
+            except Exception as e:
+                return {
+                    "ok": False,
+                    "error": f"Error en refinado IA: {e}",
+                    "raw": last_raw,
+                    "prompt": _prompt,
+                    "system": _system,
+                }
+            last_raw = fixed_raw
+            try:
+                with ai_trace.stage("json"):
+                    candidate = _try_parse_json(fixed_raw)
+            except Exception:
+                continue
+            with ai_trace.stage("coerce"):
+                candidate = _coerce_to_schema(candidate, datos)
 
-        errs2 = []
-        errs2 += validar_negocio(fixed)
-        try:
-            errs2 += validar_comentarios(fixed, (datos.get("comentarios") or ""))
-        except Exception:
-            pass
-        try:
-            errs2 += validar_objetivo(fixed, A)
-        except Exception:
-            pass
-        try:
-            errs2 += validar_estructura_split(fixed, A, datos)
-        except Exception:
-            pass
+        with ai_trace.stage("postprocess"):
+            candidate = _sanitize_plan_reps(candidate)
+            candidate = _postprocess_plan(candidate, A)
+        errs2 = _validate_plan(candidate, datos, A)
+        if errs2:
+            candidate, errs2, actions = _repair_locally(candidate, errs2, datos, A)
+            repairs += actions
 
         if not errs2:
-            return {"ok": True, "data": fixed, "prompt": _prompt, "system": _system}
+            return {"ok": True, "data": candidate, "prompt": _prompt, "system": _system, "repairs": repairs}
+        fixed = candidate
         last_errs = errs2
     # Si no pudo corregirse, devolvemos el último estado para depurar.
     return {"ok": False, "error": f"Refinado aún con errores: {last_errs}", "raw": last_raw, "prompt": _prompt, "system": _system}
+
+
+async def call_gpt_async(datos: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+    """Envoltorio de call_gpt en un hilo (asyncio.to_thread), no una versión async nativa.
+
+    Sirve para tener varias generaciones en curso desde un event loop sin
+    bloquearlo; cada una ocupa un hilo del executor por defecto mientras dura.
+    Las peticiones al modelo siguen pasando por el cliente compartido de
+    ai_client y su límite de concurrencia (VITALPEAK_AI_CONCURRENCY).
+    """
+    return await asyncio.to_thread(call_gpt, datos, **kwargs)
 import re as _re2
 
 def _sanitize_reps_value(val) -> str:
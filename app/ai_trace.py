@@ -0,0 +1,214 @@
+"""Telemetría de call_gpt: tiempos por etapa, tokens, intentos y errores por validador.
+
+La traza activa vive en una ContextVar, así que la ven también los hilos de
+_repair_days (se copia el contexto), las tareas de _speculate (run_async
+propaga el contexto) y los reintentos de ai_client, sin pasarla por
+parámetro. Fuera de `tracing()` todas las funciones son no-op.
+
+Cada traza terminada se añade a un JSONL rotativo:
+    VITALPEAK_AI_METRICS_FILE=usuarios_data/ai_metrics.jsonl
+    VITALPEAK_AI_METRICS_MAX=500     trazas que se conservan (0 = no guardar)
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+DEFAULT_MAX_TRACES = 500
+
+_current: "contextvars.ContextVar[Optional[GenerationTrace]]" = contextvars.ContextVar("ai_trace", default=None)
+_file_lock = threading.Lock()
+
+
+class GenerationTrace:
+    """Acumulador de una generación (seguro entre hilos)."""
+
+    def __init__(self, model: str = "") -> None:
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self.started = time.time()
+        self.model = model
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.tokens = {"in": 0, "out": 0, "estimated": False}
+        self.validations: List[Dict[str, int]] = []
+        self.result: Dict[str, Any] = {}
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_tokens(self, tokens_in: int, tokens_out: int, *, estimated: bool = False) -> None:
+        with self._lock:
+            self.tokens["in"] += int(tokens_in or 0)
+            self.tokens["out"] += int(tokens_out or 0)
+            self.tokens["estimated"] = self.tokens["estimated"] or estimated
+
+    def add_validation(self, per_validator: Dict[str, int]) -> None:
+        with self._lock:
+            self.validations.append(dict(per_validator))
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ts": self.started,
+                "model": self.model,
+                "total_s": round(time.perf_counter() - self._t0, 4),
+                "stages_s": {k: round(v, 4) for k, v in self.stages.items()},
+                "tokens": dict(self.tokens),
+                "counters": dict(self.counters),
+                # Primera validación (respuesta del modelo) y última (resultado entregado)
+                "validator_errors": dict(self.validations[0]) if self.validations else {},
+                "validator_errors_final": dict(self.validations[-1]) if self.validations else {},
+                "validations": [dict(v) for v in self.validations],
+                **self.result,
+            }
+
+
+def current() -> Optional[GenerationTrace]:
+    return _current.get()
+
+
+@contextmanager
+def tracing(model: str = "") -> Iterator[GenerationTrace]:
+    """Activa una traza nueva durante el bloque."""
+    trace = GenerationTrace(model)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Suma la duración del bloque a la etapa `name` de la traza activa."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_time(name, time.perf_counter() - t0)
+
+
+def count(name: str, n: int = 1) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.count(name, n)
+
+
+def record_usage(usage: Any) -> None:
+    """Tokens de `resp.usage` (objeto del SDK o dict)."""
+    trace = _current.get()
+    if trace is None or usage is None:
+        return
+    get = usage.get if isinstance(usage, dict) else lambda k: getattr(usage, k, None)
+    trace.add_tokens(get("prompt_tokens") or 0, get("completion_tokens") or 0)
+
+
+def record_estimated_tokens(tokens_in: int, tokens_out: int) -> None:
+    """Para respuestas sin `usage` (streaming): estimación local."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add_tokens(tokens_in, tokens_out, estimated=True)
+
+
+def record_validation(per_validator: Dict[str, int]) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.add_validation(per_validator)
+
+
+# --- Fichero de métricas rotativo ---
+def metrics_path() -> Path:
+    return Path(os.getenv("VITALPEAK_AI_METRICS_FILE") or "usuarios_data/ai_metrics.jsonl")
+
+
+def _max_traces() -> int:
+    try:
+        return max(0, int(os.getenv("VITALPEAK_AI_METRICS_MAX") or DEFAULT_MAX_TRACES))
+    except ValueError:
+        return DEFAULT_MAX_TRACES
+
+
+def append_metrics(trace: Dict[str, Any]) -> None:
+    """Añade la traza al JSONL; al pasar de un 10% sobre el máximo se recorta a las últimas."""
+    limit = _max_traces()
+    if not limit:
+        return
+    p = metrics_path()
+    line = json.dumps(trace, ensure_ascii=False, default=str) + "\n"
+    with _file_lock:
+        try:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            with p.open("a", encoding="utf-8") as f:
+                f.write(line)
+            lines = p.read_text(encoding="utf-8").splitlines(keepends=True)
+            if len(lines) > limit + max(1, limit // 10):
+                tmp = p.with_name(p.name + ".tmp")
+                tmp.write_text("".join(lines[-limit:]), encoding="utf-8")
+                os.replace(tmp, p)
+        except OSError:
+            # Las métricas no deben romper la generación
+            pass
+
+
+def load_metrics(n: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Últimas `n` trazas guardadas (todas si n es None)."""
+    try:
+        lines = metrics_path().read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+    out: List[Dict[str, Any]] = []
+    for line in lines[-n:] if n else lines:
+        try:
+            out.append(json.loads(line))
+        except ValueError:
+            continue
+    return out
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+def summarize(traces: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Resumen de varias trazas: éxito, p50/p95 del total, media por etapa y tokens."""
+    if not traces:
+        return {"n": 0}
+    totals = [float(t.get("total_s") or 0.0) for t in traces]
+    stages: Dict[str, float] = {}
+    errs: Dict[str, int] = {}
+    for t in traces:
+        for k, v in (t.get("stages_s") or {}).items():
+            stages[k] = stages.get(k, 0.0) + float(v)
+        for k, v in (t.get("validator_errors") or {}).items():
+            errs[k] = errs.get(k, 0) + int(v)
+    n = len(traces)
+    return {
+        "n": n,
+        "ok_rate": sum(1 for t in traces if t.get("ok")) / n,
+        "total_p50_s": _percentile(totals, 0.5),
+        "total_p95_s": _percentile(totals, 0.95),
+        "stages_mean_s": {k: v / n for k, v in sorted(stages.items(), key=lambda kv: -kv[1])},
+        "tokens_in_mean": sum(int((t.get("tokens") or {}).get("in") or 0) for t in traces) / n,
+        "tokens_out_mean": sum(int((t.get("tokens") or {}).get("out") or 0) for t in traces) / n,
+        "validator_errors": errs,
+    }
@@ -0,0 +1,122 @@
+"""Analítica vectorizada de series (pandas/NumPy, sin callbacks por fila).
+
+Columnas normalizadas (las mismas que usan las vistas de progreso):
+Fecha (date), Ejercicio, Set, Reps, Peso, y tras `add_set_metrics`: 1RM, Volumen.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+SET_COLUMNS = ["Fecha", "Ejercicio", "Set", "Reps", "Peso"]
+BEST_SET_ORDER = ["1RM", "Peso", "Reps"]
+
+
+def epley_1rm(weight, reps):
+    """1RM estimado (Epley): w·(1 + r/30). 0 si peso o reps no son positivos."""
+    w = np.asarray(weight, dtype=float)
+    r = np.asarray(reps, dtype=float)
+    return np.where((w > 0) & (r > 0), w * (1.0 + r / 30.0), 0.0)
+
+
+def brzycki_1rm(weight, reps):
+    """1RM estimado (Brzycki): w·36/(37 − r). Solo válido para 0 < r < 37."""
+    w = np.asarray(weight, dtype=float)
+    r = np.asarray(reps, dtype=float)
+    ok = (w > 0) & (r > 0) & (r < 37)
+    return np.where(ok, w * 36.0 / np.where(ok, 37.0 - r, 1.0), 0.0)
+
+
+def normalize_sets(rows: Iterable[Dict]) -> pd.DataFrame:
+    """Lista de entrenamientos → DataFrame con SET_COLUMNS (descarta fechas/ejercicios inválidos)."""
+    df = pd.DataFrame(list(rows))
+    for col in ["date", "exercise", "set", "reps", "weight"]:
+        if col not in df.columns:
+            df[col] = None
+    out = pd.DataFrame(
+        {
+            "Fecha": pd.to_datetime(df["date"], errors="coerce").dt.date,
+            "Ejercicio": df["exercise"].astype(str).str.strip(),
+            "Set": pd.to_numeric(df["set"], errors="coerce").fillna(0).astype(int),
+            "Reps": pd.to_numeric(df["reps"], errors="coerce").fillna(0).astype(int),
+            "Peso": pd.to_numeric(df["weight"], errors="coerce").fillna(0.0).astype(float),
+        }
+    )
+    valid = out["Fecha"].notna() & df["exercise"].notna() & (out["Ejercicio"] != "")
+    return out[valid].reset_index(drop=True)
+
+
+def add_set_metrics(df: pd.DataFrame, *, formula: str = "epley") -> pd.DataFrame:
+    """Añade 1RM estimado y Volumen (Peso × Reps)."""
+    df = df.copy()
+    fn = brzycki_1rm if formula == "brzycki" else epley_1rm
+    df["1RM"] = fn(df["Peso"].to_numpy(), df["Reps"].to_numpy())
+    df["Volumen"] = df["Peso"] * df["Reps"]
+    return df
+
+
+def best_set_per_group(df: pd.DataFrame, keys: Sequence[str] = ("Fecha",)) -> pd.DataFrame:
+    """Mejor set por grupo: mayor 1RM; empate → mayor peso; empate → más reps."""
+    if "1RM" not in df.columns:
+        df = add_set_metrics(df)
+    ordered = df.sort_values(BEST_SET_ORDER, ascending=False, kind="mergesort")
+    return ordered.drop_duplicates(subset=list(keys), keep="first").sort_values(list(keys)).reset_index(drop=True)
+
+
+def daily_summary(df: pd.DataFrame, keys: Sequence[str] = ("Fecha",)) -> pd.DataFrame:
+    """Resumen por día (o por `keys`): mejor set + Series, Reps_tot, Volumen, Max_peso, Max_1RM."""
+    if "1RM" not in df.columns:
+        df = add_set_metrics(df)
+    keys = list(keys)
+    agg = df.groupby(keys, as_index=False, sort=True).agg(
+        Series=("Peso", "size"),
+        Reps_tot=("Reps", "sum"),
+        Volumen=("Volumen", "sum"),
+        Max_peso=("Peso", "max"),
+        Max_1RM=("1RM", "max"),
+    )
+    best = best_set_per_group(df, keys)[keys + ["Peso", "Reps", "1RM"]].rename(
+        columns={"Peso": "Mejor peso", "Reps": "Reps en mejor set", "1RM": "Mejor 1RM est."}
+    )
+    return best.merge(agg, on=keys, how="left")
+
+
+def rolling_mean(df: pd.DataFrame, cols: Sequence[str], window: int = 3, *, suffix: str = " (MM)") -> pd.DataFrame:
+    """Añade medias móviles `col + suffix` para cada columna presente."""
+    df = df.copy()
+    for col in cols:
+        if col in df.columns:
+            df[col + suffix] = df[col].rolling(window, min_periods=1).mean()
+    return df
+
+
+def last_values(rows: Iterable[Dict], exercises: Optional[List[str]] = None) -> Dict[str, tuple]:
+    """{ejercicio: (reps, peso)} de la última serie, como last_values_for_exercise pero en bloque.
+
+    Trabaja sobre las filas crudas con la misma regla: nombre exacto (sin
+    normalizar) y última por (date, set) como texto/número tal cual.
+    """
+    df = pd.DataFrame(list(rows))
+    if df.empty or "exercise" not in df.columns:
+        return {}
+    if exercises is not None:
+        df = df[df["exercise"].isin(exercises)]
+    df = df[df["exercise"].notna()]
+    if df.empty:
+        return {}
+    key = pd.DataFrame(
+        {
+            "date": df["date"].fillna("") if "date" in df.columns else "",
+            "set": pd.to_numeric(df["set"], errors="coerce").fillna(0) if "set" in df.columns else 0,
+        },
+        index=df.index,
+    )
+    order = key.sort_values(["date", "set"], kind="mergesort").index
+    last = df.loc[order].drop_duplicates(subset=["exercise"], keep="last")
+    reps = pd.to_numeric(last.get("reps", 0), errors="coerce").fillna(0)
+    weight = pd.to_numeric(last.get("weight", 0.0), errors="coerce").fillna(0.0)
+    return {ex: (int(r), float(w)) for ex, r, w in zip(last["exercise"], reps, weight)}
@@ -1,7 +1,10 @@
 from __future__ import annotations
-import json, os, time, secrets, base64, hashlib, hmac
+import json, os, time, secrets, base64, hashlib, hmac, pickle, threading, uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
 BASE_DIR = Path(".")
 USERS_DIR = BASE_DIR / "usuarios_data"
@@ -16,76 +19,412 @@ def user_json_path(username: str) -> Path:
 def _reset_token_path(username: str) -> Path:
     return RESET_DIR / f"{username}.reset.json"
 
-def load_user(username: str) -> Optional[Dict[str, Any]]:
+# Log append-only de series: cada add_training_set añade una línea JSON en
+# O(1) en vez de reescribir el documento completo. load_user mezcla las líneas
+# pendientes en "entrenamientos" y anota hasta qué byte del log lo hizo; save_user
+# vuelca además las líneas añadidas después (por otra sesión) y solo entonces
+# borra el log. Append y save se serializan con un lock por usuario.
+# Cada log nuevo empieza con una cabecera {"_log": <id>} que identifica esa
+# generación: tras compactar, un log recreado no se confunde con el anterior.
+TRAINING_LOG_COMPACT_BYTES = 256 * 1024
+_LOG_HEADER_KEY = "_log"
+
+class _UserDoc(dict):
+    """Documento devuelto por load_user; `sets_log` = (id del log, bytes) ya mezclados."""
+
+    sets_log: Optional[Tuple[Optional[str], int]] = None
+
+def training_log_path(username: str) -> Path:
+    return USERS_DIR / f"{username}.sets.jsonl"
+
+def _log_path_for(doc_path: Path) -> Path:
+    return doc_path.with_name(doc_path.stem + ".sets.jsonl")
+
+_log_locks: Dict[str, threading.RLock] = {}
+_log_locks_guard = threading.Lock()
+
+def _log_lock(log_path: Path) -> threading.RLock:
+    key = str(log_path)
+    with _log_locks_guard:
+        lock = _log_locks.get(key)
+        if lock is None:
+            lock = _log_locks[key] = threading.RLock()
+        return lock
+
+def _log_generation(first_line: bytes) -> Optional[str]:
+    try:
+        head = json.loads(first_line.decode("utf-8"))
+    except Exception:
+        return None
+    return str(head[_LOG_HEADER_KEY]) if isinstance(head, dict) and _LOG_HEADER_KEY in head else None
+
+def _read_log_from(
+    log_path: Path, mark: Optional[Tuple[Optional[str], int]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[Tuple[Optional[str], int]]]:
+    """Filas completas del log posteriores a `mark` y la marca nueva (id del log, byte final leído).
+
+    La marca solo vale para el mismo log (misma cabecera) y si no pasa del
+    tamaño actual; si no, se lee el log entero.
+    """
+    try:
+        with log_path.open("rb") as fh:
+            gen = _log_generation(fh.readline())
+            size = os.fstat(fh.fileno()).st_size
+            start = mark[1] if mark is not None and mark[0] == gen and mark[1] <= size else 0
+            fh.seek(start)
+            raw = fh.read()
+    except OSError:
+        return [], None
+    # Solo líneas terminadas: una escritura a medias se leerá la próxima vez
+    end = raw.rfind(b"\n") + 1
+    rows: List[Dict[str, Any]] = []
+    for line in raw[:end].splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line.decode("utf-8"))
+        except Exception:
+            # Línea truncada (corte a mitad de escritura): se ignora
+            continue
+        if isinstance(row, dict) and _LOG_HEADER_KEY not in row:
+            rows.append(row)
+    return rows, (gen, start + end)
+
+def _read_training_log(log_path: Path) -> List[Dict[str, Any]]:
+    return _read_log_from(log_path)[0]
+
+def read_training_log(username: str) -> List[Dict[str, Any]]:
+    """Series añadidas al log que aún no se han compactado en el JSON principal."""
+    return _read_training_log(training_log_path(username))
+
+def _json_append_training_rows(username: str, rows: List[Dict[str, Any]]) -> None:
+    """Añade filas al log de series del usuario (una escritura + fsync)."""
+    if not rows:
+        return
+    ensure_base_dirs()
+    p = training_log_path(username)
+    payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows)
+    with _log_lock(p):
+        try:
+            fresh = p.stat().st_size == 0
+        except OSError:
+            fresh = True
+        if fresh:
+            payload = json.dumps({_LOG_HEADER_KEY: uuid.uuid4().hex}) + "\n" + payload
+        with p.open("a", encoding="utf-8") as fh:
+            fh.write(payload)
+            fh.flush()
+            os.fsync(fh.fileno())
+        if training_log_needs_compaction(username):
+            compact_training_log(username)
+
+def training_log_needs_compaction(username: str) -> bool:
+    try:
+        return training_log_path(username).stat().st_size >= TRAINING_LOG_COMPACT_BYTES
+    except OSError:
+        return False
+
+def compact_training_log(username: str) -> bool:
+    """Vuelca el log de series al JSON principal. Devuelve True si había algo que compactar."""
+    if not training_log_path(username).exists():
+        return False
+    with _log_lock(training_log_path(username)):
+        data = _json_load_user(username)
+        if data is None:
+            return False
+        _json_save_user(username, data)
+    return True
+
+# Caché en proceso de documentos de usuario. Clave: ruta del JSON; se valida con
+# (inode, mtime_ns, tamaño) del JSON y del log de series, así que cualquier
+# escritura externa la invalida. Se guarda una instantánea serializada con pickle
+# y cada lectura devuelve una copia propia: los callers pueden mutar lo que
+# reciben sin corromper la caché.
+USER_CACHE_MAX_ENTRIES = 32
+
+_user_cache: "OrderedDict[str, Tuple[tuple, bytes]]" = OrderedDict()
+_user_cache_lock = threading.Lock()
+_user_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def _stat_key(p: Path) -> Optional[tuple]:
+    try:
+        st = p.stat()
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _doc_signature(p: Path) -> tuple:
+    return (_stat_key(p), _stat_key(_log_path_for(p)))
+
+def _cache_put(p: Path, sig: tuple, data: Dict[str, Any]) -> None:
+    if sig[0] is None:
+        return
+    blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    key = str(p)
+    with _user_cache_lock:
+        _user_cache[key] = (sig, blob)
+        _user_cache.move_to_end(key)
+        while len(_user_cache) > USER_CACHE_MAX_ENTRIES:
+            _user_cache.popitem(last=False)
+            _user_cache_stats["evictions"] += 1
+
+def _cache_get(p: Path, sig: tuple) -> Optional[Dict[str, Any]]:
+    key = str(p)
+    with _user_cache_lock:
+        hit = _user_cache.get(key)
+        if hit is None or hit[0] != sig:
+            _user_cache_stats["misses"] += 1
+            return None
+        _user_cache.move_to_end(key)
+        _user_cache_stats["hits"] += 1
+        blob = hit[1]
+    return pickle.loads(blob)
+
+def user_cache_stats() -> Dict[str, int]:
+    """Contadores de la caché de usuarios (hits, misses, evictions, entries)."""
+    with _user_cache_lock:
+        out = dict(_user_cache_stats)
+        out["entries"] = len(_user_cache)
+    return out
+
+def clear_user_cache() -> None:
+    with _user_cache_lock:
+        _user_cache.clear()
+
+def _read_user_doc(p: Path) -> Optional[Dict[str, Any]]:
+    sig = _doc_signature(p)
+    cached = _cache_get(p, sig)
+    if cached is not None:
+        return cached
+    try:
+        data = json.loads(p.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    if not isinstance(data, dict):
+        return data
+    doc = _UserDoc(data)
+    pending, doc.sets_log = _read_log_from(_log_path_for(p))
+    if pending:
+        doc.setdefault("entrenamientos", []).extend(pending)
+    _cache_put(p, sig, doc)
+    return doc
+
+def _json_load_user(username: str) -> Optional[Dict[str, Any]]:
     ensure_base_dirs()
     p = user_json_path(username)
     if not p.exists():
         pl = user_json_path(username.lower())
         if pl.exists():
-            try:
-                return json.loads(pl.read_text(encoding="utf-8"))
-            except Exception:
-                return None
+            return _read_user_doc(pl)
         return None
+    return _read_user_doc(p)
+
+def _fold_training_log(log_path: Path, data: Dict[str, Any]) -> None:
+    """Añade a `data` las series del log que no mezcló load_user (llamar con el lock del log)."""
+    # Sin marca (documento no leído con load_user) se vuelca el log entero
+    tail, _ = _read_log_from(log_path, getattr(data, "sets_log", None))
+    if tail:
+        data.setdefault("entrenamientos", []).extend(tail)
+
+def _discard_training_log(log_path: Path, data: Dict[str, Any]) -> None:
+    # Tras reescribir el documento completo, las filas del log ya están dentro
     try:
-        return json.loads(p.read_text(encoding="utf-8"))
-    except Exception:
-        return None
+        log_path.unlink()
+    except OSError:
+        pass
+    if isinstance(data, _UserDoc):
+        data.sets_log = None
 
-def save_user(username: str, data: Dict[str, Any]) -> None:
-    """Guarda JSON de usuario con reintentos (OneDrive a veces bloquea el archivo)."""
+def _json_save_user(username: str, data: Dict[str, Any]) -> None:
+    """Guarda JSON de usuario con reintentos (OneDrive a veces bloquea el archivo).
+
+    Antes de escribir se añaden a `data` las series del log posteriores a su
+    load_user (p. ej. de otra sesión) y después se borra el log.
+    """
     ensure_base_dirs()
     p = user_json_path(username)
-    payload = json.dumps(data, ensure_ascii=False, indent=2)
-    tmp = p.with_suffix(p.suffix + f".tmp.{os.getpid()}")
-    last_err: Exception | None = None
-    for attempt in range(8):
+    lp = _log_path_for(p)
+    with _log_lock(lp):
+        _fold_training_log(lp, data)
+        payload = json.dumps(data, ensure_ascii=False, indent=2)
+        tmp = p.with_suffix(p.suffix + f".tmp.{os.getpid()}")
+        last_err: Exception | None = None
+        for attempt in range(8):
+            try:
+                tmp.write_text(payload, encoding="utf-8")
+                os.replace(tmp, p)
+                _discard_training_log(lp, data)
+                _cache_put(p, _doc_signature(p), data)
+                return
+            except PermissionError as e:
+                last_err = e
+                time.sleep(0.05 * (attempt + 1))
+            except OSError as e:
+                last_err = e
+                time.sleep(0.05 * (attempt + 1))
+            finally:
+                if tmp.exists():
+                    try:
+                        tmp.unlink()
+                    except Exception:
+                        pass
+        # Último intento directo (mensaje más claro si falla)
         try:
-            tmp.write_text(payload, encoding="utf-8")
-            os.replace(tmp, p)
-            return
+            p.write_text(payload, encoding="utf-8")
+            _discard_training_log(lp, data)
+            _cache_put(p, _doc_signature(p), data)
         except PermissionError as e:
-            last_err = e
-            time.sleep(0.05 * (attempt + 1))
-        except OSError as e:
-            last_err = e
-            time.sleep(0.05 * (attempt + 1))
-        finally:
-            if tmp.exists():
-                try:
-                    tmp.unlink()
-                except Exception:
-                    pass
-    # Último intento directo (mensaje más claro si falla)
-    try:
-        p.write_text(payload, encoding="utf-8")
-    except PermissionError as e:
-        raise PermissionError(
-            f"No se pudo escribir {p}. Cierra otras instancias de Streamlit/OneDrive "
-            f"o espera a que sincronice, e inténtalo de nuevo. Detalle: {e}"
-        ) from (last_err or e)
+            raise PermissionError(
+                f"No se pudo escribir {p}. Cierra otras instancias de Streamlit/OneDrive "
+                f"o espera a que sincronice, e inténtalo de nuevo. Detalle: {e}"
+            ) from (last_err or e)
+
+class StorageBackend(ABC):
+    """Interfaz de persistencia de usuarios. Ver JsonFileBackend y app.sqlite_store.SQLiteBackend."""
+
+    name = "base"
+
+    @abstractmethod
+    def user_exists(self, username: str) -> bool: ...
+
+    @abstractmethod
+    def load_user(self, username: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def save_user(self, username: str, data: Dict[str, Any]) -> None: ...
+
+    @abstractmethod
+    def append_training_rows(self, username: str, rows: List[Dict[str, Any]]) -> None:
+        """Añade series sin reescribir el resto del documento."""
+
+    @abstractmethod
+    def list_usernames(self) -> List[str]: ...
+
+    @abstractmethod
+    def data_version(self, username: str) -> Optional[str]:
+        """Token opaco que cambia con cada escritura del usuario (None si no existe)."""
+
+
+class JsonFileBackend(StorageBackend):
+    """Un JSON por usuario en USERS_DIR (+ log append-only de series)."""
+
+    name = "json"
+
+    def user_exists(self, username: str) -> bool:
+        ensure_base_dirs()
+        return user_json_path(username).exists()
+
+    def load_user(self, username: str) -> Optional[Dict[str, Any]]:
+        return _json_load_user(username)
+
+    def save_user(self, username: str, data: Dict[str, Any]) -> None:
+        _json_save_user(username, data)
+
+    def append_training_rows(self, username: str, rows: List[Dict[str, Any]]) -> None:
+        _json_append_training_rows(username, rows)
+
+    def list_usernames(self) -> List[str]:
+        ensure_base_dirs()
+        # Solo <user>.json (excluye tokens <user>.reset.json e índices ocultos)
+        return sorted(
+            p.stem
+            for p in USERS_DIR.glob("*.json")
+            if not p.name.endswith(".reset.json") and not p.name.startswith(".")
+        )
+
+    def data_version(self, username: str) -> Optional[str]:
+        p = user_json_path(username)
+        if not p.exists():
+            p = user_json_path(username.lower())
+        sig = _doc_signature(p)
+        return None if sig[0] is None else json.dumps(sig)
+
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+def get_storage_backend() -> StorageBackend:
+    """Backend activo. VITALPEAK_STORAGE=sqlite activa SQLite (por defecto: json)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                kind = (os.getenv("VITALPEAK_STORAGE") or "json").strip().lower()
+                if kind == "sqlite":
+                    from .sqlite_store import SQLiteBackend
+                    _backend = SQLiteBackend()
+                else:
+                    _backend = JsonFileBackend()
+    return _backend
+
+def set_storage_backend(backend: Optional[StorageBackend]) -> None:
+    """Fija el backend (None → se vuelve a resolver desde el entorno)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+def user_exists(username: str) -> bool:
+    return get_storage_backend().user_exists(username)
+
+def load_user(username: str) -> Optional[Dict[str, Any]]:
+    return get_storage_backend().load_user(username)
+
+def save_user(username: str, data: Dict[str, Any]) -> None:
+    get_storage_backend().save_user(username, data)
+
+def append_training_rows(username: str, rows: List[Dict[str, Any]]) -> None:
+    """Añade series al historial del usuario sin reescribir el documento completo."""
+    if rows:
+        get_storage_backend().append_training_rows(username, rows)
+
+def list_usernames() -> List[str]:
+    return get_storage_backend().list_usernames()
+
+def user_data_version(username: str) -> Optional[str]:
+    """Versión de los datos del usuario, para invalidar cachés derivadas."""
+    return get_storage_backend().data_version(username)
+
+def new_user_data(password_hash: str = "", email: Optional[str] = None) -> Dict[str, Any]:
+    """Documento vacío de usuario (sin escribirlo a disco)."""
+    return {
+        "password": password_hash,
+        "email": email,
+        "recovery_email": email,
+        "profile": {},
+        "entrenamientos": [],
+        "rutinas": [],
+        "custom_exercises": [],
+        "exercise_meta": {},
+        "weights": [],
+        "objetivos": {"dias_semana": 3, "peso_objetivo": None, "ejercicios": {}},
+    }
 
 def ensure_user(username: str) -> Dict[str, Any]:
     ensure_base_dirs()
-    p = user_json_path(username)
-    if not p.exists():
-        data = {
-            "password": "",
-            "email": None,
-            "recovery_email": None,
-            "profile": {},
-            "entrenamientos": [],
-            "rutinas": [],
-            "custom_exercises": [],
-            "exercise_meta": {},
-            "weights": [],
-            "objetivos": {"dias_semana": 3, "peso_objetivo": None, "ejercicios": {}},
-        }
+    if not user_exists(username):
+        data = new_user_data()
         save_user(username, data)
         return data
     d = load_user(username) or {}
     return d
 
+@contextmanager
+def user_transaction(username: str) -> Iterator[Dict[str, Any]]:
+    """Unidad de trabajo: carga el documento una vez y lo guarda una sola vez al salir.
+
+    Si el bloque lanza una excepción no se escribe nada.
+
+        with user_transaction(user) as data:
+            data["rutinas"].append(...)
+            data["routine_plan"][fecha] = ...
+    """
+    data = load_user(username)
+    if data is None:
+        data = new_user_data()
+    yield data
+    save_user(username, data)
+
 def _pbkdf2_hash(password: str, *, iterations: int = 310_000) -> str:
     salt = secrets.token_bytes(16)
     dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
@@ -140,22 +479,11 @@ def authenticate(username: str, password: str) -> bool:
 
 def register_user(username: str, password: str, email: Optional[str]=None) -> bool:
     ensure_base_dirs()
-    p = user_json_path(username)
-    if p.exists():
+    if user_exists(username):
         return False
-    data = {
-        "password": _pbkdf2_hash(password),
-        "email": email,
-        "recovery_email": email,
-        "profile": {},
-        "entrenamientos": [],
-        "rutinas": [],
-        "custom_exercises": [],
-        "exercise_meta": {},
-        "weights": [],
-        "objetivos": {"dias_semana": 3, "peso_objetivo": None, "ejercicios": {}},
-    }
+    data = new_user_data(_pbkdf2_hash(password), email)
     save_user(username, data)
+    update_email_index(username, data)
     return True
 
 def set_account_email(username: str, email: str) -> None:
@@ -163,11 +491,105 @@ def set_account_email(username: str, email: str) -> None:
     d["email"] = email
     d.setdefault("recovery_email", email)
     save_user(username, d)
+    update_email_index(username, d)
 
 def set_recovery_email(username: str, email: str) -> None:
     d = ensure_user(username)
     d["recovery_email"] = email
     save_user(username, d)
+    update_email_index(username, d)
+
+# Índice email → usuario para "Olvidé mi contraseña" (evita abrir todos los
+# JSON). Es un fichero pequeño en USERS_DIR que se mantiene al cambiar emails y
+# se reconstruye entero si no existe o si una búsqueda no lo encuentra (o con
+# scripts/rebuild_email_index.py).
+EMAIL_INDEX_PATH = USERS_DIR / ".email_index.json"
+
+_email_index: Optional[Dict[str, str]] = None
+_email_index_sig: Optional[tuple] = None
+_email_index_lock = threading.Lock()
+
+def _norm_email(email: Any) -> str:
+    return str(email or "").strip().lower()
+
+def _user_emails(data: Optional[Dict[str, Any]]) -> set:
+    data = data or {}
+    return {e for e in (_norm_email(data.get("email")), _norm_email(data.get("recovery_email"))) if e}
+
+def _read_email_index() -> Optional[Dict[str, str]]:
+    global _email_index, _email_index_sig
+    sig = _stat_key(EMAIL_INDEX_PATH)
+    if sig is None:
+        return None
+    if _email_index is not None and _email_index_sig == sig:
+        return _email_index
+    try:
+        idx = json.loads(EMAIL_INDEX_PATH.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    if not isinstance(idx, dict):
+        return None
+    _email_index, _email_index_sig = idx, sig
+    return idx
+
+def _write_email_index(idx: Dict[str, str]) -> None:
+    global _email_index, _email_index_sig
+    ensure_base_dirs()
+    tmp = EMAIL_INDEX_PATH.with_name(EMAIL_INDEX_PATH.name + f".tmp.{os.getpid()}")
+    tmp.write_text(json.dumps(idx, ensure_ascii=False, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, EMAIL_INDEX_PATH)
+    _email_index, _email_index_sig = idx, _stat_key(EMAIL_INDEX_PATH)
+
+def rebuild_email_index() -> int:
+    """Recorre todos los usuarios y regenera el índice. Devuelve nº de emails indexados."""
+    idx: Dict[str, str] = {}
+    for username in list_usernames():
+        for e in _user_emails(load_user(username)):
+            idx.setdefault(e, username)
+    with _email_index_lock:
+        _write_email_index(idx)
+    return len(idx)
+
+def update_email_index(username: str, data: Optional[Dict[str, Any]] = None) -> None:
+    """Sincroniza en el índice los emails actuales de `username`."""
+    if not EMAIL_INDEX_PATH.exists():
+        # Sin índice todavía: se construye con todos los usuarios, no solo con este
+        rebuild_email_index()
+        return
+    if data is None:
+        data = load_user(username)
+    emails = _user_emails(data)
+    with _email_index_lock:
+        idx = dict(_read_email_index() or {})
+        changed = False
+        for e, u in list(idx.items()):
+            if u == username and e not in emails:
+                del idx[e]
+                changed = True
+        for e in emails:
+            if idx.get(e) != username:
+                idx[e] = username
+                changed = True
+        if changed or not EMAIL_INDEX_PATH.exists():
+            _write_email_index(idx)
+
+def find_user_by_email(email: str) -> Optional[str]:
+    """Usuario cuyo email o recovery_email coincide (sin distinguir mayúsculas)."""
+    key = _norm_email(email)
+    if not key:
+        return None
+    idx = _read_email_index()
+    if idx is None:
+        rebuild_email_index()
+        idx = _read_email_index() or {}
+    username = idx.get(key)
+    if username and key in _user_emails(load_user(username)):
+        return username
+    # Email ausente o entrada obsoleta (usuarios anteriores al índice, email
+    # cambiado sin pasar por set_*_email): reconstruir una vez
+    rebuild_email_index()
+    username = (_read_email_index() or {}).get(key)
+    return username or None
 
 def get_emails_for_user(username: str) -> dict:
     d = load_user(username) or {}
@@ -10,9 +10,6 @@ from .datastore import (
     register_user,
     load_user,
     save_user,
-    set_password,
-    set_account_email,
-    set_recovery_email,
 )
 
 
@@ -56,10 +53,8 @@ def maybe_seed_admin() -> None:
     try:
         existing = load_user(username)
         if existing is None:
+            # register_user ya guarda hash de contraseña, email y recovery_email
             register_user(username, password, email=email)
-            set_password(username, password)
-            set_account_email(username, email)
-            set_recovery_email(username, email)
         # Si ya existe, no reescribir credenciales en cada arranque (evita bloqueos OneDrive)
 
         data = load_user(username) or {}
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import threading
+from collections import Counter, OrderedDict
 from datetime import date, timedelta
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
 
-from .datastore import load_user, save_user
+from .datastore import load_user, save_user, user_data_version
 
 
 DEFAULT_GOALS: Dict[str, Any] = {
@@ -142,33 +144,111 @@ def week_range(d: date) -> Tuple[date, date]:
     return start, end
 
 
-def workout_days_in_range(username: str, start: date, end: date) -> int:
-    """Cuenta días únicos con al menos 1 serie registrada (entrenamientos) en el rango."""
+# Días entrenados por usuario, cacheados por versión de datos: un solo parseo de
+# fechas por escritura, en vez de uno por semana consultada.
+_DAYS_CACHE_MAX = 64
+_days_cache: "OrderedDict[str, Tuple[Optional[str], FrozenSet[date]]]" = OrderedDict()
+_days_cache_lock = threading.Lock()
+
+
+def training_days(username: str) -> FrozenSet[date]:
+    """Conjunto de días con al menos 1 serie registrada."""
+    version = user_data_version(username)
+    with _days_cache_lock:
+        hit = _days_cache.get(username)
+        if hit is not None and version is not None and hit[0] == version:
+            _days_cache.move_to_end(username)
+            return hit[1]
     data = load_user(username) or {}
-    entrenos = data.get("entrenamientos", []) or []
     days = set()
-    for e in entrenos:
+    for e in data.get("entrenamientos", []) or []:
         ds = e.get("date")
         if not ds:
             continue
         try:
-            dd = date.fromisoformat(str(ds)[:10])
+            days.add(date.fromisoformat(str(ds)[:10]))
         except Exception:
             continue
-        if start <= dd <= end:
-            days.add(dd)
-    return len(days)
+    out = frozenset(days)
+    with _days_cache_lock:
+        _days_cache[username] = (version, out)
+        _days_cache.move_to_end(username)
+        while len(_days_cache) > _DAYS_CACHE_MAX:
+            _days_cache.popitem(last=False)
+    return out
+
+
+def workout_days_in_range(username: str, start: date, end: date) -> int:
+    """Cuenta días únicos con al menos 1 serie registrada (entrenamientos) en el rango."""
+    return sum(1 for d in training_days(username) if start <= d <= end)
+
+
+def weekly_buckets(username: str, start: date, end: date) -> List[Dict[str, Any]]:
+    """Semanas (lunes–domingo) que cubren [start, end] con los días entrenados de cada una.
+
+    Una sola pasada sobre los días entrenados, sea cual sea el número de semanas.
+    """
+    first = week_start_monday(start)
+    last = week_start_monday(end)
+    counts: Counter = Counter(
+        week_start_monday(d) for d in training_days(username) if first <= d <= last + timedelta(days=6)
+    )
+    out: List[Dict[str, Any]] = []
+    ws = first
+    while ws <= last:
+        out.append({"week_start": ws, "week_end": ws + timedelta(days=6), "workouts": counts.get(ws, 0)})
+        ws += timedelta(days=7)
+    return out
 
 
 def weekly_workout_counts(username: str, weeks_back: int = 8, *, anchor: Optional[date] = None) -> List[Dict[str, Any]]:
     """Devuelve lista (semana_inicio, semana_fin, entrenos) para las últimas N semanas."""
     if anchor is None:
         anchor = date.today()
+    if weeks_back <= 0:
+        return []
     this_start = week_start_monday(anchor)
-    out: List[Dict[str, Any]] = []
-    for i in range(weeks_back - 1, -1, -1):
-        ws = this_start - timedelta(days=7 * i)
-        we = ws + timedelta(days=6)
-        c = workout_days_in_range(username, ws, we)
-        out.append({"week_start": ws, "week_end": we, "workouts": c})
-    return out
+    return weekly_buckets(username, this_start - timedelta(days=7 * (weeks_back - 1)), this_start)
+
+
+def week_streak(username: str, *, anchor: Optional[date] = None) -> int:
+    """Semanas consecutivas cumpliendo el objetivo de días (o con ≥1 entreno si no hay objetivo).
+
+    La semana en curso solo suma si ya se ha cumplido; si no, la racha cuenta desde la anterior.
+    """
+    if anchor is None:
+        anchor = date.today()
+    target = max(1, int(get_goals(username).get("dias_semana") or 0))
+    days = training_days(username)
+    if not days:
+        return 0
+    counts: Counter = Counter(week_start_monday(d) for d in days if d <= anchor)
+    ws = week_start_monday(anchor)
+    if counts.get(ws, 0) < target:
+        ws -= timedelta(days=7)
+    streak = 0
+    while counts.get(ws, 0) >= target:
+        streak += 1
+        ws -= timedelta(days=7)
+    return streak
+
+
+def weekly_adherence(username: str, weeks_back: int = 8, *, anchor: Optional[date] = None) -> Dict[str, Any]:
+    """Cumplimiento del objetivo semanal en las últimas N semanas.
+
+    weeks_met: semanas que alcanzan dias_semana; pct_weeks: % de semanas cumplidas;
+    pct_days: días hechos / días objetivo (cada semana limitada al objetivo).
+    """
+    target = int(get_goals(username).get("dias_semana") or 0)
+    hist = weekly_workout_counts(username, weeks_back, anchor=anchor)
+    if target <= 0 or not hist:
+        return {"target": target, "weeks": len(hist), "weeks_met": 0, "pct_weeks": None, "pct_days": None}
+    met = sum(1 for h in hist if h["workouts"] >= target)
+    done = sum(min(h["workouts"], target) for h in hist)
+    return {
+        "target": target,
+        "weeks": len(hist),
+        "weeks_met": met,
+        "pct_weeks": 100.0 * met / len(hist),
+        "pct_days": 100.0 * done / (target * len(hist)),
+    }
@@ -0,0 +1,543 @@
+"""Exportación / importación del historial (entrenamientos y peso corporal).
+
+Formatos:
+- "parquet" y "arrow" (Arrow IPC) con pyarrow, escribiendo por bloques de
+  `chunk_rows` filas para no materializar una tabla enorme en memoria;
+- "csv" en streaming (sin dependencias), usado como fallback si no hay pyarrow.
+
+La exportación a Excel del Historial (`export_entrenamientos_excel`) ordena las
+series por bloques volcados a temporales (_ExternalSorter) y escribe el libro
+con xlsxwriter en modo constant_memory, con memoria acotada.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Union
+
+from .datastore import load_user, user_transaction
+from .training import add_training_sets
+
+
+DATASETS: Dict[str, Dict[str, str]] = {
+    # columna → tipo lógico (str | int | float)
+    "entrenamientos": {"date": "str", "exercise": "str", "set": "int", "reps": "int", "weight": "float"},
+    "weights": {"date": "str", "weight": "float"},
+}
+
+FORMATS = ("parquet", "arrow", "csv")
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+MIME_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+    "csv": "text/csv",
+}
+
+DEFAULT_CHUNK_ROWS = 10_000
+
+Dest = Union[str, Path, BinaryIO]
+
+
+def has_pyarrow() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_format(fmt: str = "auto") -> str:
+    """"auto" → parquet si hay pyarrow, si no csv. Formatos columnar sin pyarrow → csv."""
+    fmt = (fmt or "auto").lower()
+    if fmt not in FORMATS and fmt != "auto":
+        raise ValueError(f"Formato no soportado: {fmt}")
+    if fmt in ("auto", "parquet", "arrow") and not has_pyarrow():
+        return "csv"
+    return "parquet" if fmt == "auto" else fmt
+
+
+def _cast(value: Any, kind: str) -> Any:
+    if value is None or value == "":
+        return None
+    try:
+        if kind == "int":
+            return int(float(value))
+        if kind == "float":
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    return str(value)
+
+
+def iter_chunks(
+    rows: Iterable[Dict[str, Any]],
+    dataset: str = "entrenamientos",
+    *,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> Iterator[Dict[str, List[Any]]]:
+    """Agrupa `rows` en bloques columnares {columna: [valores]} con tipos normalizados."""
+    cols = DATASETS[dataset]
+    chunk: Dict[str, List[Any]] = {c: [] for c in cols}
+    n = 0
+    for row in rows:
+        for c, kind in cols.items():
+            chunk[c].append(_cast(row.get(c), kind))
+        n += 1
+        if n >= chunk_rows:
+            yield chunk
+            chunk = {c: [] for c in cols}
+            n = 0
+    if n:
+        yield chunk
+
+
+def _arrow_schema(dataset: str):
+    import pyarrow as pa
+
+    types = {"str": pa.string(), "int": pa.int32(), "float": pa.float64()}
+    return pa.schema([(c, types[k]) for c, k in DATASETS[dataset].items()])
+
+
+def _open_binary(dest: Dest):
+    if isinstance(dest, (str, Path)):
+        return open(dest, "wb"), True
+    return dest, False
+
+
+def write_rows(
+    rows: Iterable[Dict[str, Any]],
+    dest: Dest,
+    *,
+    dataset: str = "entrenamientos",
+    fmt: str = "auto",
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> str:
+    """Escribe `rows` en `dest` (ruta o binario). Devuelve el formato usado."""
+    fmt = resolve_format(fmt)
+    fh, close = _open_binary(dest)
+    try:
+        if fmt == "csv":
+            text = io.TextIOWrapper(fh, encoding="utf-8", newline="", write_through=True)
+            try:
+                w = csv.writer(text)
+                w.writerow(list(DATASETS[dataset]))
+                for chunk in iter_chunks(rows, dataset, chunk_rows=chunk_rows):
+                    w.writerows(zip(*chunk.values()))
+            finally:
+                text.detach()
+            return fmt
+
+        import pyarrow as pa
+
+        schema = _arrow_schema(dataset)
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            writer = pq.ParquetWriter(fh, schema, compression="zstd")
+            write = writer.write_table
+        else:
+            writer = pa.ipc.new_file(fh, schema)
+            write = writer.write_table
+        try:
+            wrote = False
+            for chunk in iter_chunks(rows, dataset, chunk_rows=chunk_rows):
+                write(pa.Table.from_pydict(chunk, schema=schema))
+                wrote = True
+            if not wrote:
+                write(schema.empty_table())
+        finally:
+            writer.close()
+        return fmt
+    finally:
+        if close:
+            fh.close()
+
+
+def export_history(
+    username: str,
+    dest: Dest,
+    *,
+    dataset: str = "entrenamientos",
+    fmt: str = "auto",
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> str:
+    """Exporta entrenamientos o pesos del usuario. Devuelve el formato usado."""
+    data = load_user(username) or {}
+    return write_rows(data.get(dataset, []) or [], dest, dataset=dataset, fmt=fmt, chunk_rows=chunk_rows)
+
+
+def export_history_bytes(username: str, *, dataset: str = "entrenamientos", fmt: str = "auto") -> tuple:
+    """(bytes, formato) para st.download_button."""
+    buf = io.BytesIO()
+    used = export_history(username, buf, dataset=dataset, fmt=fmt)
+    return buf.getvalue(), used
+
+
+def _detect_format(src: Dest, fmt: Optional[str]) -> str:
+    if fmt and fmt != "auto":
+        return fmt
+    name = str(src) if isinstance(src, (str, Path)) else str(getattr(src, "name", ""))
+    for f, ext in EXTENSIONS.items():
+        if name.lower().endswith(ext):
+            return f
+    return "csv"
+
+
+def read_rows(
+    src: Dest,
+    *,
+    dataset: str = "entrenamientos",
+    fmt: Optional[str] = None,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Lee un fichero exportado y produce bloques de filas (listas de dicts)."""
+    cols = DATASETS[dataset]
+    fmt = _detect_format(src, fmt)
+    if fmt == "csv":
+        fh = open(src, "rb") if isinstance(src, (str, Path)) else src
+        text = io.TextIOWrapper(fh, encoding="utf-8", newline="")
+        try:
+            batch: List[Dict[str, Any]] = []
+            for rec in csv.DictReader(text):
+                batch.append({c: _cast(rec.get(c), k) for c, k in cols.items()})
+                if len(batch) >= chunk_rows:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        finally:
+            if isinstance(src, (str, Path)):
+                text.close()
+            else:
+                text.detach()
+        return
+
+    import pyarrow as pa
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        batches = pq.ParquetFile(src).iter_batches(batch_size=chunk_rows, columns=list(cols))
+    else:
+        reader = pa.ipc.open_file(src)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    for rb in batches:
+        pydict = rb.to_pydict()
+        n = rb.num_rows
+        yield [{c: _cast(pydict.get(c, [None] * n)[i], k) for c, k in cols.items()} for i in range(n)]
+
+
+# Al importar: columnas obligatorias (si faltan, la fila se descarta) y valores
+# por defecto para celdas vacías, iguales a los de training.add_training_sets.
+_IMPORT_REQUIRED: Dict[str, tuple] = {
+    "entrenamientos": ("date", "exercise"),
+    "weights": ("date", "weight"),
+}
+_IMPORT_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "entrenamientos": {"set": 1, "reps": 0, "weight": 0.0},
+    "weights": {},
+}
+
+
+def _import_row(row: Dict[str, Any], dataset: str) -> Optional[Dict[str, Any]]:
+    if any(row.get(c) in (None, "") for c in _IMPORT_REQUIRED[dataset]):
+        return None
+    out = dict(row)
+    for c, default in _IMPORT_DEFAULTS[dataset].items():
+        if out.get(c) is None:
+            out[c] = default
+    return out
+
+
+def import_history(
+    username: str,
+    src: Dest,
+    *,
+    dataset: str = "entrenamientos",
+    fmt: Optional[str] = None,
+    replace: bool = False,
+) -> int:
+    """Importa filas al usuario. Por defecto añade; con replace=True sustituye el dataset.
+
+    Las celdas vacías toman los valores por defecto de _IMPORT_DEFAULTS y las
+    filas sin columnas obligatorias se descartan, igual en ambos modos.
+    Devuelve el número de filas importadas.
+    """
+    total = 0
+    if dataset == "entrenamientos" and not replace:
+        for batch in read_rows(src, dataset=dataset, fmt=fmt):
+            clean = [r for r in (_import_row(r, dataset) for r in batch) if r is not None]
+            total += add_training_sets(username, clean)
+        return total
+
+    rows: List[Dict[str, Any]] = []
+    for batch in read_rows(src, dataset=dataset, fmt=fmt):
+        rows.extend(r for r in (_import_row(r, dataset) for r in batch) if r is not None)
+    with user_transaction(username) as data:
+        if replace:
+            data[dataset] = rows
+        else:
+            data.setdefault(dataset, []).extend(rows)
+    return len(rows)
+
+
+EXCEL_MODES = ("mes", "semana", "todo", "ejercicio")
+
+_SHEET_BAD_CHARS = set('[]:*?/\\')
+
+
+def _sheet_title(raw: str, used: set) -> str:
+    """Nombre de hoja válido (≤31 caracteres, sin []:*?/\\) y único."""
+    base = "".join("_" if ch in _SHEET_BAD_CHARS else ch for ch in raw).strip("'") or "Hoja"
+    base = base[:31]
+    title, i = base, 2
+    while title.lower() in used:
+        suffix = f" ({i})"
+        title = base[: 31 - len(suffix)] + suffix
+        i += 1
+    used.add(title.lower())
+    return title
+
+
+EXCEL_SORT_CHUNK_ROWS = 50_000  # filas ordenadas en memoria antes de volcarlas a un temporal
+
+
+class _ExternalSorter:
+    """Ordena tuplas sin tenerlas todas en memoria: bloques de `chunk_rows`
+    ordenados y volcados a temporales (JSON por línea), mezclados con heapq.merge.
+
+    La tupla se compara entera, así que debe empezar por la clave de orden y un
+    contador único (nunca se llega a comparar el resto). Si todo cabe en un
+    bloque no se escribe nada a disco.
+    """
+
+    def __init__(self, chunk_rows: int = EXCEL_SORT_CHUNK_ROWS) -> None:
+        self.chunk_rows = chunk_rows
+        self._buf: List[tuple] = []
+        self._runs: List[Any] = []
+
+    def add(self, item: tuple) -> None:
+        self._buf.append(item)
+        if len(self._buf) >= self.chunk_rows:
+            self._spill()
+
+    def _spill(self) -> None:
+        import tempfile
+
+        self._buf.sort()
+        f = tempfile.TemporaryFile("w+", encoding="utf-8")
+        for item in self._buf:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        f.seek(0)
+        self._runs.append(f)
+        self._buf = []
+
+    @staticmethod
+    def _read(f) -> Iterator[tuple]:
+        for line in f:
+            yield tuple(json.loads(line))
+
+    def __iter__(self) -> Iterator[tuple]:
+        import heapq
+
+        if not self._runs:
+            self._buf.sort()
+            yield from self._buf
+            return
+        if self._buf:
+            self._spill()
+        yield from heapq.merge(*(self._read(f) for f in self._runs))
+
+    def close(self) -> None:
+        for f in self._runs:
+            f.close()
+        self._runs, self._buf = [], []
+
+
+def _excel_group_key(modo: str, d) -> str:
+    if modo == "mes":
+        return d.strftime("%Y-%m")
+    if modo == "semana":
+        return d.strftime("%G-W%V")
+    return "Entrenamientos"
+
+
+def export_entrenamientos_excel(
+    rows: Iterable[Dict[str, Any]], modo: str = "mes", *, chunk_rows: int = EXCEL_SORT_CHUNK_ROWS
+) -> bytes:
+    """Excel consolidado escrito fila a fila (xlsxwriter en modo constant_memory).
+
+    Hojas: una por mes ("mes"), semana ISO ("semana"), ejercicio ("ejercicio") o
+    todo en una ("todo"); dentro, un bloque por día. Añade una hoja "Resumen"
+    (mejor set por día y ejercicio). Las series se leen una vez, se ordenan por
+    bloques con _ExternalSorter y se escriben en una pasada sobre la mezcla
+    ordenada; el resumen de cada (día, ejercicio) se cierra en cuanto cambia el
+    grupo. La memoria no depende del tamaño del historial (salvo el .xlsx
+    resultante, que se devuelve en bytes).
+    """
+    import xlsxwriter
+    from datetime import date as _date
+
+    from .training_stats import epley_1rm
+
+    if modo not in EXCEL_MODES:
+        raise ValueError(f"Modo no soportado: {modo}")
+
+    by_exercise = modo == "ejercicio"
+    cols = DATASETS["entrenamientos"]
+    sets = _ExternalSorter(chunk_rows)
+    # En modo ejercicio el resumen sale ordenado por (ejercicio, día) y hay que reordenarlo
+    res_sorter = _ExternalSorter(chunk_rows) if by_exercise else None
+
+    out = io.BytesIO()
+    wb = xlsxwriter.Workbook(out, {"constant_memory": True, "in_memory": False})
+    try:
+        for seq, r in enumerate(rows):
+            ds = str(r.get("date") or "")[:10]
+            try:
+                d = _date.fromisoformat(ds).toordinal()
+            except ValueError:
+                continue
+            ex = _cast(r.get("exercise"), cols["exercise"]) or ""
+            set_idx = _cast(r.get("set"), cols["set"])
+            k = (ex, d) if by_exercise else (d, ex)
+            sets.add(k + (set_idx if set_idx is not None else 0, seq, d, ex, set_idx,
+                          _cast(r.get("reps"), cols["reps"]), _cast(r.get("weight"), cols["weight"])))
+
+        bold = wb.add_format({"bold": True})
+        date_fmt = wb.add_format({"num_format": "yyyy-mm-dd"})
+        header = ["date", "exercise", "set", "reps", "weight"]
+        used_titles: set = set()
+        # Se crea primero para que quede como primera hoja
+        ws_res = wb.add_worksheet(_sheet_title("Resumen", used_titles))
+        res_header = ["Fecha", "Ejercicio", "Mejor peso", "Reps en mejor set", "Mejor 1RM est.",
+                      "Series", "Reps_tot", "Volumen", "Max_peso", "Max_1RM"]
+        for c, name in enumerate(res_header):
+            ws_res.write(0, c, name, bold)
+        res_row = 1
+
+        def write_summary(d_ord: int, ex: str, s: List[Any]) -> None:
+            nonlocal res_row
+            ws_res.write_datetime(res_row, 0, _date.fromordinal(d_ord), date_fmt)
+            ws_res.write(res_row, 1, ex)
+            for c, v in enumerate(s, start=2):
+                ws_res.write_number(res_row, c, v)
+            res_row += 1
+
+        def close_group(group: tuple, s: List[Any]) -> None:
+            # (día, ejercicio) es único por grupo: la tupla nunca se compara más allá
+            if res_sorter is not None:
+                res_sorter.add(group + tuple(s))
+            else:
+                write_summary(group[0], group[1], s)
+
+        ws = None
+        sheet_key = None
+        row = 0
+        block = None
+        group: Optional[tuple] = None
+        s: List[Any] = []
+        for item in sets:
+            d_ord, ex, set_idx, reps, weight = item[4:]
+            d = _date.fromordinal(d_ord)
+            key = ex if by_exercise else _excel_group_key(modo, d)
+            if key != sheet_key:
+                ws = wb.add_worksheet(_sheet_title(str(key), used_titles))
+                sheet_key, row, block = key, 0, None
+            if d != block:
+                if block is not None:
+                    row += 1  # línea en blanco entre días
+                ws.write(row, 0, f"Fecha: {d.isoformat()}"); row += 1
+                for c, name in enumerate(header):
+                    ws.write(row, c, name, bold)
+                row += 1
+                block = d
+            ws.write_datetime(row, 0, d, date_fmt)
+            ws.write(row, 1, ex)
+            for c, v in ((2, set_idx), (3, reps), (4, weight)):
+                if v is not None:
+                    ws.write_number(row, c, v)
+            row += 1
+
+            # Resumen por (día, ejercicio), misma regla que analytics.best_set_per_group
+            w, rp = float(weight or 0.0), int(reps or 0)
+            rm = float(epley_1rm(w, rp))
+            if (d_ord, ex) != group:
+                if group is not None:
+                    close_group(group, s)
+                group, s = (d_ord, ex), [w, rp, rm, 1, rp, w * rp, w, rm]
+            else:
+                if (rm, w, rp) > (s[2], s[0], s[1]):
+                    s[0], s[1], s[2] = w, rp, rm
+                s[3] += 1
+                s[4] += rp
+                s[5] += w * rp
+                s[6] = max(s[6], w)
+                s[7] = max(s[7], rm)
+        if group is not None:
+            close_group(group, s)
+        if res_sorter is not None:
+            for item in res_sorter:
+                write_summary(item[0], item[1], list(item[2:]))
+    finally:
+        sets.close()
+        if res_sorter is not None:
+            res_sorter.close()
+        wb.close()
+    return out.getvalue()
+
+
+def export_entrenamientos_excel_pandas(rows: Iterable[Dict[str, Any]], modo: str = "mes") -> bytes:
+    """Implementación anterior (un to_excel por día con startrow creciente).
+
+    Se mantiene como referencia para scripts/bench_excel_export.py; la app usa
+    export_entrenamientos_excel.
+    """
+    import pandas as pd
+
+    from . import analytics
+
+    if modo not in EXCEL_MODES:
+        raise ValueError(f"Modo no soportado: {modo}")
+    frames = [pd.DataFrame(chunk) for chunk in iter_chunks(rows, "entrenamientos")]
+    cols = list(DATASETS["entrenamientos"])
+    df_in = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=cols)
+
+    out = io.BytesIO()
+    with pd.ExcelWriter(out, engine="xlsxwriter") as writer:
+        # Hoja resumen: mejor set y volumen por día y ejercicio
+        resumen = analytics.daily_summary(analytics.normalize_sets(df_in.to_dict("records")), keys=["Fecha", "Ejercicio"])
+        resumen.to_excel(writer, sheet_name="Resumen", index=False)
+        df_in["date"] = pd.to_datetime(df_in["date"])
+        if modo == "todo":
+            sheet_name = "Entrenamientos"; row = 0
+            for dt, g in df_in.sort_values("date").groupby(df_in["date"].dt.date):
+                g2 = g.sort_values(["date","exercise","set"])
+                if sheet_name not in writer.sheets:
+                    writer.book.add_worksheet(sheet_name)
+                ws = writer.sheets[sheet_name]
+                ws.write(row, 0, f"Fecha: {dt.isoformat()}"); row += 1
+                g2.to_excel(writer, sheet_name=sheet_name, index=False, startrow=row)
+                row += len(g2) + 2
+        else:
+            if modo == "mes":
+                df_in["_key"] = df_in["date"].dt.strftime("%Y-%m")
+            elif modo == "ejercicio":
+                df_in["_key"] = df_in["exercise"].fillna("")
+            else:
+                df_in["_key"] = df_in["date"].dt.strftime("%G-W%V")
+            used_titles = {"resumen"}
+            for key, gkey in df_in.sort_values(["_key","date"]).groupby("_key"):
+                sheet = _sheet_title(str(key), used_titles) if modo == "ejercicio" else str(key); row = 0
+                for dt, gday in gkey.groupby(gkey["date"].dt.date):
+                    g2 = gday.drop(columns=["_key"]).sort_values(["date","exercise","set"])
+                    if sheet not in writer.sheets:
+                        writer.book.add_worksheet(sheet)
+                    ws = writer.sheets[sheet]
+                    ws.write(row, 0, f"Fecha: {dt.isoformat()}"); row += 1
+                    g2.to_excel(writer, sheet_name=sheet, index=False, startrow=row)
+                    row += len(g2) + 2
+    return out.getvalue()
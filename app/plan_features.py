@@ -0,0 +1,131 @@
+"""Clasificación de ejercicios por palabras clave para los validadores de la IA.
+
+Cada categoría es una lista de subcadenas (las mismas que usaban los
+validadores con `any(k in nombre for k in LISTA)`) compilada en una sola
+regex de alternativas. Cada nombre se normaliza y clasifica una vez
+(`exercise_features`, con caché LRU) y `plan_features` construye el registro
+de todo el plan en una pasada, que comparten todos los validar_*.
+"""
+
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple
+
+CORE_PREFIX = ("core:", "finisher:")
+
+CATEGORIES: Dict[str, Tuple[str, ...]] = {
+    # Estructura (validar_estructura_split / plan_repair)
+    "core": ("plancha", "abdominal", "core", "hollow", "dead bug", "pallof", "crunch", "elevación de piernas", "elevacion de piernas", "farmer"),
+    "triceps": ("tríceps", "triceps", "extensión tríceps", "extension triceps", "pushdown", "jalón de tríceps", "jalon de triceps", "fondos", "press francés", "press frances", "skull"),
+    "pierna": ("sentadilla", "prensa", "zancada", "femoral", "isquio", "gemelo", "cuádriceps", "cuadriceps", "glúteo", "gluteo", "hip thrust", "peso muerto rumano"),
+    "dia_pierna": ("legs", "pierna", "lower"),
+    # Comentarios del usuario (validar_comentarios)
+    "pierna_comentarios": ("pierna", "glúteo", "gluteo", "cuádriceps", "cuadriceps", "isquio", "femoral", "gemelo", "glutes", "legs"),
+    "cardio_comentarios": ("cardio", "cinta", "trote", "correr", "bicic", "elípt", "elipt", "escalador", "remo"),
+    "calentamiento": ("calentamiento",),
+    "estiramiento": ("estir",),
+    "maquina": ("máquina", "maquina", "machine", "selectorizada"),
+    "polea": ("polea", "poleas", "cable", "cables"),
+    "smith": ("smith",),
+    "barra": ("barra", "barbell"),
+    "mancuerna": ("mancuerna", "mancuernas", "dumbbell", "db"),
+    "biceps_nombre": ("biceps", "bíceps", "bicep", "bícep"),
+    "biceps_terminos": ("curl", "predicador", "martillo", "hammer curl", "inclinado con mancuernas"),
+    # Cobertura semanal de hipertrofia (validar_objetivo)
+    "cobertura_biceps": ("curl", "bíceps", "biceps", "martillo", "predicador"),
+    "cobertura_triceps": ("tríceps", "triceps", "jalón de tríceps", "extensión de tríceps", "fondos", "pushdown", "skull"),
+    "cobertura_lateral": ("elevaciones laterales", "lateral", "deltoide lateral", "laterales"),
+    # Cardio genérico (_is_cardio_exercise)
+    "cardio": ("cardio", "cinta", "trote", "correr", "run", "running", "elíptica", "eliptica", "bicicleta", "spinning", "remo", "erg", "hiit", "saltos", "jumping jacks", "burpees", "saltar comba", "comba", "escaladora", "stepper", "air bike"),
+}
+
+
+def compile_keywords(keywords: Sequence[str]) -> "re.Pattern[str]":
+    """Una regex de alternativas equivalente a `any(k in texto for k in keywords)`."""
+    alts = sorted({k for k in keywords if k}, key=len, reverse=True)
+    return re.compile("|".join(re.escape(k) for k in alts)) if alts else re.compile(r"(?!x)x")
+
+
+@lru_cache(maxsize=256)
+def keyword_matcher(keywords: Tuple[str, ...]) -> "re.Pattern[str]":
+    """compile_keywords con caché, para listas ad hoc (p. ej. 'evitar' del usuario)."""
+    return compile_keywords(keywords)
+
+
+MATCHERS: Dict[str, "re.Pattern[str]"] = {cat: compile_keywords(kws) for cat, kws in CATEGORIES.items()}
+
+
+def register_category(name: str, keywords: Sequence[str]) -> None:
+    """Añade (o sustituye) una categoría; invalida la caché de clasificación."""
+    CATEGORIES[name] = tuple(keywords)
+    MATCHERS[name] = compile_keywords(keywords)
+    exercise_features.cache_clear()
+
+
+class ExerciseFeatures(NamedTuple):
+    norm: str
+    tags: FrozenSet[str]
+
+    def has(self, tag: str) -> bool:
+        return tag in self.tags
+
+    @property
+    def is_core_prefixed(self) -> bool:
+        return self.norm.startswith(CORE_PREFIX)
+
+
+@lru_cache(maxsize=8192)
+def exercise_features(name: str) -> ExerciseFeatures:
+    """Nombre normalizado (strip + lower) y categorías en las que encaja."""
+    norm = (name or "").strip().lower()
+    return ExerciseFeatures(norm, frozenset(cat for cat, rx in MATCHERS.items() if rx.search(norm)))
+
+
+def features_of(obj: Any) -> ExerciseFeatures:
+    """Registro de un ejercicio/día (dict con 'nombre') o de un nombre suelto."""
+    if isinstance(obj, dict):
+        obj = obj.get("nombre", "")
+    return exercise_features(str(obj or ""))
+
+
+class DayFeatures(NamedTuple):
+    day: Optional[Dict[str, Any]]
+    name: ExerciseFeatures
+    exercises: List[Tuple[Dict[str, Any], ExerciseFeatures]]
+
+    def any(self, tag: str) -> bool:
+        return any(f.has(tag) for _, f in self.exercises)
+
+    def count(self, tag: str) -> int:
+        return sum(1 for _, f in self.exercises if f.has(tag))
+
+
+def day_features(d: Any) -> DayFeatures:
+    """Registro de un solo día (day=None si no es un dict)."""
+    if not isinstance(d, dict):
+        return DayFeatures(None, exercise_features(""), [])
+    ejs = d.get("ejercicios") or []
+    pairs = [(ej, features_of(ej)) for ej in (ejs if isinstance(ejs, list) else []) if isinstance(ej, dict)]
+    return DayFeatures(d, features_of(d), pairs)
+
+
+def plan_features(plan: Dict[str, Any]) -> List[DayFeatures]:
+    """Un DayFeatures por elemento de plan['dias'] (mismo índice; day=None si no es un dict)."""
+    dias = plan.get("dias") if isinstance(plan, dict) else None
+    return [day_features(d) for d in (dias if isinstance(dias, list) else [])]
+
+
+def day_is_lower(df: DayFeatures) -> bool:
+    """Día de pierna: lo dice el nombre o ≥50% de los ejercicios son de pierna."""
+    if df.name.has("dia_pierna"):
+        return True
+    n = len(df.exercises)
+    if not n:
+        return False
+    return df.count("pierna") >= max(1, round(n * 0.5))
+
+
+def day_has_core(df: DayFeatures) -> bool:
+    return any(f.is_core_prefixed or f.has("core") for _, f in df.exercises)
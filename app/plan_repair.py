@@ -0,0 +1,247 @@
+"""Reparación determinista de planes de la IA (sin llamar al modelo).
+
+Se ejecuta entre la validación y el refinado de call_gpt y corrige lo que se
+puede arreglar mecánicamente:
+
+- material prohibido en los comentarios (sin máquinas/poleas/Smith/barra/mancuernas)
+  o en 'evitar' → sustituto del catálogo;
+- ejercicios repetidos en la semana (salvo core/finisher) → sustituto;
+- tríceps en días de pierna → sustituto de pierna;
+- nº de ejercicios por día fuera de 5–8 (o del máximo pedido) → recorta/añade accesorios;
+- último ejercicio que no es 'Core:'/'Finisher:' → lo mueve o añade uno;
+- día por encima de la duración estimada (estimate_day_minutes) → recorta
+  descansos, series y accesorios.
+
+Los sustitutos salen de exercise_catalog.suggest_alternatives (mismo grupo
+muscular) y, si no queda ninguno válido, de los pools de rules_fallback.
+"""
+
+from __future__ import annotations
+
+import copy
+import re
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from .exercise_catalog import load_base_exercises, suggest_alternatives
+from .plan_features import CORE_PREFIX, day_features, day_is_lower, features_of, keyword_matcher
+from .rules_fallback import is_lower_exercise, upper_accessory_pool, generate_fallback
+
+MIN_EXERCISES = 5
+MAX_EXERCISES = 8
+DURATION_TOLERANCE_MIN = 5
+
+_CORE_FALLBACKS = ["Plancha", "Pallof press", "Dead bug", "Crunch en polea", "Elevación de piernas colgado", "Farmer walk"]
+_LOWER_POOL = ["Zancadas con mancuernas", "Hip thrust", "Curl femoral", "Gemelos de pie", "Sentadilla goblet", "Puente de glúteo"]
+
+# Material que se puede prohibir en comentarios/detalles → categoría de plan_features
+_EQUIPMENT_RULES = (
+    (re.compile(r"(?:no\s+máquinas|no\s+maquinas|sin\s+m[aá]quinas|solo\s+peso\s+libre)"), "maquina"),
+    (re.compile(r"(?:no\s+poleas|sin\s+poleas|no\s+cables?|sin\s+cables?)"), "polea"),
+    (re.compile(r"(?:no\s+smith|sin\s+smith)"), "smith"),
+    (re.compile(r"(?:no\s+barra[s]?|sin\s+barra[s]?)"), "barra"),
+    (re.compile(r"(?:no\s+mancuernas|sin\s+mancuernas)"), "mancuerna"),
+)
+
+
+def _nrm(s: Any) -> str:
+    return str(s or "").strip().lower()
+
+
+def forbidden_rules(A: Dict[str, Any], datos: Dict[str, Any]) -> Tuple[FrozenSet[str], Optional["re.Pattern[str]"]]:
+    """Categorías de material prohibidas según comentarios/detalles y matcher de la lista 'evitar'."""
+    txt = (str(datos.get("ia_detalles") or "") + " " + str(datos.get("comentarios") or "")).lower()
+    cats = frozenset(cat for rx, cat in _EQUIPMENT_RULES if rx.search(txt))
+    avoid = tuple(sorted({_nrm(e) for e in (A.get("evitar") or []) if _nrm(e)}))
+    return cats, (keyword_matcher(avoid) if avoid else None)
+
+
+def _max_per_day(datos: Dict[str, Any]) -> int:
+    txt = str(datos.get("comentarios") or "").lower()
+    m = re.search(r"(?:m[áa]ximo|max|como\s+mucho)\s+(\d+)\s+ejercicios\s+por\s+(?:sesión|sesion|d[ií]a|dia)", txt)
+    return min(MAX_EXERCISES, int(m.group(1))) if m else MAX_EXERCISES
+
+
+class _Repairer:
+    def __init__(self, plan: Dict[str, Any], A: Dict[str, Any], datos: Dict[str, Any]) -> None:
+        self.plan = plan
+        self.A = A
+        self.datos = datos
+        self.core_prefix = CORE_PREFIX
+        self.forbidden_cats, self.avoid = forbidden_rules(A, datos)
+        self.catalog = load_base_exercises()
+        self.actions: List[str] = []
+        self._pools: Dict[bool, List[str]] = {}
+        self.used: Set[str] = {
+            _nrm(ej.get("nombre"))
+            for d in self._days()
+            for ej in d["ejercicios"]
+        }
+
+    # --- utilidades ---
+    def _days(self) -> List[Dict[str, Any]]:
+        return [d for d in (self.plan.get("dias") or []) if isinstance(d, dict) and isinstance(d.get("ejercicios"), list)]
+
+    def _is_core(self, ej: Dict[str, Any]) -> bool:
+        f = features_of(ej)
+        return f.is_core_prefixed or f.has("core")
+
+    def _forbidden(self, name: Any) -> bool:
+        f = features_of(str(name or ""))
+        return bool(f.tags & self.forbidden_cats) or (self.avoid is not None and self.avoid.search(f.norm) is not None)
+
+    def _allowed(self, name: str) -> bool:
+        n = _nrm(name)
+        return bool(n) and n not in self.used and not self._forbidden(n)
+
+    def _fallback_pool(self, lower: bool) -> List[str]:
+        if lower not in self._pools:
+            pool = list(_LOWER_POOL) if lower else list(upper_accessory_pool())
+            plan = generate_fallback({"dias": 4, "duracion": self.A.get("duracion") or 60, "objetivo": self.A.get("objetivo") or "mixto"})
+            pool += [ej["nombre"] for d in plan["dias"] for ej in d["ejercicios"]]
+            self._pools[lower] = [c for c in pool if is_lower_exercise(c) == lower and not self._is_core({"nombre": c})]
+        return self._pools[lower]
+
+    def _substitute(self, name: str, *, lower: Optional[bool] = None) -> Optional[str]:
+        """Alternativa del mismo grupo que no esté usada ni prohibida (o una de los pools de respaldo)."""
+        if lower is None:
+            lower = is_lower_exercise(name)
+        cands: List[str] = []
+        if is_lower_exercise(name) == lower:
+            cands = suggest_alternatives(name, n=len(self.catalog), pool=self.catalog)
+        for c in cands + self._fallback_pool(lower):
+            if is_lower_exercise(c) == lower and self._allowed(c):
+                return c
+        return None
+
+    def _replace(self, d: Dict[str, Any], j: int, why: str, *, lower: Optional[bool] = None) -> bool:
+        ej = d["ejercicios"][j]
+        old = str(ej.get("nombre") or "")
+        new = self._substitute(old, lower=lower)
+        if new is None:
+            return False
+        d["ejercicios"][j] = dict(ej, nombre=new)
+        self.used.add(_nrm(new))
+        self.actions.append(f"{d.get('nombre', '')}: '{old}' → '{new}' ({why}).")
+        return True
+
+    # --- reglas ---
+    def fix_forbidden(self) -> None:
+        if not self.forbidden_cats and self.avoid is None:
+            return
+        for d in self._days():
+            keep = []
+            for j, ej in enumerate(d["ejercicios"]):
+                if self._forbidden(ej.get("nombre")) and not self._replace(d, j, "material/ejercicio no permitido"):
+                    self.actions.append(f"{d.get('nombre', '')}: se quita '{ej.get('nombre', '')}' (no permitido).")
+                    continue
+                keep.append(d["ejercicios"][j])
+            d["ejercicios"] = keep
+
+    def fix_duplicates(self) -> None:
+        seen: Set[str] = set()
+        for d in self._days():
+            for j, ej in enumerate(d["ejercicios"]):
+                n = _nrm(ej.get("nombre"))
+                if not n or n.startswith(self.core_prefix):
+                    continue
+                if n in seen:
+                    self._replace(d, j, "repetido en la semana")
+                    n = _nrm(d["ejercicios"][j].get("nombre"))
+                seen.add(n)
+
+    def fix_triceps_on_lower(self) -> None:
+        for d in self._days():
+            if not day_is_lower(day_features(d)):
+                continue
+            for j, ej in enumerate(d["ejercicios"]):
+                if features_of(ej).has("triceps"):
+                    self._replace(d, j, "tríceps en día de pierna", lower=True)
+
+    def fix_core_last(self) -> None:
+        for i, d in enumerate(self._days()):
+            ejs = d["ejercicios"]
+            if ejs and _nrm(ejs[-1].get("nombre")).startswith(self.core_prefix):
+                continue
+            idx = next((j for j in range(len(ejs) - 1, -1, -1) if self._is_core(ejs[j])), None)
+            if idx is not None:
+                ej = ejs.pop(idx)
+                name = str(ej.get("nombre") or "").strip()
+                if not _nrm(name).startswith(self.core_prefix):
+                    name = f"Core: {name}"
+                ejs.append(dict(ej, nombre=name))
+                self.actions.append(f"{d.get('nombre', '')}: '{name}' pasa a ser el último ejercicio.")
+                continue
+            base = next((c for c in _CORE_FALLBACKS if self._allowed(c)), _CORE_FALLBACKS[i % len(_CORE_FALLBACKS)])
+            core = {"nombre": f"Core: {base}", "series": 3, "reps": "30-45", "descanso": "45-60s", "notas": "core/finisher"}
+            # Si el día queda largo, fix_counts recorta accesorios conservando el core
+            ejs.append(core)
+            self.used.add(_nrm(base))
+            self.actions.append(f"{d.get('nombre', '')}: se añade '{core['nombre']}' al final.")
+
+    def fix_counts(self) -> None:
+        hi = _max_per_day(self.datos)
+        for d in self._days():
+            ejs = d["ejercicios"]
+            # Sobran: se quitan accesorios empezando por el penúltimo (se conservan principal, secundario y core)
+            while len(ejs) > hi and len(ejs) > 3:
+                removed = ejs.pop(-2)
+                self.actions.append(f"{d.get('nombre', '')}: se quita '{removed.get('nombre', '')}' (demasiados ejercicios).")
+            lower = day_is_lower(day_features(d))
+            # El relleno respeta también el máximo pedido por el usuario
+            while len(ejs) < min(MIN_EXERCISES, hi):
+                name = next((c for c in self._fallback_pool(lower) if self._allowed(c)), None)
+                if name is None:
+                    break
+                pos = len(ejs) - 1 if ejs and self._is_core(ejs[-1]) else len(ejs)
+                ejs.insert(pos, {"nombre": name, "series": 3, "reps": "10-15", "descanso": "60-90s"})
+                self.used.add(_nrm(name))
+                self.actions.append(f"{d.get('nombre', '')}: se añade '{name}' (pocos ejercicios).")
+
+    def fix_duration(self) -> None:
+        from .ai_generator import estimate_day_minutes, parse_rest_to_seconds
+
+        try:
+            budget = int(self.A.get("duracion") or self.datos.get("duracion") or 60) + DURATION_TOLERANCE_MIN
+        except Exception:
+            budget = 60 + DURATION_TOLERANCE_MIN
+        for d in self._days():
+            ejs = d["ejercicios"]
+            before = estimate_day_minutes(d)
+            if before <= budget:
+                continue
+            # 1) Descansos de accesorios a 60 s (principal y secundario intactos)
+            for ej in ejs[2:]:
+                if parse_rest_to_seconds(str(ej.get("descanso", "60s"))) > 60:
+                    ej["descanso"] = "60s"
+            # 2) Una serie menos por accesorio (mínimo 2), del último al primero
+            for ej in reversed(ejs[2:]):
+                if estimate_day_minutes(d) <= budget:
+                    break
+                try:
+                    s = int(ej.get("series") or 3)
+                except Exception:
+                    s = 3
+                if s > 2:
+                    ej["series"] = s - 1
+            # 3) Quitar accesorios (sin bajar del mínimo) antes del core
+            while estimate_day_minutes(d) > budget and len(ejs) > MIN_EXERCISES:
+                ejs.pop(-2)
+            after = estimate_day_minutes(d)
+            if after < before:
+                self.actions.append(f"{d.get('nombre', '')}: duración estimada {before:.0f} → {after:.0f} min.")
+
+    def run(self) -> Tuple[Dict[str, Any], List[str]]:
+        self.fix_forbidden()
+        self.fix_duplicates()
+        self.fix_triceps_on_lower()
+        self.fix_core_last()
+        self.fix_counts()
+        self.fix_duration()
+        return self.plan, self.actions
+
+
+def repair_plan(plan: Dict[str, Any], A: Dict[str, Any], datos: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """Aplica las reparaciones sobre una copia del plan. Devuelve (plan, acciones realizadas)."""
+    if not isinstance(plan, dict):
+        return plan, []
+    return _Repairer(copy.deepcopy(plan), A, datos).run()
@@ -0,0 +1,112 @@
+"""Parser JSON incremental para la generación de rutinas en streaming.
+
+Recibe el texto del modelo token a token y devuelve cada día de `dias` en
+cuanto se cierra su objeto, sin esperar al final de la respuesta. Tolera
+texto o fences ```json antes del JSON (se ignora todo hasta la primera '{').
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+DAYS_KEYS = ("dias", "dias_semana", "days", "workout")
+
+
+class IncrementalDaysParser:
+    """Máquina de estados por carácter: cada token se recorre una sola vez."""
+
+    def __init__(self) -> None:
+        self._chunks: List[str] = []
+        self._started = False
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+        self._str_buf: List[str] = []
+        self._last_str: Optional[str] = None
+        self._last_str_depth = -1
+        self._pending_key: Optional[str] = None
+        self._days_depth: Optional[int] = None
+        self._day_buf: Optional[List[str]] = None
+        self.days: List[Dict[str, Any]] = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Añade texto y devuelve los días que se han completado con él."""
+        if not chunk:
+            return []
+        self._chunks.append(chunk)
+        out: List[Dict[str, Any]] = []
+        for ch in chunk:
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+            if self._day_buf is not None:
+                self._day_buf.append(ch)
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+                    try:
+                        self._last_str = json.loads('"' + "".join(self._str_buf) + '"')
+                    except ValueError:
+                        self._last_str = None
+                    self._last_str_depth = self._depth
+                    continue
+                self._str_buf.append(ch)
+                continue
+            if ch == '"':
+                self._in_str = True
+                self._str_buf = []
+            elif ch == ":":
+                self._pending_key = self._last_str if self._last_str_depth == self._depth else None
+            elif ch in "{[":
+                if (
+                    ch == "["
+                    and self._days_depth is None
+                    and isinstance(self._pending_key, str)
+                    and self._pending_key.lower() in DAYS_KEYS
+                ):
+                    self._days_depth = self._depth + 1
+                elif ch == "{" and self._days_depth is not None and self._depth == self._days_depth:
+                    self._day_buf = [ch]
+                self._depth += 1
+                self._pending_key = None
+            elif ch in "}]":
+                self._depth -= 1
+                if ch == "}" and self._day_buf is not None and self._depth == self._days_depth:
+                    day = self._parse_day("".join(self._day_buf))
+                    self._day_buf = None
+                    if day is not None:
+                        self.days.append(day)
+                        out.append(day)
+                elif ch == "]" and self._days_depth is not None and self._depth == self._days_depth - 1:
+                    # Fin de la lista de días: los objetos siguientes ya no son días
+                    self._days_depth = -1
+            elif ch == ",":
+                self._pending_key = None
+        return out
+
+    @staticmethod
+    def _parse_day(fragment: str) -> Optional[Dict[str, Any]]:
+        try:
+            day = json.loads(fragment)
+        except ValueError:
+            return None
+        return day if isinstance(day, dict) else None
+
+
+def iter_plan_days(tokens: Iterable[str], parser: Optional[IncrementalDaysParser] = None) -> Iterator[Dict[str, Any]]:
+    """Consume `tokens` y va devolviendo cada día completo; el texto queda en `parser.text`."""
+    parser = parser or IncrementalDaysParser()
+    for tok in tokens:
+        for day in parser.feed(tok):
+            yield day
@@ -1,15 +1,18 @@
 from __future__ import annotations
 
 import base64
+import binascii
+import hashlib
 import json
 import os
 import tempfile
 import time
 import uuid
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Literal, Optional
+from typing import Any, Iterator, Literal, Optional
 
 import cv2
 import httpx
@@ -22,11 +25,11 @@ from .supabase_utils import (
     get_supabase_client,
     supabase_config_status,
     storage_remove,
-    storage_signed_url,
-    storage_upload_bytes,
+    storage_signed_urls,
+    storage_upload_many,
 )
 
-from .datastore import ensure_base_dirs, load_user, save_user, USERS_DIR
+from .datastore import ensure_base_dirs, list_usernames, load_user, save_user, user_transaction, USERS_DIR
 
 
 Exercise = Literal["squat", "deadlift", "bench_press"]
@@ -40,6 +43,11 @@ class PostureResult:
     video_url: Any
     # For Supabase mode, values are signed URLs. For local fallback, values are data URLs.
     keyframe_urls: dict[str, str]
+    # Sizes/timings: {"preprocess": {...}, "service_sec": .., "storage_sec": ..}
+    report: dict[str, Any] = field(default_factory=dict)
+
+
+_DATA_URL_PREFIX = "data:image/jpeg;base64,"
 
 
 def _now_iso() -> str:
@@ -74,7 +82,106 @@ def _save_local_history(user_id: str, rows: list[dict[str, Any]]) -> None:
 
 
 def _data_url_jpeg(jpg_bytes: bytes) -> str:
-    return "data:image/jpeg;base64," + base64.b64encode(jpg_bytes).decode("utf-8")
+    return _DATA_URL_PREFIX + base64.b64encode(jpg_bytes).decode("utf-8")
+
+
+# --- Local keyframe blob store ---
+# Keyframes are stored once per user under posture_media/<user>/blobs/<2 hex>/<sha256>.jpg
+# and records only keep {"label", "blob": <sha256>}. Keeping the JPEGs out of the
+# user document keeps load_user/save_user small.
+
+def _blob_dir(user_id: str) -> Path:
+    return _local_media_dir(user_id) / "blobs"
+
+
+def keyframe_blob_path(user_id: str, digest: str) -> Path:
+    return _blob_dir(user_id) / digest[:2] / f"{digest}.jpg"
+
+
+def put_keyframe_blob(user_id: str, jpg_bytes: bytes) -> str:
+    """Store JPEG bytes by content; returns the SHA-256 hex digest (idempotent)."""
+    digest = hashlib.sha256(jpg_bytes).hexdigest()
+    p = keyframe_blob_path(user_id, digest)
+    if not p.exists():
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(p.name + f".tmp.{os.getpid()}")
+        tmp.write_bytes(jpg_bytes)
+        os.replace(tmp, p)
+    return digest
+
+
+@lru_cache(maxsize=64)
+def _blob_data_url(path: str, mtime_ns: int) -> str:
+    return _data_url_jpeg(Path(path).read_bytes())
+
+
+def keyframe_data_url(user_id: str, kf: dict[str, Any]) -> str:
+    """Data URL for a local keyframe record (built lazily from the blob; legacy inline data_url kept)."""
+    if kf.get("data_url"):
+        return str(kf["data_url"])
+    digest = kf.get("blob")
+    if not digest:
+        return ""
+    p = keyframe_blob_path(user_id, str(digest))
+    try:
+        return _blob_data_url(str(p), p.stat().st_mtime_ns)
+    except OSError:
+        return ""
+
+
+def _local_keyframe_refs(user_id: str, frames: dict[str, bytes]) -> list[dict[str, Any]]:
+    return [{"label": lbl, "blob": put_keyframe_blob(user_id, frames[lbl])} for lbl in ("start", "mid", "end")]
+
+
+def _remove_unreferenced_blobs(user_id: str, digests: set[str], rows: list[dict[str, Any]]) -> None:
+    still_used = {str(kf.get("blob")) for r in rows for kf in (r.get("keyframes") or []) if isinstance(kf, dict)}
+    for digest in digests - still_used:
+        try:
+            keyframe_blob_path(user_id, digest).unlink(missing_ok=True)
+        except Exception:
+            pass
+
+
+def migrate_local_keyframes(user_id: str) -> int:
+    """Move inline base64 keyframes of a user's local history into the blob store.
+
+    Returns how many keyframes were migrated (0 if there was nothing to do;
+    the user document is only rewritten in that case).
+    """
+    u = load_user(user_id) or {}
+    if not any(
+        isinstance(kf, dict) and kf.get("data_url")
+        for r in (u.get("posture_analyses") or []) if isinstance(r, dict)
+        for kf in (r.get("keyframes") or [])
+    ):
+        return 0
+    moved = 0
+    with user_transaction(user_id) as data:
+        for r in data.get("posture_analyses") or []:
+            if not isinstance(r, dict):
+                continue
+            for kf in r.get("keyframes") or []:
+                url = kf.get("data_url") if isinstance(kf, dict) else None
+                if not isinstance(url, str) or not url.startswith("data:"):
+                    continue
+                try:
+                    jpg = base64.b64decode(url.split(",", 1)[1], validate=True)
+                except (IndexError, binascii.Error, ValueError):
+                    continue
+                kf["blob"] = put_keyframe_blob(user_id, jpg)
+                kf.pop("data_url", None)
+                moved += 1
+    return moved
+
+
+def migrate_all_local_keyframes() -> dict[str, int]:
+    """Run migrate_local_keyframes for every user; returns {user: migrated} for users with changes."""
+    out: dict[str, int] = {}
+    for user_id in list_usernames():
+        n = migrate_local_keyframes(user_id)
+        if n:
+            out[user_id] = n
+    return out
 
 
 def _b64_jpeg(img_bgr) -> bytes:
@@ -84,11 +191,193 @@ def _b64_jpeg(img_bgr) -> bytes:
     return bytes(buf)
 
 
-def extract_keyframes(video_path: str) -> tuple[dict[str, bytes], dict[str, Any]]:
-    """Extract 3 keyframes (start/mid/end) from a video.
+KEYFRAME_LABELS = ("start", "mid", "end")
+MOTION_SAMPLE_FPS = 10.0  # decoded frames analysed per second of video
+MOTION_SAMPLE_WIDTH = 160  # width of the grayscale frames used for differencing
+MOTION_MAX_SAMPLES = 1200
+KEYFRAME_CANDIDATES = 48  # JPEG candidates kept in memory (bounded, thinned as the clip grows)
+KEYFRAME_MAX_WIDTH = 1280
+
+
+def _resize_max_width(img, max_width: int):
+    h, w = img.shape[:2]
+    if w <= max_width:
+        return img
+    return cv2.resize(img, (max_width, int(round(h * max_width / w))), interpolation=cv2.INTER_AREA)
+
+
+def _smooth(values: list[float], window: int) -> list[float]:
+    if window <= 1 or len(values) < 3:
+        return list(values)
+    half = window // 2
+    prefix = [0.0]
+    for v in values:
+        prefix.append(prefix[-1] + v)
+    out = []
+    for i in range(len(values)):
+        lo, hi = max(0, i - half), min(len(values), i + half + 1)
+        out.append((prefix[hi] - prefix[lo]) / (hi - lo))
+    return out
+
+
+def _argmin(values: list[float], lo: int, hi: int) -> int:
+    lo, hi = max(0, lo), min(len(values) - 1, hi)
+    if hi < lo:
+        return max(0, min(len(values) - 1, lo))
+    return min(range(lo, hi + 1), key=lambda i: values[i])
+
+
+def _motion_segment(energy: list[float], samples_per_sec: float) -> Optional[tuple[list[float], int, int]]:
+    """Smoothed energy plus first/last sample with clear motion, or None for a static clip."""
+    if len(energy) < 5:
+        return None
+    s = _smooth(energy, max(1, int(round(samples_per_sec * 0.3))))
+    lo_e, hi_e = min(s), max(s)
+    if hi_e - lo_e < 0.5:  # mean absolute difference in gray levels
+        return None
+    thr = lo_e + 0.25 * (hi_e - lo_e)
+    active = [i for i, v in enumerate(s) if v > thr]
+    return s, active[0], active[-1]
+
+
+def select_key_moments(energy: list[float], samples_per_sec: float) -> Optional[dict[str, int]]:
+    """Pick start/mid/end sample indices from a motion-energy series.
+
+    Motion drops to a minimum where the bar turns around, so:
+    - start: calmest sample in the second before motion begins (top),
+    - mid: calmest sample in the central part of the active segment (bottom),
+    - end: calmest sample in the second after motion stops (top again).
+    Returns None when there is no clear motion (static clip).
+    """
+    seg = _motion_segment(energy, samples_per_sec)
+    if seg is None:
+        return None
+    s, a, b = seg
+    win = max(1, int(round(samples_per_sec)))
+    span = b - a
+    return {
+        "start": _argmin(s, a - win, a),
+        "mid": _argmin(s, a + int(span * 0.2), b - int(span * 0.2)) if span >= 4 else (a + b) // 2,
+        "end": _argmin(s, b, b + win),
+    }
+
+
+class _CandidateFrames:
+    """At most `limit` JPEG frames spread over the clip: the calmest frame of each bucket.
 
-    This is intentionally simple for MVP. We also return basic metadata.
+    Buckets span `every` samples; when there are too many, neighbouring buckets
+    are merged (keeping the calmer frame) and `every` doubles. Turnaround points
+    are motion minima, so the calmest frame of a bucket is the best stand-in for
+    a key moment that falls inside it.
     """
+
+    def __init__(self, limit: int = KEYFRAME_CANDIDATES, max_width: int = KEYFRAME_MAX_WIDTH) -> None:
+        self.limit = max(3, limit)
+        self.max_width = max_width
+        self.every = 1
+        self.items: list[tuple[int, float, bytes]] = []  # (sample index, energy, jpeg)
+        self._open: Optional[tuple[int, float, Any]] = None  # best frame of the current bucket
+
+    def offer(self, sample_idx: int, energy: float, frame_bgr) -> None:
+        if self._open is not None and self._open[0] // self.every != sample_idx // self.every:
+            self._close()
+        if self._open is None or energy < self._open[1]:
+            self._open = (sample_idx, energy, frame_bgr)
+
+    def _close(self) -> None:
+        idx, energy, frame = self._open
+        self._open = None
+        self.items.append((idx, energy, _b64_jpeg(_resize_max_width(frame, self.max_width))))
+        while len(self.items) > self.limit:
+            self.every *= 2
+            merged: dict[int, tuple[int, float, bytes]] = {}
+            for it in self.items:
+                b = it[0] // self.every
+                if b not in merged or it[1] < merged[b][1]:
+                    merged[b] = it
+            self.items = sorted(merged.values())
+
+    def nearest(self, sample_idx: int) -> tuple[int, bytes]:
+        if self._open is not None:
+            self._close()
+        idx, _, jpg = min(self.items, key=lambda it: abs(it[0] - sample_idx))
+        return idx, jpg
+
+
+def _extract_keyframes_motion(video_path: str) -> tuple[dict[str, bytes], dict[str, Any]]:
+    """Single sequential pass: no seeks, small grayscale differencing, bounded memory."""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError("No se pudo abrir el vídeo")
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        stride = max(1, int(round(fps / MOTION_SAMPLE_FPS))) if fps else 3
+        if total > 0:
+            stride = max(stride, -(-total // MOTION_MAX_SAMPLES))
+
+        candidates = _CandidateFrames()
+        frame_idx: list[int] = []
+        energy: list[float] = []
+        prev = None
+        idx = -1
+        while True:
+            # grab() advances without copying/converting the frame; retrieve() only on samples
+            if not cap.grab():
+                break
+            idx += 1
+            if idx % stride:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok or frame is None:
+                continue
+            small = cv2.cvtColor(_resize_max_width(frame, MOTION_SAMPLE_WIDTH), cv2.COLOR_BGR2GRAY)
+            small = cv2.GaussianBlur(small, (5, 5), 0)
+            e = float(cv2.absdiff(small, prev).mean()) if prev is not None and prev.shape == small.shape else 0.0
+            energy.append(e)
+            prev = small
+            candidates.offer(len(frame_idx), e, frame)
+            frame_idx.append(idx)
+    finally:
+        cap.release()
+
+    if not frame_idx:
+        raise RuntimeError("No se pudo leer frames del vídeo")
+    if energy:
+        energy[0] = energy[1] if len(energy) > 1 else 0.0
+
+    samples_per_sec = (fps / stride) if fps else MOTION_SAMPLE_FPS
+    picks = select_key_moments(energy, samples_per_sec)
+    method = "motion"
+    if picks is None:
+        # Static clip: fixed 10/50/90% positions over what was decoded
+        n = len(frame_idx)
+        picks = {"start": int(n * 0.10), "mid": int(n * 0.50), "end": min(n - 1, int(n * 0.90))}
+        method = "fixed"
+
+    frames: dict[str, bytes] = {}
+    key_idx: dict[str, int] = {}
+    for lbl in KEYFRAME_LABELS:
+        sample, jpg = candidates.nearest(picks[lbl])
+        frames[lbl] = jpg
+        key_idx[lbl] = frame_idx[sample]
+
+    n_frames = total if total > 0 else idx + 1
+    duration = (n_frames / fps) if fps else 0
+    meta = {
+        "fps": float(fps) if fps else None,
+        "total_frames": int(n_frames),
+        "duration_sec": int(round(duration)) if duration else None,
+        "keyframe_method": method,
+        "keyframe_frames": key_idx,
+        # motion energy per sampled frame (mean abs gray difference to the previous sample)
+        "motion": {"frame_idx": frame_idx, "energy": [round(e, 3) for e in energy]},
+    }
+    return frames, meta
+
+
+def _extract_keyframes_seek(video_path: str) -> tuple[dict[str, bytes], dict[str, Any]]:
+    """Previous strategy: seek to 10%/50%/90% of the clip."""
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         raise RuntimeError("No se pudo abrir el vídeo")
@@ -125,10 +414,193 @@ def extract_keyframes(video_path: str) -> tuple[dict[str, bytes], dict[str, Any]
         "fps": float(fps) if fps else None,
         "total_frames": int(total),
         "duration_sec": int(round(duration)) if duration else None,
+        "keyframe_method": "seek",
     }
     return frames, meta
 
 
+def extract_keyframes(
+    video_path: str, mode: Literal["motion", "seek"] = "motion"
+) -> tuple[dict[str, bytes], dict[str, Any]]:
+    """Extract 3 keyframes (start/mid/end) from a video, plus basic metadata.
+
+    "motion" (default) decodes the clip once, measures frame-to-frame motion
+    on small grayscale samples and picks the top / bottom / top of the rep;
+    meta["motion"] carries the motion-energy series. "seek" is the previous
+    fixed 10/50/90% strategy.
+    """
+    if mode == "seek":
+        return _extract_keyframes_seek(video_path)
+    return _extract_keyframes_motion(video_path)
+
+
+# --- Video preprocessing before upload ---
+PREPROCESS_MAX_HEIGHT = 720
+PREPROCESS_FPS = 15.0
+PREPROCESS_PAD_SEC = 0.75  # kept around the active segment when trimming
+
+
+def preprocess_enabled() -> bool:
+    return (os.getenv("POSTURE_PREPROCESS") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+_WRITER_FOURCCS = ("avc1", "mp4v")
+BROWSER_CODECS = ("avc1",)  # codecs browsers can play from <video>; mp4v (MPEG-4 Part 2) is not one
+
+
+@lru_cache(maxsize=None)
+def _codec_available(fourcc: str) -> bool:
+    """One-time probe: can this OpenCV build encode `fourcc` into an .mp4? (uses a scratch file)."""
+    import numpy as np
+
+    fd, probe = tempfile.mkstemp(prefix="vitalpeak_codec_", suffix=".mp4")
+    os.close(fd)
+    writer = cv2.VideoWriter(probe, cv2.VideoWriter_fourcc(*fourcc), 10.0, (16, 16))
+    try:
+        if not writer.isOpened():
+            return False
+        writer.write(np.zeros((16, 16, 3), dtype=np.uint8))
+        return True
+    except Exception:
+        return False
+    finally:
+        writer.release()
+        try:
+            os.remove(probe)
+        except OSError:
+            pass
+
+
+def _open_writer(path: str, fps: float, size: tuple[int, int]):
+    # H.264 plays in browsers; mp4v is the codec every OpenCV build can write.
+    # Codecs that failed the probe are skipped; a failure on the real path
+    # (bad directory, transient I/O) does not change what later calls try.
+    fourccs = [f for f in _WRITER_FOURCCS if _codec_available(f)] or list(_WRITER_FOURCCS)
+    for fourcc in fourccs:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if writer.isOpened():
+            return writer, fourcc
+        writer.release()
+    raise RuntimeError("No se pudo crear el vídeo de salida")
+
+
+def _sampled_frames(cap, fps_in: float, fps_out: float) -> Iterator[int]:
+    """grab() every frame and yield the input frame number each time the output clock advances."""
+    n = 0
+    while cap.grab():
+        n += 1
+        if int(n * fps_out / fps_in) != int((n - 1) * fps_out / fps_in):
+            yield n
+
+
+def preprocess_video(
+    src_path: str,
+    dst_path: str,
+    *,
+    max_height: Optional[int] = None,
+    target_fps: Optional[float] = None,
+    trim: bool = True,
+) -> dict[str, Any]:
+    """Downscale, drop frames, trim to the active segment and re-encode `src_path` into `dst_path`.
+
+    Frames are resized to at most `max_height` (POSTURE_MAX_HEIGHT) and
+    subsampled to `target_fps` (POSTURE_TARGET_FPS). With `trim`, a first
+    decode only measures motion on small grayscale frames to find the active
+    segment (plus padding); the second decode encodes just that range from
+    the original, so the output is a single lossy generation. Audio is
+    dropped. Returns a report with sizes, resolution, fps, duration, codec
+    (`playable` tells whether browsers can show it) and timings.
+    """
+    max_height = int(max_height or _env_number("POSTURE_MAX_HEIGHT", PREPROCESS_MAX_HEIGHT))
+    target_fps = float(target_fps or _env_number("POSTURE_TARGET_FPS", PREPROCESS_FPS))
+    t0 = time.perf_counter()
+    cap = cv2.VideoCapture(src_path)
+    if not cap.isOpened():
+        raise RuntimeError("No se pudo abrir el vídeo")
+    fps_in = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    fps_out = min(fps_in, target_fps)
+
+    first, last = 0, None
+    n_in = n_kept = 0
+    if trim:
+        energy: list[float] = []
+        prev = None
+        try:
+            for n_in in _sampled_frames(cap, fps_in, fps_out):
+                ok, frame = cap.retrieve()
+                if not ok or frame is None:
+                    continue
+                small = cv2.GaussianBlur(cv2.cvtColor(_resize_max_width(frame, MOTION_SAMPLE_WIDTH), cv2.COLOR_BGR2GRAY), (5, 5), 0)
+                energy.append(float(cv2.absdiff(small, prev).mean()) if prev is not None else 0.0)
+                prev = small
+        finally:
+            cap.release()
+        n_kept = len(energy)
+        seg = _motion_segment(energy, fps_out)
+        if seg is not None:
+            pad = int(round(PREPROCESS_PAD_SEC * fps_out))
+            first, last = max(0, seg[1] - pad), min(n_kept - 1, seg[2] + pad)
+        cap = cv2.VideoCapture(src_path)
+    t_scan = time.perf_counter() - t0
+
+    writer = None
+    codec = ""
+    size_in = size_out = (0, 0)
+    n_out = 0
+    k = -1
+    try:
+        for n in _sampled_frames(cap, fps_in, fps_out):
+            n_in = max(n_in, n)
+            k += 1
+            if k < first:
+                continue
+            if last is not None and k > last:
+                break
+            ok, frame = cap.retrieve()
+            if not ok or frame is None:
+                continue
+            if writer is None:
+                h, w = frame.shape[:2]
+                size_in = (w, h)
+                scale = min(1.0, max_height / float(h))
+                size_out = (max(2, int(w * scale) // 2 * 2), max(2, int(h * scale) // 2 * 2))
+                writer, codec = _open_writer(dst_path, fps_out, size_out)
+            if (frame.shape[1], frame.shape[0]) != size_out:
+                frame = cv2.resize(frame, size_out, interpolation=cv2.INTER_AREA)
+            writer.write(frame)
+            n_out += 1
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.release()
+    if writer is None:
+        raise RuntimeError("No se pudo leer frames del vídeo")
+    trimmed = first > 0 or (last is not None and last < n_kept - 1)
+
+    return {
+        "bytes_in": os.path.getsize(src_path),
+        "bytes_out": os.path.getsize(dst_path),
+        "resolution_in": list(size_in),
+        "resolution_out": list(size_out),
+        "fps_in": round(float(fps_in), 2),
+        "fps_out": round(float(fps_out), 2),
+        "duration_in_sec": round(n_in / fps_in, 2) if fps_in else None,
+        "duration_out_sec": round(n_out / fps_out, 2) if fps_out else None,
+        "trimmed": [first, first + n_out - 1] if trimmed else None,
+        "codec": codec,
+        "playable": codec in BROWSER_CODECS,
+        "scan_sec": round(t_scan, 3),
+        "total_sec": round(time.perf_counter() - t0, 3),
+    }
+
+
 def _normalize_posture_analysis(raw: Any, exercise: Exercise) -> dict[str, Any]:
     """Normalize/validate analysis payload from the posture microservice."""
     if not isinstance(raw, dict):
@@ -195,10 +667,16 @@ def analyze_and_store_posture(
     video_bytes: bytes,
     posture_api_url: Optional[str] = None,
     signed_url_ttl_sec: int = 3600,
+    preprocess: Optional[bool] = None,
 ) -> PostureResult:
     """MVP (gratis): envía el vídeo a un microservicio de postura (MediaPipe) y guarda el resultado.
 
     - El análisis NO usa OpenAI.
+    - Antes de enviarlo, el vídeo se recorta al tramo con movimiento, se reduce
+      (POSTURE_MAX_HEIGHT / POSTURE_TARGET_FPS) y se recodifica (preprocess_video;
+      POSTURE_PREPROCESS=0 lo desactiva). Si no sale más pequeño se usa el original.
+      El vídeo reducido solo se guarda si el navegador puede reproducirlo (H.264);
+      si OpenCV solo pudo escribir mp4v, se analiza el reducido y se guarda el original.
     - Si Supabase está configurado, guarda vídeo+keyframes+historial de forma persistente.
       Si no, guarda localmente (best-effort; en Streamlit Cloud puede perderse).
     """
@@ -214,6 +692,26 @@ def analyze_and_store_posture(
     with open(video_path, "wb") as f:
         f.write(video_bytes)
 
+    # --- Downscale/trim/re-encode before any upload
+    # video_bytes goes to the posture service; stored_bytes is what the user plays back
+    report: dict[str, Any] = {}
+    stored_bytes = video_bytes
+    if preprocess_enabled() if preprocess is None else preprocess:
+        small_path = os.path.join(tmpdir, "upload_small.mp4")
+        try:
+            prep = preprocess_video(video_path, small_path)
+        except Exception as e:
+            prep = {"error": str(e)}
+        prep["used"] = bool(prep.get("bytes_out")) and prep["bytes_out"] < len(video_bytes)
+        if prep["used"]:
+            video_path = small_path
+            with open(small_path, "rb") as f:
+                video_bytes = f.read()
+            if prep.get("playable"):
+                stored_bytes = video_bytes
+        prep["stored"] = bool(prep["used"] and prep.get("playable"))
+        report["preprocess"] = prep
+
     # --- Extract frames
     frames, meta = extract_keyframes(video_path)
 
@@ -227,6 +725,7 @@ def analyze_and_store_posture(
         )
 
     endpoint = api_url.rstrip("/") + "/analyze"
+    t_service = time.perf_counter()
     try:
         with httpx.Client(timeout=90.0) as client:
             r = client.post(
@@ -238,6 +737,7 @@ def analyze_and_store_posture(
         analysis_raw = r.json()
     except Exception as e:
         raise RuntimeError(f"Fallo al llamar al servicio de postura: {e}")
+    report["service_sec"] = round(time.perf_counter() - t_service, 3)
 
     analysis = _normalize_posture_analysis(analysis_raw, exercise)
 
@@ -254,10 +754,16 @@ def analyze_and_store_posture(
             "end": f"keyframes/{base_prefix}_end.jpg",
         }
 
-        # Upload media
-        storage_upload_bytes(sb, bucket, video_key, video_bytes, "video/mp4", upsert=True)
-        for lbl, key in kf_keys.items():
-            storage_upload_bytes(sb, bucket, key, frames[lbl], "image/jpeg", upsert=True)
+        # Upload media (video + keyframes concurrently)
+        t_storage = time.perf_counter()
+        storage_upload_many(
+            sb,
+            bucket,
+            [(video_key, stored_bytes, "video/mp4")] + [(key, frames[lbl], "image/jpeg") for lbl, key in kf_keys.items()],
+            upsert=True,
+        )
+        report["storage_sec"] = round(time.perf_counter() - t_storage, 3)
+        report["uploaded_bytes"] = len(stored_bytes)
 
         row = {
             "user_id": user_id,
@@ -289,20 +795,22 @@ def analyze_and_store_posture(
         if db_id:
             analysis_id = str(db_id)
 
-        video_url = storage_signed_url(sb, bucket, video_key, expires_sec=signed_url_ttl_sec)
-        keyframe_urls = {lbl: storage_signed_url(sb, bucket, key, expires_sec=signed_url_ttl_sec) for lbl, key in kf_keys.items()}
+        urls = storage_signed_urls(sb, bucket, [video_key, *kf_keys.values()], expires_sec=signed_url_ttl_sec)
+        video_url = urls.get(video_key, "")
+        keyframe_urls = {lbl: urls.get(key, "") for lbl, key in kf_keys.items()}
 
         return PostureResult(
             analysis=analysis,
             analysis_id=analysis_id,
             video_url=video_url,
             keyframe_urls=keyframe_urls,
+            report=report,
         )
 
     # --- Local fallback
     media_dir = _local_media_dir(user_id)
     video_file = media_dir / f"{analysis_id}_{ts}.mp4"
-    video_file.write_bytes(video_bytes)
+    video_file.write_bytes(stored_bytes)
 
     record = {
         "id": analysis_id,
@@ -314,12 +822,8 @@ def analyze_and_store_posture(
         "top_cues": analysis.get("top_cues", []),
         "metrics": analysis.get("metrics", {}),
         "video_path": str(video_file),
-        # store keyframes as data URLs so UI can render without external storage
-        "keyframes": [
-            {"label": "start", "data_url": _data_url_jpeg(frames["start"])},
-            {"label": "mid", "data_url": _data_url_jpeg(frames["mid"])},
-            {"label": "end", "data_url": _data_url_jpeg(frames["end"])},
-        ],
+        # keyframes live in the blob store; the record only keeps their SHA-256
+        "keyframes": _local_keyframe_refs(user_id, frames),
         "duration_sec": meta.get("duration_sec"),
         "created_at": _now_iso(),
         "model_version": "mvp_local_fallback_v1",
@@ -328,19 +832,20 @@ def analyze_and_store_posture(
     rows = _load_local_history(user_id)
     rows.insert(0, record)
     # keep last 200
-    if len(rows) > 200:
+    dropped = rows[200:]
+    if dropped:
         rows = rows[:200]
     _save_local_history(user_id, rows)
+    if dropped:
+        digests = {str(kf["blob"]) for r in dropped for kf in (r.get("keyframes") or []) if isinstance(kf, dict) and kf.get("blob")}
+        _remove_unreferenced_blobs(user_id, digests, rows)
 
     return PostureResult(
         analysis=analysis,
         analysis_id=analysis_id,
-        video_url=video_bytes,
-        keyframe_urls={
-            "start": record["keyframes"][0]["data_url"],
-            "mid": record["keyframes"][1]["data_url"],
-            "end": record["keyframes"][2]["data_url"],
-        },
+        video_url=stored_bytes,
+        keyframe_urls={lbl: _data_url_jpeg(frames[lbl]) for lbl in ("start", "mid", "end")},
+        report=report,
     )
 
 
@@ -361,10 +866,17 @@ def list_posture_history(user_id: str, limit: int = 50) -> list[dict[str, Any]]:
     return res.data or []
 
 
-def get_signed_urls_for_record(record: dict[str, Any], ttl_sec: int = 3600) -> tuple[str, dict[str, str]]:
+def get_signed_urls_for_record(
+    record: dict[str, Any], ttl_sec: int = 3600, *, as_paths: bool = False
+) -> tuple[str, dict[str, str]]:
+    """Video + keyframe URLs for a history row.
+
+    Local fallback: video bytes and keyframe data URLs built lazily from the
+    blob store (or the blob file paths with `as_paths=True`, e.g. for st.image).
+    """
     sb = get_supabase_client()
     if sb is None:
-        # local fallback: return video bytes + keyframe data-urls
+        # local fallback: return video bytes + keyframe data-urls / paths
         video_data: Any = ""
         vp = record.get("video_path")
         try:
@@ -372,24 +884,50 @@ def get_signed_urls_for_record(record: dict[str, Any], ttl_sec: int = 3600) -> t
                 video_data = Path(vp).read_bytes()
         except Exception:
             video_data = ""
+        user_id = str(record.get("user_id") or "")
         kf_urls: dict[str, str] = {}
         for kf in (record.get("keyframes") or []):
             lbl = kf.get("label")
             if not lbl:
                 continue
-            if kf.get("data_url"):
-                kf_urls[str(lbl)] = str(kf.get("data_url"))
+            if as_paths and kf.get("blob") and user_id:
+                kf_urls[str(lbl)] = str(keyframe_blob_path(user_id, str(kf["blob"])))
+                continue
+            url = keyframe_data_url(user_id, kf) if user_id else str(kf.get("data_url") or "")
+            if url:
+                kf_urls[str(lbl)] = url
         return video_data, kf_urls
+    return get_signed_urls_for_records([record], ttl_sec)[0]
+
+
+def _record_storage_paths(record: dict[str, Any]) -> tuple[str, dict[str, str]]:
+    kf_paths = {
+        str(kf["label"]): str(kf["path"])
+        for kf in (record.get("keyframes") or [])
+        if isinstance(kf, dict) and kf.get("label") and kf.get("path")
+    }
+    return str(record.get("video_path") or ""), kf_paths
+
+
+def get_signed_urls_for_records(
+    records: list[dict[str, Any]], ttl_sec: int = 3600, *, as_paths: bool = False
+) -> list[tuple[Any, dict[str, str]]]:
+    """get_signed_urls_for_record for a whole history page.
+
+    With Supabase, every path of every record is signed in a single batched
+    request (cached URLs are reused), instead of one round-trip per file.
+    """
+    sb = get_supabase_client()
+    if sb is None:
+        return [get_signed_urls_for_record(r, ttl_sec, as_paths=as_paths) for r in records]
     bucket = get_supabase_bucket("posture")
-    video_path = record.get("video_path") or ""
-    video_url = storage_signed_url(sb, bucket, video_path, expires_sec=ttl_sec) if video_path else ""
-    kf_urls: dict[str, str] = {}
-    for kf in (record.get("keyframes") or []):
-        lbl = kf.get("label")
-        path = kf.get("path")
-        if lbl and path:
-            kf_urls[str(lbl)] = storage_signed_url(sb, bucket, str(path), expires_sec=ttl_sec)
-    return video_url, kf_urls
+    per_record = [_record_storage_paths(r) for r in records]
+    all_paths = [p for video, kfs in per_record for p in (video, *kfs.values()) if p]
+    urls = storage_signed_urls(sb, bucket, all_paths, expires_sec=ttl_sec)
+    return [
+        (urls.get(video, "") if video else "", {lbl: urls.get(p, "") for lbl, p in kfs.items()})
+        for video, kfs in per_record
+    ]
 
 
 def delete_posture_record(user_id: str, record_id: str) -> None:
@@ -412,6 +950,8 @@ def delete_posture_record(user_id: str, record_id: str) -> None:
             except Exception:
                 pass
             _save_local_history(user_id, new_rows)
+            digests = {str(kf["blob"]) for kf in (removed.get("keyframes") or []) if isinstance(kf, dict) and kf.get("blob")}
+            _remove_unreferenced_blobs(user_id, digests, new_rows)
         return
     bucket = get_supabase_bucket("posture")
     # Read record to get paths
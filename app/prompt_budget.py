@@ -0,0 +1,146 @@
+"""Medición y compactación de prompts del creador de rutinas IA.
+
+Un prompt se representa como lista de secciones (nombre, texto). Aquí se:
+- estiman tokens por sección (tiktoken si está instalado; si no, ~4 caracteres/token);
+- eliminan reglas repetidas (líneas '- ...' que ya aparecieron en una sección anterior);
+- renderiza la forma canónica compacta (sin espacios sobrantes ni líneas vacías dobles);
+- aplica un presupuesto de tokens quitando secciones opcionales.
+
+Configuración:
+    VITALPEAK_AI_PROMPT_COMPACT=1     0 = prompt detallado original
+    VITALPEAK_AI_PROMPT_BUDGET=0      tokens máximos del prompt (0 = sin límite)
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import tiktoken
+except Exception:
+    tiktoken = None  # type: ignore
+
+CHARS_PER_TOKEN = 4.0
+
+
+class PromptSection(NamedTuple):
+    name: str
+    text: str
+    optional: bool = False  # se puede quitar si no cabe en el presupuesto
+
+
+def compact_enabled() -> bool:
+    return (os.getenv("VITALPEAK_AI_PROMPT_COMPACT") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def token_budget() -> int:
+    try:
+        return max(0, int(os.getenv("VITALPEAK_AI_PROMPT_BUDGET") or 0))
+    except ValueError:
+        return 0
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    """Tokens del texto (exactos con tiktoken; estimación por caracteres si no está)."""
+    if not text:
+        return 0
+    enc = _encoding()
+    if enc is not None:
+        return len(enc.encode(text))
+    return int(round(len(text) / CHARS_PER_TOKEN)) or 1
+
+
+def _rule_key(line: str) -> str:
+    """Forma normalizada de una regla: minúsculas, sin tildes, puntuación ni espacios extra."""
+    s = unicodedata.normalize("NFKD", line.lower())
+    s = "".join(c for c in s if not unicodedata.combining(c))
+    s = re.sub(r"[^\w\s]", " ", s)
+    return " ".join(s.split())
+
+
+def dedupe_rules(sections: Iterable[PromptSection]) -> List[PromptSection]:
+    """Quita las reglas ('- ...') ya dichas en una sección anterior o en la misma."""
+    seen = set()
+    out: List[PromptSection] = []
+    for sec in sections:
+        lines = []
+        for line in sec.text.splitlines():
+            if line.lstrip().startswith("- "):
+                key = _rule_key(line)
+                if key in seen:
+                    continue
+                seen.add(key)
+            lines.append(line)
+        out.append(sec._replace(text="\n".join(lines)))
+    return out
+
+
+def compact_text(text: str) -> str:
+    """Sin espacios al final de línea ni bloques de líneas vacías."""
+    lines = [line.rstrip() for line in text.strip().splitlines()]
+    out: List[str] = []
+    for line in lines:
+        if not line and (not out or not out[-1]):
+            continue
+        out.append(line)
+    return "\n".join(out)
+
+
+def apply_budget(sections: Sequence[PromptSection], max_tokens: int) -> List[PromptSection]:
+    """Quita secciones opcionales (de la última a la primera) hasta caber en max_tokens."""
+    kept = list(sections)
+    if max_tokens <= 0:
+        return kept
+    for sec in reversed(list(sections)):
+        if estimate_tokens(render(kept)) <= max_tokens:
+            break
+        if sec.optional:
+            kept.remove(sec)
+    return kept
+
+
+def render(sections: Iterable[PromptSection], *, compact: bool = True) -> str:
+    if not compact:
+        return "".join(sec.text for sec in sections)
+    return "\n\n".join(t for t in (compact_text(sec.text) for sec in sections) if t) + "\n"
+
+
+def canonical(sections: Sequence[PromptSection], *, max_tokens: Optional[int] = None) -> str:
+    """Forma canónica compacta: reglas sin duplicar, texto compactado y presupuesto aplicado."""
+    secs = dedupe_rules(sections)
+    secs = apply_budget(secs, token_budget() if max_tokens is None else max_tokens)
+    return render(secs)
+
+
+def section_report(
+    sections: Sequence[PromptSection], *, compact: bool = True, max_tokens: Optional[int] = None
+) -> Dict[str, Any]:
+    """Tokens por sección y total del texto que se envía (forma compacta con presupuesto, o detallada)."""
+    secs = list(sections)
+    if compact:
+        secs = apply_budget(dedupe_rules(secs), token_budget() if max_tokens is None else max_tokens)
+    per: Dict[str, int] = {}
+    for sec in secs:
+        per[sec.name] = per.get(sec.name, 0) + estimate_tokens(compact_text(sec.text) if compact else sec.text)
+    text = render(secs, compact=compact)
+    return {"sections": per, "total": estimate_tokens(text), "chars": len(text)}
+
+
+def compare(verbose: str, compact: str) -> Tuple[int, int, float]:
+    """(tokens detallado, tokens compacto, ahorro en %)."""
+    a, b = estimate_tokens(verbose), estimate_tokens(compact)
+    return a, b, (100.0 * (a - b) / a) if a else 0.0
@@ -2,8 +2,8 @@ from __future__ import annotations
 
 from typing import Any, Dict, List, Optional
 
-from .datastore import load_user, save_user
-from .training import add_training_set
+from .datastore import load_user, save_user, user_transaction
+from .training import add_training_sets
 
 
 def list_routines(username: str) -> List[Dict]:
@@ -22,6 +22,12 @@ def add_routine(
     routines = data.get("rutinas", [])
     if any(r.get("name") == name for r in routines):
         raise ValueError("Ya existe una rutina con ese nombre")
+    routines.append(_routine_entry(name, items, days))
+    data["rutinas"] = routines
+    save_user(username, data)
+
+
+def _routine_entry(name: str, items: List[Dict], days: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
     entry: Dict[str, Any] = {"name": name, "items": list(items or [])}
     if days:
         entry["kind"] = "program"
@@ -31,9 +37,7 @@ def add_routine(
             for d in days:
                 flat.extend(list(d.get("items") or []))
             entry["items"] = flat
-    routines.append(entry)
-    data["rutinas"] = routines
-    save_user(username, data)
+    return entry
 
 
 def delete_routine(username: str, name: str) -> None:
@@ -92,13 +96,16 @@ def materialize_program_days(username: str, routine: Dict[str, Any]) -> List[str
     if not is_program(routine):
         return [sessions[0]["name"]] if sessions else []
 
-    existing = {r.get("name") for r in list_routines(username)}
     names: List[str] = []
-    for s in sessions:
-        names.append(s["name"])
-        if s["name"] not in existing:
-            add_routine(username, s["name"], s["items"])
-            existing.add(s["name"])
+    # Todas las rutinas hijas en una sola escritura
+    with user_transaction(username) as data:
+        routines = data.setdefault("rutinas", [])
+        existing = {r.get("name") for r in routines}
+        for s in sessions:
+            names.append(s["name"])
+            if s["name"] not in existing:
+                routines.append(_routine_entry(s["name"], s["items"]))
+                existing.add(s["name"])
     return names
 
 
@@ -116,13 +123,13 @@ def apply_routine(username: str, routine_name: str, date_iso: str) -> int:
     if is_program(routine) and routine.get("days"):
         # Preferir no usar el plan crudo en un solo día
         items = routine.get("items", [])
-    count = 0
+    rows: List[Dict[str, Any]] = []
     for item in items:
         ex = item.get("exercise")
         sets = int(item.get("sets", 1))
         reps = int(item.get("reps", 10))
         weight = float(item.get("weight", 0.0))
         for s in range(1, sets + 1):
-            add_training_set(username, date_iso, ex, s, reps, weight)
-            count += 1
-    return count
+            rows.append({"date": date_iso, "exercise": ex, "set": s, "reps": reps, "weight": weight})
+    # Una sola escritura para toda la rutina
+    return add_training_sets(username, rows)
@@ -68,7 +68,7 @@ def wants_single_leg_day(datos: dict) -> bool:
     return any(k in txt for k in keys)
 
 
-def _is_lower_exercise(name: str) -> bool:
+def is_lower_exercise(name: str) -> bool:
     n = str(name).lower()
     lower_kw = [
         "sentadilla", "squat", "prensa", "zancad", "extension cu", "extensión cu",
@@ -76,7 +76,7 @@ def _is_lower_exercise(name: str) -> bool:
     ]
     return any(k in n for k in lower_kw)
 
-def _upper_accessory_pool():
+def upper_accessory_pool():
     return [
         "Face pulls", "Pájaros mancuernas", "Remo en polea", "Curl bíceps barra",
         "Extensión tríceps polea", "Elevaciones laterales", "Press inclinado mancuernas",
@@ -89,11 +89,11 @@ def enforce_single_leg_day(plan: dict) -> dict:
     dias = plan.get("dias") or plan.get("semanal") or plan
 
     def replace_lower_with_upper(e_list):
-        pool = _upper_accessory_pool()
+        pool = upper_accessory_pool()
         new_list = []
         for e in e_list:
             name = e.get("nombre") if isinstance(e, dict) else str(e)
-            if _is_lower_exercise(name):
+            if is_lower_exercise(name):
                 rep = {"nombre": pool[len(new_list) % len(pool)], "series": 3, "reps": "10-15", "descanso": "60-90s"}
                 new_list.append(rep)
             else:
@@ -106,7 +106,7 @@ def enforce_single_leg_day(plan: dict) -> dict:
         leg_days = []
         for d, exs in dias.items():
             ex_list = exs if isinstance(exs, list) else exs.get("ejercicios", [])
-            if any(_is_lower_exercise(e.get("nombre") if isinstance(e, dict) else e) for e in ex_list):
+            if any(is_lower_exercise(e.get("nombre") if isinstance(e, dict) else e) for e in ex_list):
                 leg_days.append(d)
         if len(leg_days) > 1:
             for d in leg_days[1:]:
@@ -120,7 +120,7 @@ def enforce_single_leg_day(plan: dict) -> dict:
         leg_idx = []
         for idx, day in enumerate(dias):
             ex_list = day.get("ejercicios", [])
-            if any(_is_lower_exercise(e.get("nombre") if isinstance(e, dict) else e) for e in ex_list):
+            if any(is_lower_exercise(e.get("nombre") if isinstance(e, dict) else e) for e in ex_list):
                 leg_idx.append(idx)
         if len(leg_idx) > 1:
             for idx in leg_idx[1:]:
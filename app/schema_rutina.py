@@ -1,3 +1,5 @@
+import copy
+from functools import lru_cache
 from typing import List, Optional, Literal, Dict, Any
 from pydantic import BaseModel, Field, conint, validator
 
@@ -44,6 +46,45 @@ class Rutina(BaseModel):
     dias: List[Dia]
     progresion: Progresion
 
+def _model_schema(model) -> Dict[str, Any]:
+    if hasattr(model, "model_json_schema"):
+        return model.model_json_schema()
+    return model.schema()  # pydantic v1
+
+
+def _inline_refs(node: Any, defs: Dict[str, Any]) -> Any:
+    """Sustituye los $ref a $defs por su contenido (no todos los servidores resuelven $ref)."""
+    if isinstance(node, dict):
+        ref = node.get("$ref")
+        if isinstance(ref, str) and ref.split("/")[-1] in defs:
+            return _inline_refs(defs[ref.split("/")[-1]], defs)
+        return {k: _inline_refs(v, defs) for k, v in node.items() if k not in ("$defs", "definitions", "title")}
+    if isinstance(node, list):
+        return [_inline_refs(v, defs) for v in node]
+    return node
+
+
+@lru_cache(maxsize=8)
+def _json_schema(name: str) -> Dict[str, Any]:
+    model = {"rutina": Rutina, "dia": Dia}[name]
+    raw = _model_schema(model)
+    defs = raw.get("$defs") or raw.get("definitions") or {}
+    return _inline_refs(raw, defs)
+
+
+def rutina_json_schema(dias: Optional[int] = None) -> Dict[str, Any]:
+    """JSON Schema autocontenido de Rutina (para salida estructurada); con `dias` fija la longitud de la lista."""
+    schema = copy.deepcopy(_json_schema("rutina"))
+    if dias:
+        schema["properties"]["dias"]["minItems"] = int(dias)
+        schema["properties"]["dias"]["maxItems"] = int(dias)
+    return schema
+
+
+def dia_json_schema() -> Dict[str, Any]:
+    """JSON Schema autocontenido de un solo Dia (refinado por día)."""
+    return copy.deepcopy(_json_schema("dia"))
+
 def validar_negocio(data: Dict[str, Any]) -> list[str]:
     errors: list[str] = []
     rutina = Rutina(**data)
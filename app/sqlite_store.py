@@ -0,0 +1,393 @@
+"""Backend SQLite (modo WAL) para los datos de usuario.
+
+Se activa con VITALPEAK_STORAGE=sqlite. La ruta de la base de datos sale de
+VITALPEAK_SQLITE_PATH (por defecto usuarios_data/vitalpeak.db).
+
+Entrenamientos, pesos, rutinas, planificador y objetivos van en tablas
+indexadas por usuario; el resto del documento (perfil, contraseña, emails,
+meta de ejercicios...) se guarda como JSON en `users.doc`. Para los JSON
+existentes:
+
+    python scripts/migrate_to_sqlite.py
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .datastore import USERS_DIR, JsonFileBackend, StorageBackend, ensure_base_dirs
+
+
+DEFAULT_DB_PATH = USERS_DIR / "vitalpeak.db"
+
+# Claves del documento que viven en tablas propias
+TABLE_KEYS = ("entrenamientos", "weights", "rutinas", "routine_plan", "objetivos")
+
+_TRAINING_COLS = ("date", "exercise", "set", "reps", "weight")
+_WEIGHT_COLS = ("date", "weight")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username   TEXT PRIMARY KEY,
+    doc        TEXT NOT NULL,
+    sections   TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS trainings (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    username  TEXT NOT NULL,
+    date      TEXT,
+    exercise  TEXT,
+    set_index INTEGER,
+    reps      INTEGER,
+    weight    REAL,
+    extra     TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_trainings_user_date ON trainings(username, date);
+CREATE INDEX IF NOT EXISTS ix_trainings_user_exercise ON trainings(username, exercise, date);
+CREATE TABLE IF NOT EXISTS weights (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    date     TEXT,
+    weight   REAL,
+    extra    TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_weights_user_date ON weights(username, date);
+CREATE TABLE IF NOT EXISTS routines (
+    username TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name     TEXT,
+    data     TEXT NOT NULL,
+    PRIMARY KEY (username, position)
+);
+CREATE INDEX IF NOT EXISTS ix_routines_user_name ON routines(username, name);
+CREATE TABLE IF NOT EXISTS routine_plan (
+    username TEXT NOT NULL,
+    date     TEXT NOT NULL,
+    routine  TEXT,
+    PRIMARY KEY (username, date)
+);
+CREATE TABLE IF NOT EXISTS goals (
+    username TEXT PRIMARY KEY,
+    data     TEXT NOT NULL
+);
+"""
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def _section_hash(value: Any) -> str:
+    raw = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _split_row(row: Dict[str, Any], cols: tuple) -> tuple:
+    extra = {k: v for k, v in row.items() if k not in cols}
+    return tuple(row.get(c) for c in cols) + (_dumps(extra) if extra else None,)
+
+
+def _join_row(values: tuple, cols: tuple, extra: Optional[str]) -> Dict[str, Any]:
+    out = dict(zip(cols, values))
+    if extra:
+        try:
+            out.update(json.loads(extra))
+        except Exception:
+            pass
+    return out
+
+
+class _LoadedDoc(dict):
+    """Documento devuelto por load_user con el estado de la base en ese momento.
+
+    `sections`: hash de cada sección tal como se leyó; `trainings_max_id`: mayor
+    trainings.id leído. save_user solo reescribe las secciones que el documento
+    ha cambiado desde entonces y conserva las series añadidas después
+    (append_training_rows desde otra sesión).
+    """
+
+    sections: Optional[Dict[str, Any]] = None
+    trainings_max_id: Optional[int] = None
+
+
+class SQLiteBackend(StorageBackend):
+    """Usuarios en una base SQLite con WAL (lecturas concurrentes + un escritor)."""
+
+    name = "sqlite"
+
+    def __init__(self, db_path: Optional[Path | str] = None) -> None:
+        if db_path is None:
+            db_path = os.getenv("VITALPEAK_SQLITE_PATH") or DEFAULT_DB_PATH
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    # -- conexión --------------------------------------------------------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            ensure_base_dirs()
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            # Streamlit ejecuta cada sesión en su hilo: una conexión por hilo
+            conn = sqlite3.connect(str(self.db_path), timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(_SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def _resolve(self, conn: sqlite3.Connection, username: str) -> Optional[str]:
+        # Mismo criterio que el backend JSON: nombre exacto y, si no, en minúsculas
+        for cand in (username, username.lower()):
+            if conn.execute("SELECT 1 FROM users WHERE username = ?", (cand,)).fetchone():
+                return cand
+        return None
+
+    # -- StorageBackend --------------------------------------------------
+    def user_exists(self, username: str) -> bool:
+        conn = self._conn()
+        return conn.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone() is not None
+
+    def list_usernames(self) -> List[str]:
+        conn = self._conn()
+        return [r[0] for r in conn.execute("SELECT username FROM users ORDER BY username")]
+
+    def data_version(self, username: str) -> Optional[str]:
+        conn = self._conn()
+        uname = self._resolve(conn, username)
+        if uname is None:
+            return None
+        row = conn.execute("SELECT updated_at FROM users WHERE username = ?", (uname,)).fetchone()
+        return repr(row[0])
+
+    def load_user(self, username: str) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        # Una transacción de lectura: documento, hashes y tablas del mismo instante
+        conn.execute("BEGIN")
+        try:
+            return self._load(conn, username)
+        finally:
+            conn.execute("COMMIT")
+
+    def _load(self, conn: sqlite3.Connection, username: str) -> Optional[Dict[str, Any]]:
+        uname = self._resolve(conn, username)
+        if uname is None:
+            return None
+        doc_raw, sections_raw = conn.execute(
+            "SELECT doc, sections FROM users WHERE username = ?", (uname,)
+        ).fetchone()
+        try:
+            data = _LoadedDoc(json.loads(doc_raw))
+            sections: Dict[str, Any] = json.loads(sections_raw or "{}")
+        except Exception:
+            return None
+
+        if "entrenamientos" in sections:
+            rows = conn.execute(
+                "SELECT id, date, exercise, set_index, reps, weight, extra FROM trainings "
+                "WHERE username = ? ORDER BY id",
+                (uname,),
+            ).fetchall()
+            data["entrenamientos"] = [_join_row(r[1:6], _TRAINING_COLS, r[6]) for r in rows]
+            data.trainings_max_id = rows[-1][0] if rows else 0
+        if "weights" in sections:
+            data["weights"] = [
+                _join_row(r[:2], _WEIGHT_COLS, r[2])
+                for r in conn.execute(
+                    "SELECT date, weight, extra FROM weights WHERE username = ? ORDER BY id", (uname,)
+                )
+            ]
+        if "rutinas" in sections:
+            data["rutinas"] = [
+                json.loads(r[0])
+                for r in conn.execute(
+                    "SELECT data FROM routines WHERE username = ? ORDER BY position", (uname,)
+                )
+            ]
+        if "routine_plan" in sections:
+            data["routine_plan"] = {
+                r[0]: r[1]
+                for r in conn.execute(
+                    "SELECT date, routine FROM routine_plan WHERE username = ? ORDER BY date", (uname,)
+                )
+            }
+        if "objetivos" in sections:
+            row = conn.execute("SELECT data FROM goals WHERE username = ?", (uname,)).fetchone()
+            data["objetivos"] = json.loads(row[0]) if row else None
+        # Secciones sin hash guardado (tras append_training_rows): el de lo leído
+        data.sections = {
+            k: (h if h is not None or k not in data else _section_hash(data[k])) for k, h in sections.items()
+        }
+        return data
+
+    def save_user(self, username: str, data: Dict[str, Any]) -> None:
+        conn = self._conn()
+        rest = {k: v for k, v in data.items() if k not in TABLE_KEYS}
+        loaded = getattr(data, "sections", None)
+        max_id = getattr(data, "trainings_max_id", None)
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT sections FROM users WHERE username = ?", (username,)).fetchone()
+            old_sections: Dict[str, Any] = json.loads(row[0]) if row and row[0] else {}
+            sections: Dict[str, Any] = {}
+            written: Dict[str, Any] = {}
+            for key in TABLE_KEYS:
+                if key not in data:
+                    continue
+                h = _section_hash(data[key])
+                # Sin cambios respecto a lo leído (o a lo guardado, si no viene de load_user): no se toca
+                base = loaded.get(key) if loaded is not None else old_sections.get(key)
+                if base is not None and h == base and key in old_sections:
+                    sections[key] = old_sections[key]
+                    written[key] = h
+                    continue
+                if key == "entrenamientos" and max_id is not None:
+                    max_id, appended = self._write_trainings(conn, username, data[key], max_id)
+                    sections[key] = None if appended else h
+                else:
+                    self._write_section(conn, username, key, data.get(key))
+                    sections[key] = h
+                written[key] = h
+            conn.execute(
+                "INSERT INTO users(username, doc, sections, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET doc = excluded.doc, "
+                "sections = excluded.sections, updated_at = excluded.updated_at",
+                (username, _dumps(rest), _dumps(sections), time.time()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if isinstance(data, _LoadedDoc):
+            # El documento pasa a describir lo que acaba de guardar
+            data.sections = written
+            data.trainings_max_id = max_id
+
+    def append_training_rows(self, username: str, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT sections FROM users WHERE username = ?", (username,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO users(username, doc, sections, updated_at) VALUES (?, '{}', '{}', ?)",
+                    (username, time.time()),
+                )
+                sections: Dict[str, Any] = {}
+            else:
+                sections = json.loads(row[0] or "{}")
+            conn.executemany(
+                "INSERT INTO trainings(username, date, exercise, set_index, reps, weight, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(username,) + _split_row(r, _TRAINING_COLS) for r in rows],
+            )
+            # El hash ya no describe la tabla; load_user lo recalcula al leer
+            sections["entrenamientos"] = None
+            conn.execute(
+                "UPDATE users SET sections = ?, updated_at = ? WHERE username = ?",
+                (_dumps(sections), time.time(), username),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # -- secciones -------------------------------------------------------
+    def _write_trainings(
+        self, conn: sqlite3.Connection, username: str, value: Any, max_id: int
+    ) -> tuple:
+        """Reescribe las series del documento conservando, al final, las añadidas tras `max_id`.
+
+        Devuelve (id de la última serie del documento, si había series añadidas).
+        """
+        appended = conn.execute(
+            "SELECT date, exercise, set_index, reps, weight, extra FROM trainings "
+            "WHERE username = ? AND id > ? ORDER BY id",
+            (username, max_id),
+        ).fetchall()
+        self._write_section(conn, username, "entrenamientos", value)
+        last = conn.execute("SELECT MAX(id) FROM trainings WHERE username = ?", (username,)).fetchone()[0]
+        conn.executemany(
+            "INSERT INTO trainings(username, date, exercise, set_index, reps, weight, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(username,) + tuple(r) for r in appended],
+        )
+        return (last or 0), bool(appended)
+
+    def _write_section(self, conn: sqlite3.Connection, username: str, key: str, value: Any) -> None:
+        if key == "entrenamientos":
+            conn.execute("DELETE FROM trainings WHERE username = ?", (username,))
+            conn.executemany(
+                "INSERT INTO trainings(username, date, exercise, set_index, reps, weight, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(username,) + _split_row(r, _TRAINING_COLS) for r in (value or []) if isinstance(r, dict)],
+            )
+        elif key == "weights":
+            conn.execute("DELETE FROM weights WHERE username = ?", (username,))
+            conn.executemany(
+                "INSERT INTO weights(username, date, weight, extra) VALUES (?, ?, ?, ?)",
+                [(username,) + _split_row(r, _WEIGHT_COLS) for r in (value or []) if isinstance(r, dict)],
+            )
+        elif key == "rutinas":
+            conn.execute("DELETE FROM routines WHERE username = ?", (username,))
+            conn.executemany(
+                "INSERT INTO routines(username, position, name, data) VALUES (?, ?, ?, ?)",
+                [
+                    (username, i, r.get("name") if isinstance(r, dict) else None, _dumps(r))
+                    for i, r in enumerate(value or [])
+                ],
+            )
+        elif key == "routine_plan":
+            conn.execute("DELETE FROM routine_plan WHERE username = ?", (username,))
+            conn.executemany(
+                "INSERT INTO routine_plan(username, date, routine) VALUES (?, ?, ?)",
+                [(username, str(d), r) for d, r in (value or {}).items()],
+            )
+        elif key == "objetivos":
+            conn.execute("DELETE FROM goals WHERE username = ?", (username,))
+            if value is not None:
+                conn.execute("INSERT INTO goals(username, data) VALUES (?, ?)", (username, _dumps(value)))
+
+
+def migrate_json_users(
+    backend: Optional[SQLiteBackend] = None,
+    *,
+    overwrite: bool = False,
+) -> Dict[str, List[str]]:
+    """Importa usuarios_data/*.json (incluido el log de series pendiente) a SQLite.
+
+    Devuelve {"imported": [...], "skipped": [...], "failed": [...]}.
+    """
+    target = backend or SQLiteBackend()
+    source = JsonFileBackend()
+    report: Dict[str, List[str]] = {"imported": [], "skipped": [], "failed": []}
+    for username in source.list_usernames():
+        if not overwrite and target.user_exists(username):
+            report["skipped"].append(username)
+            continue
+        data = source.load_user(username)
+        if not isinstance(data, dict):
+            report["failed"].append(username)
+            continue
+        try:
+            target.save_user(username, data)
+        except Exception:
+            report["failed"].append(username)
+            continue
+        report["imported"].append(username)
+    return report
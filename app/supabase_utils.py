@@ -1,6 +1,11 @@
 from __future__ import annotations
 
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Optional
 from collections.abc import Mapping
 
@@ -90,34 +95,92 @@ def _get_secret(key: str, default: Optional[str] = None) -> Optional[str]:
     return (os.getenv(key) or default)
 
 
+# Accept common aliases: people often name this differently in secrets.
+_KEY_ALIASES = (
+    "SUPABASE_SERVICE_ROLE_KEY",
+    "SUPABASE_SERVICE_KEY",
+    "SUPABASE_SERVICE_ROLE",
+    "SUPABASE_KEY",
+    "SUPABASE_ANON_KEY",
+)
+_CONFIG_ENV_KEYS = ("SUPABASE_URL", "SUPABASE_BUCKET") + _KEY_ALIASES
+
+# Process-wide cache of the resolved config and of the client built from it.
+# The config is re-resolved when the relevant env vars or the Streamlit
+# secrets change (see _env_signature).
+_client_lock = threading.Lock()
+_config_cache: Optional[tuple[tuple, dict[str, Optional[str]]]] = None
+_client_cache: Optional[tuple[tuple[str, str], Any]] = None
+
+
+def _secrets_fingerprint() -> Optional[str]:
+    """Short hash of the current Streamlit secrets (None without Streamlit/secrets)."""
+    if st is None:
+        return None
+    try:
+        secrets = st.secrets
+        data = secrets.to_dict() if hasattr(secrets, "to_dict") else dict(secrets)
+    except Exception:
+        return None
+    return hashlib.sha256(repr(sorted(data.items(), key=lambda kv: str(kv[0]))).encode("utf-8")).hexdigest()[:16]
+
+
+def _env_signature() -> tuple:
+    return tuple(os.getenv(k) for k in _CONFIG_ENV_KEYS) + (_secrets_fingerprint(),)
+
+
+def resolve_supabase_config(refresh: bool = False) -> dict[str, Optional[str]]:
+    """URL, key and bucket from secrets/env, resolved once and cached."""
+    global _config_cache
+    sig = _env_signature()
+    with _client_lock:
+        if not refresh and _config_cache is not None and _config_cache[0] == sig:
+            return _config_cache[1]
+    key = None
+    for alias in _KEY_ALIASES:
+        key = _get_secret(alias)
+        if key:
+            break
+    cfg = {
+        "url": (_get_secret("SUPABASE_URL") or "").strip() or None,
+        "key": (key or "").strip() or None,
+        "bucket": (_get_secret("SUPABASE_BUCKET") or "").strip() or None,
+    }
+    with _client_lock:
+        _config_cache = (sig, cfg)
+    return cfg
+
+
 def get_supabase_client():
+    """Shared client for the process (built once per URL/key).
+
+    supabase-py keeps an httpx session per sub-client (postgrest, storage), so
+    reusing the client reuses its keep-alive connection pool.
+    """
+    global _client_cache
     # If dependency isn't installed (or failed import), fail gracefully.
     if create_client is None:
         return None
-    url = _get_secret("SUPABASE_URL")
-    # Accept common aliases: people often name this differently in secrets.
-    key = (
-        _get_secret("SUPABASE_SERVICE_ROLE_KEY")
-        or _get_secret("SUPABASE_SERVICE_KEY")
-        or _get_secret("SUPABASE_SERVICE_ROLE")
-        or _get_secret("SUPABASE_KEY")
-        or _get_secret("SUPABASE_ANON_KEY")
-    )
-    if not url or not key:
+    cfg = resolve_supabase_config()
+    if not cfg["url"] or not cfg["key"]:
         return None
-    return create_client(str(url).strip(), str(key).strip())
+    ident = (cfg["url"], cfg["key"])
+    with _client_lock:
+        if _client_cache is not None and _client_cache[0] == ident:
+            return _client_cache[1]
+        replaced = _client_cache is not None
+        client = create_client(cfg["url"], cfg["key"])
+        _client_cache = (ident, client)
+    if replaced:
+        # Signed URLs minted for the previous project/key are no longer valid
+        clear_signed_url_cache()
+    return client
 
 
 def supabase_config_status() -> dict[str, Any]:
     """Return a safe, non-sensitive view of whether Supabase config is present."""
-    url = _get_secret("SUPABASE_URL")
-    key = (
-        _get_secret("SUPABASE_SERVICE_ROLE_KEY")
-        or _get_secret("SUPABASE_SERVICE_KEY")
-        or _get_secret("SUPABASE_KEY")
-        or _get_secret("SUPABASE_ANON_KEY")
-    )
-    bucket = _get_secret("SUPABASE_BUCKET")
+    cfg = resolve_supabase_config()
+    url, key, bucket = cfg["url"], cfg["key"], cfg["bucket"]
     keys_present: list[str] = []
     if st is not None:
         try:
@@ -133,7 +196,7 @@ def supabase_config_status() -> dict[str, Any]:
 
 
 def get_supabase_bucket(default: str = "posture") -> str:
-    return _get_secret("SUPABASE_BUCKET", default) or default
+    return resolve_supabase_config()["bucket"] or default
 
 
 def storage_upload_bytes(
@@ -149,16 +212,125 @@ def storage_upload_bytes(
     sb.storage.from_(bucket).upload(path, data, file_opts)
 
 
+UPLOAD_WORKERS = 4
+
+
+def storage_upload_many(
+    sb,
+    bucket: str,
+    items: list[tuple[str, bytes, str]],
+    upsert: bool = True,
+    max_workers: int = UPLOAD_WORKERS,
+) -> None:
+    """Upload several (path, data, content_type) items concurrently.
+
+    Raises the first upload error after all uploads have finished.
+    """
+    if not items:
+        return
+    if len(items) == 1:
+        storage_upload_bytes(sb, bucket, *items[0], upsert=upsert)
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as pool:
+        futures = [pool.submit(storage_upload_bytes, sb, bucket, path, data, ctype, upsert) for path, data, ctype in items]
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    if errors:
+        raise errors[0]
+
+
 def storage_remove(sb, bucket: str, paths: list[str]) -> None:
     if not paths:
         return
     sb.storage.from_(bucket).remove(paths)
+    _signed_cache_invalidate(bucket, paths)
+
+
+# --- Signed URL cache ---
+# Keyed by (bucket, path, ttl). An entry is reused while at least
+# SIGNED_URL_MIN_REMAINING of its lifetime is left, so callers always get a
+# URL that stays valid for a reasonable time after rendering.
+SIGNED_URL_CACHE_SIZE = 2048
+SIGNED_URL_MIN_REMAINING = 0.5
+
+_signed_lock = threading.Lock()
+_signed_cache: "OrderedDict[tuple[str, str, int], tuple[str, float]]" = OrderedDict()
+
+
+def _signed_cache_get(bucket: str, path: str, expires_sec: int) -> Optional[str]:
+    key = (bucket, path, int(expires_sec))
+    with _signed_lock:
+        hit = _signed_cache.get(key)
+        if hit is None:
+            return None
+        url, expires_at = hit
+        if expires_at - time.monotonic() < expires_sec * SIGNED_URL_MIN_REMAINING:
+            del _signed_cache[key]
+            return None
+        _signed_cache.move_to_end(key)
+        return url
+
+
+def _signed_cache_put(bucket: str, path: str, expires_sec: int, url: str) -> None:
+    if not url:
+        return
+    with _signed_lock:
+        _signed_cache[(bucket, path, int(expires_sec))] = (url, time.monotonic() + expires_sec)
+        while len(_signed_cache) > SIGNED_URL_CACHE_SIZE:
+            _signed_cache.popitem(last=False)
+
+
+def _signed_cache_invalidate(bucket: str, paths: list[str]) -> None:
+    gone = set(paths)
+    with _signed_lock:
+        for key in [k for k in _signed_cache if k[0] == bucket and k[1] in gone]:
+            del _signed_cache[key]
+
+
+def clear_signed_url_cache() -> None:
+    with _signed_lock:
+        _signed_cache.clear()
+
+
+def _signed_url_of(item: Any) -> str:
+    # supabase-py has returned both 'signedURL' and 'signedUrl' across versions
+    if not isinstance(item, Mapping):
+        return ""
+    return str(item.get("signedURL") or item.get("signedUrl") or "")
+
+
+def storage_signed_urls(sb, bucket: str, paths: list[str], expires_sec: int = 3600) -> dict[str, str]:
+    """Signed URLs for several paths: cached ones are reused, the rest are signed in one request."""
+    out: dict[str, str] = {}
+    missing: list[str] = []
+    for p in dict.fromkeys(p for p in paths if p):
+        url = _signed_cache_get(bucket, p, expires_sec)
+        if url:
+            out[p] = url
+        else:
+            missing.append(p)
+    if not missing:
+        return out
+    store = sb.storage.from_(bucket)
+    signed: dict[str, str] = {}
+    if len(missing) > 1 and hasattr(store, "create_signed_urls"):
+        try:
+            for item in store.create_signed_urls(missing, expires_sec) or []:
+                if isinstance(item, Mapping) and item.get("path") and not item.get("error"):
+                    signed[str(item["path"])] = _signed_url_of(item)
+        except Exception:
+            signed = {}
+    for p in missing:
+        url = signed.get(p) or ""
+        if not url:
+            # Batch endpoint unavailable or path missing from its reply: sign it alone
+            url = _signed_url_of(store.create_signed_url(p, expires_sec))
+        _signed_cache_put(bucket, p, expires_sec, url)
+        out[p] = url
+    return out
 
 
 def storage_signed_url(sb, bucket: str, path: str, expires_sec: int = 3600) -> str:
-    res = sb.storage.from_(bucket).create_signed_url(path, expires_sec)
-    # supabase-py returns dict like {'signedURL': '...'}
-    return (res or {}).get("signedURL", "")
+    return storage_signed_urls(sb, bucket, [path], expires_sec).get(path, "")
 
 
 def db_insert(sb, table: str, row: dict[str, Any]) -> dict[str, Any]:
@@ -1,22 +1,44 @@
 from __future__ import annotations
-from typing import Dict, List, Optional, Tuple
-from .datastore import load_user, save_user
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from .datastore import load_user, append_training_rows, user_data_version
+from .training_stats import apply_new_rows
 
 
-def add_training_set(username: str, date_iso: str, exercise: str, set_index: int, reps: int, weight: float) -> None:
-    data = load_user(username)
-    row = {
+def _training_row(date_iso: str, exercise: str, set_index: int, reps: int, weight: float) -> Dict[str, Any]:
+    return {
         "date": date_iso,
         "exercise": exercise,
         "set": int(set_index),
         "reps": int(reps),
         "weight": float(weight),
     }
-    data.setdefault("entrenamientos", []).append(row)
-    save_user(username, data)
+
+
+def add_training_set(username: str, date_iso: str, exercise: str, set_index: int, reps: int, weight: float) -> None:
+    add_training_sets(username, [_training_row(date_iso, exercise, set_index, reps, weight)])
+
+
+def add_training_sets(username: str, rows: Iterable[Dict[str, Any]]) -> int:
+    """Registra varias series en una sola escritura. Cada fila: date, exercise, set, reps, weight.
+
+    Devuelve el número de series añadidas.
+    """
+    clean = [
+        _training_row(r["date"], r["exercise"], r.get("set", 1), r.get("reps", 0), r.get("weight", 0.0))
+        for r in rows
+    ]
+    if not clean:
+        return 0
+    prev_version = user_data_version(username)
+    # Append O(1) (log de series en JSON, INSERT en SQLite)
+    append_training_rows(username, clean)
+    # Agregados de progreso: solo se tocan los ejercicios de estas filas
+    apply_new_rows(username, clean, prev_version=prev_version)
+    return len(clean)
 
 
 def list_training(username: str) -> List[Dict]:
+    # load_user ya incluye las series pendientes del log
     data = load_user(username)
     return data.get("entrenamientos", [])
 
@@ -0,0 +1,226 @@
+"""Agregados por ejercicio y día para la página de progreso.
+
+Por cada ejercicio se guarda, día a día: mejor set (por 1RM estimado, luego
+peso, luego reps), peso máximo, 1RM máximo, series, reps y volumen. Se
+persisten en usuarios_data/stats/<user>/ (un fichero por ejercicio más un
+manifiesto con la versión de datos del usuario, ver datastore.user_data_version):
+
+- add_training_sets los actualiza de forma incremental (solo los ejercicios
+  de las filas nuevas);
+- cualquier otra escritura cambia la versión y se reconstruyen una vez.
+
+Así la página de progreso solo lee el ejercicio seleccionado, sin recorrer el
+historial completo.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from .datastore import USERS_DIR, ensure_base_dirs, load_user, user_data_version
+
+
+STATS_DIR = USERS_DIR / "stats"
+
+_lock = threading.Lock()
+
+
+def _user_dir(username: str) -> Path:
+    return STATS_DIR / username
+
+
+def _manifest_path(username: str) -> Path:
+    return _user_dir(username) / "_manifest.json"
+
+
+def _exercise_file(exercise: str) -> str:
+    return hashlib.sha1(exercise.encode("utf-8")).hexdigest()[:16] + ".json"
+
+
+def epley_1rm(weight: float, reps: int) -> float:
+    """1RM estimado (Epley). 0 si no hay peso o reps."""
+    if weight > 0 and reps > 0:
+        return float(weight) * (1.0 + float(reps) / 30.0)
+    return 0.0
+
+
+def _clean_row(row: Dict[str, Any]) -> Optional[tuple]:
+    ex = str(row.get("exercise") or "").strip()
+    if not ex or ex == "None":
+        return None
+    ds = str(row.get("date") or "")[:10]
+    try:
+        date.fromisoformat(ds)
+    except ValueError:
+        return None
+    try:
+        reps = int(row.get("reps") or 0)
+    except (TypeError, ValueError):
+        reps = 0
+    try:
+        weight = float(row.get("weight") or 0.0)
+    except (TypeError, ValueError):
+        weight = 0.0
+    try:
+        set_idx = int(row.get("set") or 0)
+    except (TypeError, ValueError):
+        set_idx = 0
+    return ex, ds, set_idx, reps, weight
+
+
+def _fold(by_exercise: Dict[str, Dict[str, Any]], rows: Iterable[Dict[str, Any]]) -> None:
+    """Suma `rows` a {ejercicio: {fecha: agregado}}."""
+    for row in rows:
+        clean = _clean_row(row)
+        if clean is None:
+            continue
+        ex, ds, set_idx, reps, weight = clean
+        rm = epley_1rm(weight, reps)
+        days = by_exercise.setdefault(ex, {})
+        d = days.get(ds)
+        if d is None:
+            d = days[ds] = {
+                "sets": 0,
+                "reps": 0,
+                "volume": 0.0,
+                "max_weight": weight,
+                "max_weight_reps": reps,
+                "max_1rm": rm,
+                "best": {"weight": weight, "reps": reps, "1rm": rm, "set": set_idx},
+            }
+        d["sets"] += 1
+        d["reps"] += reps
+        d["volume"] += weight * reps
+        if weight > d["max_weight"]:
+            d["max_weight"], d["max_weight_reps"] = weight, reps
+        if rm > d["max_1rm"]:
+            d["max_1rm"] = rm
+        b = d["best"]
+        if (rm, weight, reps) > (b["1rm"], b["weight"], b["reps"]):
+            d["best"] = {"weight": weight, "reps": reps, "1rm": rm, "set": set_idx}
+
+
+def _read_json(p: Path) -> Optional[Dict[str, Any]]:
+    if not p.exists():
+        return None
+    try:
+        data = json.loads(p.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _write_json(p: Path, payload: Dict[str, Any]) -> None:
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_name(p.name + f".tmp.{os.getpid()}")
+    tmp.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, p)
+
+
+def invalidate_stats(username: str) -> None:
+    """Descarta los agregados; se reconstruyen en la próxima lectura."""
+    try:
+        _manifest_path(username).unlink()
+    except OSError:
+        pass
+
+
+def _rebuild(username: str, version: Optional[str]) -> Dict[str, Any]:
+    data = load_user(username) or {}
+    by_exercise: Dict[str, Dict[str, Any]] = {}
+    _fold(by_exercise, data.get("entrenamientos", []) or [])
+    manifest = {"version": version, "exercises": {ex: _exercise_file(ex) for ex in by_exercise}}
+    ensure_base_dirs()
+    shutil.rmtree(_user_dir(username), ignore_errors=True)
+    try:
+        for ex, days in by_exercise.items():
+            _write_json(_user_dir(username) / manifest["exercises"][ex], {"exercise": ex, "days": days})
+        _write_json(_manifest_path(username), manifest)
+    except OSError:
+        # Es una caché: si no se puede escribir se recalcula la próxima vez
+        pass
+    manifest["_days"] = by_exercise
+    return manifest
+
+
+def _fresh_manifest(username: str) -> Dict[str, Any]:
+    version = user_data_version(username)
+    manifest = _read_json(_manifest_path(username))
+    if manifest is not None and version is not None and manifest.get("version") == version:
+        return manifest
+    return _rebuild(username, version)
+
+
+def exercises_with_data(username: str) -> List[str]:
+    """Ejercicios con al menos una serie registrada (ordenados)."""
+    with _lock:
+        return sorted(_fresh_manifest(username).get("exercises") or {})
+
+
+def exercise_days(
+    username: str,
+    exercise: str,
+    d_from: Optional[date] = None,
+    d_to: Optional[date] = None,
+) -> List[Dict[str, Any]]:
+    """Agregado por día (ordenado por fecha) de un ejercicio, opcionalmente en [d_from, d_to].
+
+    Cada fila: date, sets, reps, volume, max_weight, max_weight_reps, max_1rm, best.
+    """
+    with _lock:
+        manifest = _fresh_manifest(username)
+        if "_days" in manifest:
+            days = manifest["_days"].get(exercise) or {}
+        else:
+            fname = (manifest.get("exercises") or {}).get(exercise)
+            payload = _read_json(_user_dir(username) / fname) if fname else None
+            days = (payload or {}).get("days") or {}
+    lo = d_from.isoformat() if d_from else ""
+    hi = d_to.isoformat() if d_to else "9999-12-31"
+    return [dict(days[ds], date=ds) for ds in sorted(days) if lo <= ds <= hi]
+
+
+def apply_new_rows(username: str, rows: List[Dict[str, Any]], *, prev_version: Optional[str]) -> None:
+    """Suma filas recién añadidas a los agregados.
+
+    `prev_version` es la versión de datos antes del append; si los agregados no
+    estaban al día con ella se descartan (se reconstruirán al leerlos).
+    """
+    with _lock:
+        manifest = _read_json(_manifest_path(username))
+        if manifest is None or prev_version is None or manifest.get("version") != prev_version:
+            invalidate_stats(username)
+            return
+        files = manifest.setdefault("exercises", {})
+        by_exercise: Dict[str, Dict[str, Any]] = {}
+        for ex in {c[0] for c in map(_clean_row, rows) if c is not None}:
+            fname = files.get(ex) or _exercise_file(ex)
+            payload = _read_json(_user_dir(username) / fname) if ex in files else None
+            by_exercise[ex] = (payload or {}).get("days") or {}
+            files[ex] = fname
+        _fold(by_exercise, rows)
+        try:
+            for ex, days in by_exercise.items():
+                _write_json(_user_dir(username) / files[ex], {"exercise": ex, "days": days})
+            manifest["version"] = user_data_version(username)
+            _write_json(_manifest_path(username), manifest)
+        except OSError:
+            invalidate_stats(username)
+
+
+def pr_days(day_rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Días (ordenados) en los que se superó el mejor 1RM estimado previo."""
+    best = 0.0
+    out = []
+    for d in day_rows:
+        if d["max_1rm"] > best:
+            best = d["max_1rm"]
+            out.append(d)
+    return out
@@ -20,6 +20,7 @@ import streamlit as st
 
 from app.config import load_env, get_openai_api_key
 from app.ai_generator import call_gpt, _get_model
+from app.ai_trace import load_metrics, summarize
 from app.rules_fallback import generate_fallback
 
 try:
@@ -111,6 +112,27 @@ def _day_to_routine_items(dia: Dict[str, Any]) -> List[Dict[str, Any]]:
     return items
 
 
+def _render_day(dia: Dict[str, Any]) -> None:
+    with st.expander(str(dia.get("nombre") or "Día"), expanded=True):
+        rows = []
+        for ej in dia.get("ejercicios") or []:
+            if not isinstance(ej, dict):
+                continue
+            rows.append(
+                {
+                    "Ejercicio": ej.get("nombre", ""),
+                    "Series": ej.get("series", ""),
+                    "Reps": ej.get("reps", ""),
+                    "Descanso": ej.get("descanso", ""),
+                    "Intensidad": ej.get("intensidad", ""),
+                }
+            )
+        if rows:
+            st.dataframe(rows, use_container_width=True, hide_index=True)
+        if dia.get("notas"):
+            st.caption(f"Notas: {dia['notas']}")
+
+
 def _render_plan(plan: Dict[str, Any]) -> None:
     meta = plan.get("meta") or {}
     st.markdown(
@@ -120,24 +142,7 @@ def _render_plan(plan: Dict[str, Any]) -> None:
         f"**Objetivo:** {meta.get('objetivo', '—')}"
     )
     for dia in plan.get("dias") or []:
-        with st.expander(dia.get("nombre", "Día"), expanded=True):
-            rows = []
-            for ej in dia.get("ejercicios") or []:
-                if not isinstance(ej, dict):
-                    continue
-                rows.append(
-                    {
-                        "Ejercicio": ej.get("nombre", ""),
-                        "Series": ej.get("series", ""),
-                        "Reps": ej.get("reps", ""),
-                        "Descanso": ej.get("descanso", ""),
-                        "Intensidad": ej.get("intensidad", ""),
-                    }
-                )
-            if rows:
-                st.dataframe(rows, use_container_width=True, hide_index=True)
-            if dia.get("notas"):
-                st.caption(f"Notas: {dia['notas']}")
+        _render_day(dia)
     prog = plan.get("progresion") or {}
     if prog:
         st.markdown("#### Progresión")
@@ -148,6 +153,34 @@ def _render_plan(plan: Dict[str, Any]) -> None:
         )
 
 
+def _render_trace(trace: Dict[str, Any]) -> None:
+    """Panel de telemetría: tiempos por etapa de esta generación y resumen de las últimas."""
+    with st.expander(f"Telemetría de la generación ({trace.get('total_s', 0):.1f} s)"):
+        tokens = trace.get("tokens") or {}
+        counters = trace.get("counters") or {}
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Total", f"{trace.get('total_s', 0):.1f} s")
+        c2.metric("Tokens entrada/salida", f"{tokens.get('in', 0)}/{tokens.get('out', 0)}" + (" ~" if tokens.get("estimated") else ""))
+        c3.metric("Llamadas al modelo", counters.get("model_calls", 0), help=f"Aciertos de caché: {counters.get('cache_hits', 0)}")
+        c4.metric("Reintentos / refinados", f"{counters.get('retries', 0)} / {counters.get('refine_attempts', 0)}")
+        stages = trace.get("stages_s") or {}
+        if stages:
+            st.caption("Segundos por etapa (`refine` incluye las etapas de sus intentos)")
+            st.bar_chart({k: [v] for k, v in stages.items()})
+        errs = trace.get("validator_errors") or {}
+        if any(errs.values()):
+            final = trace.get("validator_errors_final") or {}
+            st.caption("Errores por validador (respuesta inicial → resultado)")
+            st.table([{"validador": k, "inicial": v, "final": final.get(k, 0)} for k, v in errs.items()])
+        recent = summarize(load_metrics(50))
+        if recent.get("n", 0) > 1:
+            st.caption(
+                f"Últimas {recent['n']} generaciones: p50 {recent['total_p50_s']:.1f} s · "
+                f"p95 {recent['total_p95_s']:.1f} s · éxito {recent['ok_rate']:.0%} · "
+                f"tokens medios {recent['tokens_in_mean']:.0f}/{recent['tokens_out_mean']:.0f}"
+            )
+
+
 st.title("💪 Creador de Rutinas (IA)")
 st.caption(
     "Genera un plan personalizado con Ollama (gratis, local) u OpenAI. "
@@ -221,6 +254,17 @@ with st.form("form_rutina_ia"):
         height=100,
     )
     force_fallback = st.checkbox("Forzar plan de respaldo (sin IA)", value=False)
+    best_of = st.select_slider(
+        "Candidatos en paralelo",
+        options=[1, 2, 3],
+        value=min(3, max(1, int(os.getenv("VITALPEAK_AI_BEST_OF") or 1))),
+        help="Con Ollama local, 2–3 candidatos a distintas temperaturas reducen la espera: se usa el primero que pasa todas las validaciones.",
+    )
+    skip_cache = st.checkbox(
+        "Ignorar caché (pedir una respuesta nueva al modelo)",
+        value=False,
+        help="Por defecto, si ya se generó una rutina con los mismos datos normalizados, se reutiliza al instante.",
+    )
     submitted = st.form_submit_button("Generar rutina", type="primary", use_container_width=True)
 
 if submitted:
@@ -242,6 +286,8 @@ if submitted:
     data_out: Optional[Dict[str, Any]] = None
     used_fallback = False
     error: Optional[str] = None
+    repairs: List[str] = []
+    trace: Optional[Dict[str, Any]] = None
     source = ""
 
     if force_fallback or not api_configured:
@@ -249,10 +295,22 @@ if submitted:
         data_out = generate_fallback(datos_usuario)
         source = "Plan de respaldo (sin IA)"
     else:
+        # Vista previa: cada día se pinta en cuanto el modelo lo termina de escribir
+        live_slot = st.empty()
+        live = live_slot.container()
+        live.caption("Vista previa (días según llegan del modelo):")
+
+        def _on_day(dia: Dict[str, Any]) -> None:
+            with live:
+                _render_day(dia)
+
         with st.spinner(f"Generando con {_get_model()}… (Ollama puede tardar 30 s–2 min)"):
-            result = call_gpt(datos_usuario)
+            result = call_gpt(datos_usuario, use_cache=not skip_cache, on_day=_on_day, best_of=int(best_of))
+        live_slot.empty()
+        trace = result.get("trace")
         if result.get("ok"):
             data_out = result["data"]
+            repairs = result.get("repairs") or []
             source = f"IA · {_get_model()}"
         else:
             used_fallback = True
@@ -264,6 +322,8 @@ if submitted:
     st.session_state["ia_last_source"] = source
     st.session_state["ia_last_error"] = error
     st.session_state["ia_last_fallback"] = used_fallback
+    st.session_state["ia_last_repairs"] = repairs
+    st.session_state["ia_last_trace"] = trace
 
 # Mostrar último plan generado
 plan = st.session_state.get("ia_last_plan")
@@ -277,6 +337,15 @@ if plan:
             with st.expander("Detalle del error de IA"):
                 st.code(err)
 
+    repairs = st.session_state.get("ia_last_repairs") or []
+    if repairs:
+        with st.expander(f"Ajustes automáticos aplicados ({len(repairs)})"):
+            st.markdown("\n".join(f"- {r}" for r in repairs))
+
+    trace = st.session_state.get("ia_last_trace")
+    if trace:
+        _render_trace(trace)
+
     _render_plan(plan)
 
     c1, c2, c3 = st.columns(3)
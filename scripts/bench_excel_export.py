@@ -0,0 +1,58 @@
+"""Benchmark: exportación Excel fila a fila (xlsxwriter) vs implementación anterior (pandas).
+
+Uso (desde la raíz del proyecto):
+    python scripts/bench_excel_export.py [n_series] [modo]
+"""
+
+from __future__ import annotations
+
+import datetime as _dt
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.history_io import EXCEL_MODES, export_entrenamientos_excel, export_entrenamientos_excel_pandas
+
+
+def _synthetic_history(n: int) -> list[dict]:
+    rnd = random.Random(42)
+    exercises = [f"Ejercicio {i}" for i in range(12)]
+    start = _dt.date(2020, 1, 1)
+    rows, day = [], 0
+    while len(rows) < n:
+        d = (start + _dt.timedelta(days=day)).isoformat()
+        for ex in rnd.sample(exercises, 5):
+            for s in range(1, 5):
+                rows.append({"date": d, "exercise": ex, "set": s, "reps": rnd.randint(5, 12), "weight": rnd.choice([20.0, 40.0, 60.0, 80.0])})
+        day += 2
+    return rows[:n]
+
+
+def _measure(fn, rows, modo):
+    # Tiempo y memoria en pasadas separadas: tracemalloc distorsiona los tiempos
+    t0 = time.perf_counter()
+    payload = fn(rows, modo=modo)
+    dt = time.perf_counter() - t0
+    tracemalloc.start()
+    fn(rows, modo=modo)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dt, peak, len(payload)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    modo = sys.argv[2] if len(sys.argv) > 2 else "mes"
+    if modo not in EXCEL_MODES:
+        sys.exit(f"modo debe ser uno de: {', '.join(EXCEL_MODES)}")
+    rows = _synthetic_history(n)
+    print(f"series={n} modo={modo}")
+    for name, fn in (("pandas", export_entrenamientos_excel_pandas), ("xlsxwriter", export_entrenamientos_excel)):
+        dt, peak, size = _measure(fn, rows, modo)
+        print(f"{name:10s} tiempo={dt:7.2f}s  pico_mem={peak / 1e6:7.1f} MB  tamaño={size / 1e6:6.2f} MB")
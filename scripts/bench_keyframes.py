@@ -0,0 +1,79 @@
+"""Benchmark: extracción de keyframes en una pasada (movimiento) vs seeks al 10/50/90 %.
+
+Genera un clip sintético (una barra que baja y sube: pausa arriba, bajada,
+pausa abajo, subida) y mide tiempo, pico de memoria y qué frames elige cada modo.
+
+Uso (desde la raíz del proyecto):
+    python scripts/bench_keyframes.py [segundos] [ancho]
+"""
+
+from __future__ import annotations
+
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.posture_mvp import extract_keyframes
+
+FPS = 30
+
+
+def _synthetic_clip(path: str, seconds: float, width: int) -> dict[str, int]:
+    """Escribe el clip y devuelve los frames de referencia (inicio arriba, abajo, fin arriba)."""
+    height = int(width * 9 / 16) // 2 * 2
+    n = int(seconds * FPS)
+    # Calentamiento quieto 20 %, una repetición lenta en el 60 % central, quieto 20 %
+    a, b = int(n * 0.2), int(n * 0.8)
+    bottom = (a + b) // 2
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), FPS, (width, height))
+    top_y, low_y = int(height * 0.2), int(height * 0.7)
+    for i in range(n):
+        if i < a or i > b:
+            y = top_y
+        else:
+            # coseno: velocidad nula arriba y abajo
+            phase = (i - a) / max(1, b - a)
+            y = int(top_y + (low_y - top_y) * (1 - np.cos(2 * np.pi * phase)) / 2)
+        frame = np.full((height, width, 3), 40, np.uint8)
+        cv2.rectangle(frame, (width // 4, y), (3 * width // 4, y + height // 12), (220, 220, 220), -1)
+        cv2.circle(frame, (width // 2, y + height // 6), height // 12, (180, 120, 60), -1)
+        writer.write(frame)
+    writer.release()
+    return {"start": a, "mid": bottom, "end": b}
+
+
+def _measure(path: str, mode: str):
+    t0 = time.perf_counter()
+    frames, meta = extract_keyframes(path, mode=mode)
+    dt = time.perf_counter() - t0
+    tracemalloc.start()
+    extract_keyframes(path, mode=mode)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dt, peak, meta
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 1280
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "clip.mp4")
+        truth = _synthetic_clip(path, seconds, width)
+        size = Path(path).stat().st_size
+        print(f"clip={seconds:.0f}s ancho={width}px tamaño={size / 1e6:.1f} MB referencia={truth}")
+        for mode in ("seek", "motion"):
+            dt, peak, meta = _measure(path, mode)
+            picks = meta.get("keyframe_frames") or {}
+            print(
+                f"{mode:7s} tiempo={dt:6.2f}s  pico_mem={peak / 1e6:6.1f} MB  "
+                f"método={meta.get('keyframe_method')}  frames={picks or '10/50/90 %'}"
+            )
@@ -0,0 +1,28 @@
+"""CLI: saca los keyframes base64 del historial de postura local al almacén de blobs.
+
+Uso (desde la raíz del proyecto):
+    python scripts/migrate_posture_media.py [usuario ...]
+
+Sin argumentos migra todos los usuarios. Es idempotente.
+"""
+
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.posture_mvp import migrate_all_local_keyframes, migrate_local_keyframes
+
+if __name__ == "__main__":
+    users = sys.argv[1:]
+    if users:
+        result = {u: n for u in users if (n := migrate_local_keyframes(u))}
+    else:
+        result = migrate_all_local_keyframes()
+    for user, n in result.items():
+        print(f"{user}: {n} keyframes migrados")
+    print(f"Usuarios migrados: {len(result)}")
@@ -0,0 +1,27 @@
+"""CLI: importa usuarios_data/*.json a la base SQLite (VITALPEAK_STORAGE=sqlite).
+
+Uso (desde la raíz del proyecto):
+    python scripts/migrate_to_sqlite.py [ruta.db] [--overwrite]
+"""
+
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.sqlite_store import SQLiteBackend, migrate_json_users
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    backend = SQLiteBackend(args[0] if args else None)
+    report = migrate_json_users(backend, overwrite="--overwrite" in sys.argv)
+    print(f"Base de datos: {backend.db_path.resolve()}")
+    for key in ("imported", "skipped", "failed"):
+        names = report[key]
+        print(f"{key}={len(names)} {', '.join(names)}")
+    if report["failed"]:
+        sys.exit(1)
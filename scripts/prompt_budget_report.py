@@ -0,0 +1,59 @@
+"""Tokens por sección del prompt del creador IA: forma detallada vs compacta.
+
+Uso (desde la raíz del proyecto):
+    python scripts/prompt_budget_report.py [datos.json]
+
+Sin argumento usa un perfil de ejemplo. Con tiktoken instalado los tokens son
+exactos (cl100k_base); si no, estimados por caracteres.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.ai_generator import _build_fix_prompt, analyze_user_data, build_prompt, prompt_report
+from app.prompt_budget import compare
+
+EJEMPLO = {
+    "objetivo": "hipertrofia",
+    "nivel": "intermedio",
+    "dias": 4,
+    "duracion": 60,
+    "split_pref": "PPL",
+    "evitar": "sentadilla trasera",
+    "ia_detalles": "Prioridad glúteo y hombro lateral.",
+    "comentarios": "sin poleas, máximo 7 ejercicios por sesión",
+}
+
+
+def _print_report(title: str, report: dict) -> None:
+    print(f"{title}: {report['total']} tokens ({report['chars']} caracteres)")
+    for name, n in report["sections"].items():
+        print(f"  {name:18s} {n:6d}")
+
+
+if __name__ == "__main__":
+    datos = json.loads(Path(sys.argv[1]).read_text(encoding="utf-8")) if len(sys.argv) > 1 else EJEMPLO
+    _print_report("detallado", prompt_report(datos, compact=False))
+    _print_report("compacto", prompt_report(datos, compact=True))
+    a, b, pct = compare(build_prompt(datos, compact=False), build_prompt(datos, compact=True))
+    print(f"prompt inicial: {a} → {b} tokens (-{pct:.1f}%)")
+
+    # Refinado: plan de ejemplo con tantos días como pide el usuario
+    A = analyze_user_data(datos)
+    ej = {"nombre": "Press banca", "series": 4, "reps": "6-8", "intensidad": "RIR 2", "descanso": "120s"}
+    plan = {"meta": {}, "dias": [{"nombre": d, "ejercicios": [ej] * 6, "notas": ""} for d in A["disponibilidad"]], "progresion": {}}
+    errs = ["Día 1: el último ejercicio debe empezar por 'Core:' o 'Finisher:'."]
+    os.environ["VITALPEAK_AI_PROMPT_COMPACT"] = "0"
+    verbose = _build_fix_prompt(plan, errs, build_prompt(datos, compact=False), A, datos)
+    os.environ["VITALPEAK_AI_PROMPT_COMPACT"] = "1"
+    compact = _build_fix_prompt(plan, errs, build_prompt(datos, compact=True), A, datos)
+    a, b, pct = compare(verbose, compact)
+    print(f"prompt de refinado: {a} → {b} tokens (-{pct:.1f}%)")
@@ -0,0 +1,16 @@
+"""CLI: regenera el índice email → usuario (recuperación de contraseña)."""
+
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.datastore import EMAIL_INDEX_PATH, rebuild_email_index
+
+if __name__ == "__main__":
+    n = rebuild_email_index()
+    print(f"Indexados {n} emails en {EMAIL_INDEX_PATH.resolve()}")
@@ -98,7 +98,7 @@ from app.email_utils import send_email
 from app.datastore import set_password, set_account_email, set_recovery_email, get_emails_for_user, set_profile, get_password_reset, create_password_reset, clear_password_reset
 
 from app.datastore import (
-    register_user, authenticate, load_user, save_user,
+    register_user, authenticate, load_user, save_user, user_exists, find_user_by_email,
 )
 from app.exercises import (
     list_all_exercises, add_custom_exercise, remove_custom_exercise, rename_custom_exercise,
@@ -114,7 +114,7 @@ from app.goals import (
     get_goals, save_goals,
     set_weekly_days_goal, set_target_body_weight,
     set_exercise_goal, remove_exercise_goal,
-    weekly_workout_counts, week_range,
+    weekly_workout_counts, week_range, week_streak, weekly_adherence,
 )
 from app.routines import (
     list_routines, add_routine, delete_routine, rename_routine, apply_routine
@@ -125,10 +125,13 @@ from app.today_ui import render_today_page
 def pagina_progreso():
     """Progreso de ejercicios basado en los entrenamientos guardados (usuarios_data/<user>.json).
     Muestra evolución por sesión (día) y detalle por sets, con métricas y exportación.
+    Las métricas por sesión salen de los agregados de app.training_stats (no se
+    recorre el historial completo en cada rerun).
     """
     import pandas as pd
     import streamlit as st
     from datetime import date as _date
+    from app import training_stats
 
     st.subheader("📈 Progreso de ejercicios")
 
@@ -137,32 +140,12 @@ def pagina_progreso():
         st.info("Inicia sesión para ver tu progreso.")
         return
 
-    entrenos = list_training(user)
-    if not entrenos:
+    exercises_with_data = training_stats.exercises_with_data(user)
+    if not exercises_with_data:
         st.info("Aún no tienes entrenamientos guardados. Registra alguna serie para ver el progreso aquí.")
         return
 
-    df = pd.DataFrame(entrenos)
-    # Normalizar columnas esperadas
-    for col in ["date", "exercise", "set", "reps", "weight"]:
-        if col not in df.columns:
-            df[col] = None
-
-    df["exercise"] = df["exercise"].astype(str).str.strip()
-    df["date_dt"] = pd.to_datetime(df["date"], errors="coerce")
-    df = df.dropna(subset=["date_dt"])
-    df["Fecha"] = df["date_dt"].dt.date
-    df["Set"] = pd.to_numeric(df["set"], errors="coerce").fillna(0).astype(int)
-    df["Reps"] = pd.to_numeric(df["reps"], errors="coerce").fillna(0).astype(int)
-    df["Peso"] = pd.to_numeric(df["weight"], errors="coerce").fillna(0.0).astype(float)
-
-    df = df[(df["exercise"] != "") & (df["exercise"].notna())].copy()
-    if df.empty:
-        st.info("No se encontraron registros válidos de entrenamientos.")
-        return
-
     # Selector de ejercicio (prioriza los que tienen datos)
-    exercises_with_data = sorted(df["exercise"].unique().tolist())
     all_exs = list_all_exercises(user)
     # Mezclar: primero con datos, luego el resto (por si quieres ver un ejercicio sin datos)
     merged = exercises_with_data + [e for e in all_exs if e not in set(exercises_with_data)]
@@ -187,14 +170,14 @@ def pagina_progreso():
         except Exception:
             pass
 
-    df_ex = df[df["exercise"] == selected].copy()
-    if df_ex.empty:
+    days_all = training_stats.exercise_days(user, selected)
+    if not days_all:
         st.info("Este ejercicio aún no tiene series registradas.")
         return
 
     # Rango de fechas
-    min_d = df_ex["Fecha"].min()
-    max_d = df_ex["Fecha"].max()
+    min_d = _date.fromisoformat(days_all[0]["date"])
+    max_d = _date.fromisoformat(days_all[-1]["date"])
 
     c1, c2, c3 = st.columns([1, 1, 1])
     with c1:
@@ -207,24 +190,23 @@ def pagina_progreso():
     if d_from > d_to:
         d_from, d_to = d_to, d_from
 
-    df_ex = df_ex[(df_ex["Fecha"] >= d_from) & (df_ex["Fecha"] <= d_to)].copy()
-    if df_ex.empty:
+    lo, hi = d_from.isoformat(), d_to.isoformat()
+    days = [d for d in days_all if lo <= d["date"] <= hi]
+    if not days:
         st.info("No hay registros en ese rango de fechas.")
         return
-
-    # 1RM estimado (Epley)
-    df_ex["1RM"] = df_ex.apply(lambda r: float(r["Peso"]) * (1.0 + float(r["Reps"]) / 30.0) if r["Peso"] > 0 and r["Reps"] > 0 else 0.0, axis=1)
-    df_ex["Volumen"] = df_ex["Peso"] * df_ex["Reps"]
+    # PR = sesión que supera el mejor 1RM estimado de todo el historial previo
+    pr_dates = {d["date"] for d in training_stats.pr_days(days_all)}
 
     # Métricas rápidas
-    pr_w_row = df_ex.loc[df_ex["Peso"].idxmax()] if not df_ex.empty else None
-    pr_1rm_row = df_ex.loc[df_ex["1RM"].idxmax()] if not df_ex.empty else None
-    last_day = df_ex["Fecha"].max()
+    pr_w_day = max(days, key=lambda d: d["max_weight"])
+    pr_1rm_day = max(days, key=lambda d: d["max_1rm"])
+    last_day = days[-1]["date"]
 
-    total_sessions = df_ex["Fecha"].nunique()
-    total_sets = len(df_ex)
-    total_reps = int(df_ex["Reps"].sum())
-    total_volume = float(df_ex["Volumen"].sum())
+    total_sessions = len(days)
+    total_sets = sum(d["sets"] for d in days)
+    total_reps = int(sum(d["reps"] for d in days))
+    total_volume = float(sum(d["volume"] for d in days))
 
     m1, m2, m3, m4 = st.columns(4)
     m1.metric("Sesiones", total_sessions)
@@ -233,40 +215,37 @@ def pagina_progreso():
     m4.metric("Volumen total", f"{total_volume:,.0f} kg·rep".replace(",", "."))
 
     pr1, pr2, pr3 = st.columns(3)
-    if pr_w_row is not None:
-        pr1.metric("PR Peso", f"{float(pr_w_row['Peso']):g} kg", help=f"{int(pr_w_row['Reps'])} reps — {pr_w_row['Fecha']}")
-    if pr_1rm_row is not None:
-        pr2.metric("Mejor 1RM est.", f"{float(pr_1rm_row['1RM']):.1f} kg", help=f"{float(pr_1rm_row['Peso']):g} kg x {int(pr_1rm_row['Reps'])} — {pr_1rm_row['Fecha']}")
+    pr1.metric("PR Peso", f"{float(pr_w_day['max_weight']):g} kg", help=f"{int(pr_w_day['max_weight_reps'])} reps — {pr_w_day['date']}")
+    best_rm = pr_1rm_day["best"]
+    pr2.metric("Mejor 1RM est.", f"{float(best_rm['1rm']):.1f} kg", help=f"{float(best_rm['weight']):g} kg x {int(best_rm['reps'])} — {pr_1rm_day['date']}")
     pr3.metric("Última sesión", str(last_day))
 
     st.markdown("---")
 
     if mode == "Por sesión (día)":
-        # Agregación por día
-        def _best_set(g):
-            # Devuelve set con mayor 1RM; si empate, mayor peso; si empate, mayor reps
-            gg = g.sort_values(["1RM", "Peso", "Reps"], ascending=[False, False, False])
-            return gg.iloc[0]
-
-        agg = df_ex.groupby("Fecha", as_index=False).apply(_best_set)
-        # groupby.apply crea índice compuesto; normalizar
-        if isinstance(agg.index, pd.MultiIndex):
-            agg = agg.reset_index(drop=True)
-
-        day = df_ex.groupby("Fecha", as_index=False).agg(
-            Series=("Peso", "count"),
-            Reps_tot=("Reps", "sum"),
-            Volumen=("Volumen", "sum"),
+        # Agregación por día (precalculada)
+        series = pd.DataFrame(
+            [
+                {
+                    "Fecha": _date.fromisoformat(d["date"]),
+                    "Mejor peso": float(d["best"]["weight"]),
+                    "Reps en mejor set": int(d["best"]["reps"]),
+                    "Mejor 1RM est.": float(d["best"]["1rm"]),
+                    "Series": int(d["sets"]),
+                    "Reps_tot": int(d["reps"]),
+                    "Volumen": float(d["volume"]),
+                    "PR": d["date"] in pr_dates,
+                }
+                for d in days
+            ]
         )
-        series = agg[["Fecha", "Peso", "Reps", "1RM"]].merge(day, on="Fecha", how="left").sort_values("Fecha")
-        series = series.rename(columns={"Peso": "Mejor peso", "Reps": "Reps en mejor set", "1RM": "Mejor 1RM est."})
 
         # Suavizado
         win = 3
         if smooth and len(series) >= win:
-            for col in ["Mejor peso", "Mejor 1RM est.", "Volumen"]:
-                if col in series.columns:
-                    series[col + " (MM)"] = series[col].rolling(win, min_periods=1).mean()
+            from app import analytics
+
+            series = analytics.rolling_mean(series, ["Mejor peso", "Mejor 1RM est.", "Volumen"], window=win)
 
         # Gráficas
         st.markdown("### Evolución")
@@ -289,7 +268,7 @@ def pagina_progreso():
 
         st.markdown("### Sesiones (detalle)")
         st.dataframe(
-            series[["Fecha", "Mejor peso", "Reps en mejor set", "Mejor 1RM est.", "Series", "Reps_tot", "Volumen"]],
+            series[["Fecha", "Mejor peso", "Reps en mejor set", "Mejor 1RM est.", "Series", "Reps_tot", "Volumen", "PR"]],
             use_container_width=True,
             hide_index=True,
         )
@@ -299,14 +278,32 @@ def pagina_progreso():
         st.download_button("⬇️ Descargar progreso (CSV)", data=csv1, file_name=f"progreso_{selected}.csv", mime="text/csv")
 
     else:
-        # Por set
+        # Por set: aquí sí hacen falta las series individuales, solo del ejercicio elegido
+        from app import analytics
+
+        rows = [e for e in list_training(user) if str(e.get("exercise") or "").strip() == selected]
+        df_ex = analytics.normalize_sets(rows)
+        df_ex = df_ex[(df_ex["Fecha"] >= d_from) & (df_ex["Fecha"] <= d_to)]
+        # 1RM estimado (Epley) + volumen, vectorizado
+        df_ex = analytics.add_set_metrics(df_ex)
+
         st.markdown("### Sets (filtrados)")
         show_cols = ["Fecha", "Set", "Reps", "Peso", "1RM", "Volumen"]
         st.dataframe(df_ex[show_cols].sort_values(["Fecha", "Set"]), use_container_width=True, hide_index=True)
 
         st.markdown("### Evolución por set")
-        # Preparar serie temporal: mejor peso por día (simple), y nube de sets por día (tabla + chart)
-        per_day = df_ex.groupby("Fecha", as_index=False).agg(Max_peso=("Peso","max"), Max_1RM=("1RM","max"), Volumen=("Volumen","sum")).sort_values("Fecha")
+        # Máximos por día: ya están en los agregados
+        per_day = pd.DataFrame(
+            [
+                {
+                    "Fecha": _date.fromisoformat(d["date"]),
+                    "Max_peso": float(d["max_weight"]),
+                    "Max_1RM": float(d["max_1rm"]),
+                    "Volumen": float(d["volume"]),
+                }
+                for d in days
+            ]
+        )
         st.write("**Máximo peso por día (a partir de sets)**")
         st.line_chart(per_day.set_index("Fecha")[["Max_peso"]])
 
@@ -464,22 +461,11 @@ if not logged_in or page == "Entrar":
             if st.button("Enviar enlace de recuperación", key="forgot_btn"):
                 target_user = None
                 if rec_id:
-                    try:
-                        _ = load_user(rec_id)
+                    if user_exists(rec_id):
                         target_user = rec_id
-                    except Exception:
-                        pass
-                if not target_user:
-                    import glob, json
-                    from pathlib import Path as _P
-                    for pth in glob.glob(str((_P(".") / "usuarios_data" / "*.json").resolve())):
-                        try:
-                            d = json.load(open(pth, "r", encoding="utf-8"))
-                            if d.get("recovery_email") == rec_id or d.get("email") == rec_id:
-                                target_user = _P(pth).stem
-                                break
-                        except Exception:
-                            pass
+                    else:
+                        # Índice email → usuario (sin recorrer todos los JSON)
+                        target_user = find_user_by_email(rec_id)
                 if not target_user:
                     st.info("Si existe, te llegará un correo con instrucciones.")
                 else:
@@ -939,50 +925,40 @@ elif page == "Historial":
         st.dataframe(df_filtered)
 
         # Exportar Excel consolidado (una hoja por mes/semana o todo)
-        modo = st.selectbox("Consolidar en hoja por:", ["mes","semana","todo"], index=0)
-        from io import BytesIO
-        import pandas as _pd, calendar as _cal, datetime as _dt
-        def export_entrenamientos_excel(df_in: _pd.DataFrame, modo: str = "mes") -> bytes:
-            out = BytesIO()
-            with _pd.ExcelWriter(out, engine="xlsxwriter") as writer:
-                if "date" not in df_in.columns:
-                    raise ValueError("Falta columna 'date'")
-                df_in = df_in.copy()
-                df_in["date"] = _pd.to_datetime(df_in["date"])
-                if modo == "todo":
-                    sheet_name = "Entrenamientos"; row = 0
-                    for dt, g in df_in.sort_values("date").groupby(df_in["date"].dt.date):
-                        g2 = g.sort_values(["date","exercise","set"])
-                        if sheet_name not in writer.sheets:
-                            writer.book.add_worksheet(sheet_name)
-                        ws = writer.sheets[sheet_name]
-                        ws.write(row, 0, f"Fecha: {dt.isoformat()}"); row += 1
-                        g2.to_excel(writer, sheet_name=sheet_name, index=False, startrow=row)
-                        row += len(g2) + 2
-                else:
-                    if modo == "mes":
-                        df_in["_key"] = df_in["date"].dt.strftime("%Y-%m")
-                    else:
-                        df_in["_key"] = df_in["date"].dt.strftime("%G-W%V")
-                    for key, gkey in df_in.sort_values(["_key","date"]).groupby("_key"):
-                        sheet = str(key); row = 0
-                        for dt, gday in gkey.groupby(gkey["date"].dt.date):
-                            g2 = gday.drop(columns=["_key"]).sort_values(["date","exercise","set"])
-                            if sheet not in writer.sheets:
-                                writer.book.add_worksheet(sheet)
-                            ws = writer.sheets[sheet]
-                            ws.write(row, 0, f"Fecha: {dt.isoformat()}"); row += 1
-                            g2.to_excel(writer, sheet_name=sheet, index=False, startrow=row)
-                            row += len(g2) + 2
-            return out.getvalue()
+        from app import history_io
 
+        modo = st.selectbox("Consolidar en hoja por:", list(history_io.EXCEL_MODES), index=0)
         if st.button("Exportar a Excel (consolidado)", use_container_width=True):
             try:
-                xbytes = export_entrenamientos_excel(df_filtered, modo=modo)
+                xbytes = history_io.export_entrenamientos_excel(df_filtered.to_dict("records"), modo=modo)
                 st.download_button("Descargar Excel", data=xbytes, file_name=f"entrenamientos_{modo}.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
             except Exception as e:
                 st.error(str(e))
 
+        # Exportar / importar historial completo (Parquet/Arrow o CSV si no hay pyarrow)
+        with st.expander("Exportar / importar historial completo"):
+            ds_label = st.radio("Datos", ["Entrenamientos", "Peso corporal"], horizontal=True, key="hist_io_dataset")
+            dataset = "entrenamientos" if ds_label == "Entrenamientos" else "weights"
+            fmt_opts = ["parquet", "arrow", "csv"] if history_io.has_pyarrow() else ["csv"]
+            fmt = st.selectbox("Formato", fmt_opts, index=0, key="hist_io_fmt")
+            if st.button("Preparar exportación", use_container_width=True, key="hist_io_export"):
+                payload, used = history_io.export_history_bytes(user, dataset=dataset, fmt=fmt)
+                st.download_button(
+                    "Descargar",
+                    data=payload,
+                    file_name=f"{dataset}{history_io.EXTENSIONS[used]}",
+                    mime=history_io.MIME_TYPES[used],
+                    use_container_width=True,
+                )
+            up = st.file_uploader("Importar fichero", type=[e.lstrip(".") for e in history_io.EXTENSIONS.values()], key="hist_io_upload")
+            replace = st.checkbox("Sustituir los datos actuales (si no, se añaden)", value=False, key="hist_io_replace")
+            if up is not None and st.button("Importar", use_container_width=True, key="hist_io_import"):
+                try:
+                    n = history_io.import_history(user, up, dataset=dataset, replace=replace)
+                    st.success(f"Importadas {n} filas.")
+                except Exception as e:
+                    st.error(f"No se pudo importar: {e}")
+
 
 elif page == "Objetivos":
     require_auth()
@@ -1030,6 +1006,16 @@ elif page == "Objetivos":
         st.caption("Histórico de días entrenados (últimas 8 semanas)")
         st.bar_chart(df_hist)
 
+        adh = weekly_adherence(user, weeks_back=8, anchor=date.today())
+        k1, k2 = st.columns(2)
+        k1.metric("Racha", f"{week_streak(user, anchor=date.today())} semanas", help="Semanas seguidas cumpliendo el objetivo")
+        if adh["pct_weeks"] is not None:
+            k2.metric(
+                "Cumplimiento (8 semanas)",
+                f"{adh['weeks_met']}/{adh['weeks']} semanas",
+                help=f"{adh['pct_days']:.0f}% de los días objetivo",
+            )
+
     st.markdown("---")
 
     st.subheader("⚖️ Peso objetivo")
@@ -1125,11 +1111,15 @@ elif page == "Objetivos":
     if not ex_goals:
         st.info("Aún no tienes objetivos por ejercicio. Añade alguno arriba.")
     else:
+        from app import analytics
+
+        # Última serie de todos los ejercicios con objetivo en una sola pasada
+        last_by_ex = analytics.last_values(list_training(user), list(ex_goals.keys()))
         rows = []
         for ex_name, meta in sorted(ex_goals.items(), key=lambda x: x[0].lower()):
             t_w = meta.get("peso")
             t_r = meta.get("reps")
-            last = last_values_for_exercise(user, ex_name)
+            last = last_by_ex.get(ex_name)
             last_r, last_w = (None, None)
             if last:
                 last_r, last_w = last
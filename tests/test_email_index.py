@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from app import datastore as ds
+
+
+@pytest.fixture
+def users_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(ds, "USERS_DIR", tmp_path)
+    monkeypatch.setattr(ds, "EMAIL_INDEX_PATH", tmp_path / ".email_index.json")
+    monkeypatch.setattr(ds, "_email_index", None)
+    monkeypatch.setattr(ds, "_email_index_sig", None)
+    ds.clear_user_cache()
+    ds.set_storage_backend(ds.JsonFileBackend())
+    yield tmp_path
+    ds.set_storage_backend(None)
+    ds.clear_user_cache()
+
+
+def _write_legacy_user(users_dir, username, email):
+    # Usuario creado antes de que existiera el índice
+    data = ds.new_user_data(email=email)
+    (users_dir / f"{username}.json").write_text(json.dumps(data), encoding="utf-8")
+
+
+def test_existing_users_without_index_stay_reachable(users_dir):
+    _write_legacy_user(users_dir, "olduser", "old@x.com")
+    assert not ds.EMAIL_INDEX_PATH.exists()
+
+    assert ds.register_user("newuser", "pw", "new@x.com")
+
+    assert ds.find_user_by_email("old@x.com") == "olduser"
+    assert ds.find_user_by_email("NEW@x.com") == "newuser"
+
+
+def test_lookup_miss_rebuilds_stale_index(users_dir):
+    assert ds.register_user("newuser", "pw", "new@x.com")
+    _write_legacy_user(users_dir, "olduser", "old@x.com")
+
+    assert ds.find_user_by_email("old@x.com") == "olduser"
+    assert ds.find_user_by_email("nobody@x.com") is None